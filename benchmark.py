@@ -1,15 +1,34 @@
 #!/usr/bin/env python3
 
+import argparse
+import datetime
 import itertools
+import json
 import logging
 import logging.handlers
+import math
 import multiprocessing as mp
-import queue
+import os
+import platform
+import random
+import resource
 import statistics as stat
+import subprocess
+import sys
 import time
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 import osmreader
 import planners
+import synthetic
+
+# Sections in benchmark.osm between which routes are planned
+BENCHMARK_SECTIONS = ['6398654_5', '6455545_1', '6394116_3', '6398167_0', '6394550_1',
+                      '6454161_1', '6389831_0']
 
 def setup_logging():
     logger = logging.getLogger()
@@ -28,114 +47,620 @@ def setup_logging():
     logger.addHandler(ch)
     logger.addHandler(fh)
 
-def Astar_worker(graph, taskqueue, resultqueue, logqueue):
-    # Set up logging to use the queue
+def load_graph(filename="benchmark.osm", traversal=False):
+    """Returns the CSR graph of an OSM file
+
+    The graph is memory mapped from the snapshot next to the OSM file.
+    When there is no snapshot or the OSM file changed since it was made
+    the graph is built again and a new snapshot is written. The graph is
+    always returned mapped, so worker processes that receive it map the
+    same file instead of copying it.
+
+    Params:
+    filename - The OSM file
+    traversal - Return the traversal graph instead of the section graph,
+                see DirectionalGraphBuilder.build_traversal_graph()
+    """
+    logger = logging.getLogger('load_graph')
+    snapshot = filename + ('.traversal.graph' if traversal else '.graph')
+    try:
+        return planners.load_snapshot(snapshot, filename)
+    except FileNotFoundError:
+        logger.info("No snapshot of %s found, building the graph", filename)
+    except ValueError as e:
+        logger.info("%s, building the graph", e)
+
+    osm = osmreader.MultiReader(filename)
+    osm.filter_unused_nodes(True)
+    osm.find_bounds()
+    builder = osmreader.DirectionalGraphBuilder(osm.nodes, osm.ways)
+    builder.build()
+    graph = planners.CSRGraph.from_digraph(builder.build_traversal_graph() if traversal else builder.graph)
+    graph.bounds = (osm.min_lat, osm.max_lat, osm.min_lon, osm.max_lon)
+    planners.save_snapshot(graph, snapshot, filename)
+    return planners.load_snapshot(snapshot)
+
+def benchmark_sections(graph, count=len(BENCHMARK_SECTIONS), seed=0):
+    """Returns the numbers of the sections to plan routes between
+
+    These are BENCHMARK_SECTIONS when the graph has all of them,
+    otherwise count sections picked at random with a fixed seed, so any
+    map can be benchmarked and repeated runs use the same routes.
+    """
+    if all(name in graph.ids for name in BENCHMARK_SECTIONS):
+        return [ graph.index(name) for name in BENCHMARK_SECTIONS ]
+    logging.getLogger('benchmark_sections').info("Picking %d random sections", count)
+    sections = graph.nodes()
+    if graph.traversal:
+        # Routes start at the section nodes, not at their traversals
+        sections = [ s for s in sections if osmreader.traversal_sections([graph.name(s)])[0] == graph.name(s) ]
+    return random.Random(seed).sample(sections, min(count, len(sections)))
+
+def route_length(graph, path):
+    """Returns the length of a route through a CSR graph, inf if there is none"""
+    if not path:
+        return math.inf
+    return sum(graph.length[section] for section in path[:-1])
+
+def check_route_lengths(graph, routes, reference):
+    """Raises a ValueError when two planners found routes of different lengths
+
+    Timing planners against each other only makes sense when they solve
+    the same problem.
+
+    Params:
+    graph - The CSR graph the routes were planned in
+    routes - The routes found by the planner that is checked
+    reference - The routes found by another planner for the same pairs
+    """
+    for path, expected in zip(routes, reference):
+        length = route_length(graph, path)
+        expected_length = route_length(graph, expected)
+        if not math.isclose(length, expected_length, rel_tol=1e-9, abs_tol=1e-6):
+            raise ValueError("A route from {} to {} is {} m long instead of {} m".format(
+                             graph.name(expected[0]), graph.name(expected[-1]), length, expected_length))
+
+def worker_memory():
+    """Returns the proportional set size of this process in KiB
+
+    Pages shared with other processes, like those of a memory mapped
+    graph, are divided over the processes that use them, so the sum
+    over all workers is their real memory use. Falls back to the peak
+    resident set size where /proc is not available.
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# The graph of a benchmark pool process and when it was ready, set by
+# init_worker()
+_worker_graph = None
+_worker_startup = None
+
+def init_worker(graph, created, logqueue):
+    """Initialises a process of the benchmark pool
+
+    The graph is mapped from its snapshot when the process starts, see
+    CSRGraph.__reduce_ex__. Logs are sent to the QueueListener of the
+    main process.
+    """
+    global _worker_graph, _worker_startup
+    _worker_graph = graph
+    _worker_startup = time.time() - created
     h = logging.handlers.QueueHandler(logqueue)
     root = logging.getLogger()
     root.handlers = []
     root.addHandler(h)
+    logging.getLogger('A*_worker').info("Starting A* benchmark subprocess")
 
-    logger = logging.getLogger('A*_worker')
-    logger.info("Starting A* benchmark subprocess")
+def Astar_worker(tasks):
+    """Plans a chunk of routes in a pool process
 
-    for id, start, end in iter(taskqueue.get, None):
+    Returns the statistics of every route, the time spent on the whole
+    chunk, and the pid, startup time and memory of the process.
+    """
+    chunk_time = time.perf_counter()
+    graph = _worker_graph
+    results = []
+    for id, start, end in tasks:
         # Run A* and record its runtime
         start_time = time.perf_counter()
         path, open_set, closed_set = planners.Astar(graph, start, end, True)
         time_taken = time.perf_counter() - start_time
-        # Create the statistics and report them to the main process
-        length = sum([ graph.node_attributes(section)['length'] for section in path ])
-        data = (id, start, end, 0, len(path), length, len(open_set), len(closed_set), time_taken)
-        resultqueue.put(data)
-        # Report that we have finished the benchmark
-        taskqueue.task_done()
-    # Notify that we processed the stop signal
-    taskqueue.task_done()
-    logger.info("Exiting A* benchmark subprocess")
-
-def process_subprocess_logs(logqueue):
-    try:
-        while True:
-            record = logqueue.get_nowait()
-            logger = logging.getLogger(record.name)
-            logger.handle(record)
-    except queue.Empty:
-        pass
-
-def process_result_queue(resultqueue, logs):
-    try:
-        while True:
-            record = resultqueue.get_nowait()
-            logs.append(record)
-    except queue.Empty:
-        pass
+        # Random sections of a map are not always connected, a missing
+        # route is recorded with an infinite length
+        path = path or []
+        length = route_length(graph, path)
+        results.append((id, start, end, 0, len(path), length, len(open_set), len(closed_set), time_taken))
+    return results, time.perf_counter() - chunk_time, os.getpid(), _worker_startup, worker_memory()
 
-def Astar_benchmark(runs=20):
+def Astar_benchmark(runs=20, filename="benchmark.osm", sections=None, process_count=None,
+                    chunks_per_process=4):
     logger = logging.getLogger('A*_benchmark')
 
     logger.info("Setting up A* benchmark")
-    osm = osmreader.MultiReader("benchmark.osm")
-    osm.filter_unused_nodes(True)
-    osm.find_bounds()
-    graph = osmreader.DirectionalGraphBuilder(osm.nodes, osm.ways)
-    graph.build()
+    graph = load_graph(filename)
 
     # Generate paths starts
-    sections = ['6398654_5', '6455545_1', '6394116_3', '6398167_0', '6394550_1',
-                '6454161_1', '6389831_0']
+    if sections is None:
+        sections = benchmark_sections(graph)
+    else:
+        sections = [ graph.index(s) for s in sections ]
     paths = list(itertools.permutations(sections, 2))
-    logs = []
-
-    # Set up for the subprocesses
-    taskqueue = mp.JoinableQueue()
-    resultqueue = mp.Queue()
-    logqueue = mp.Queue()
+    tasks = [ (j, start, end) for j, (start, end) in
+              enumerate((start, end) for start, end in paths for i in range(runs)) ]
     # Use all cores but leave one for the main process
-    process_count = max(2, mp.cpu_count() - 2)
-
-    # Start the subprocesses before adding the tasks so they can get
-    # started right away before we added several thousand (or more)
-    # items to the task queue
-    processes = [mp.Process(target=Astar_worker, args=(graph.graph, taskqueue, resultqueue, logqueue)) for i in range(process_count)]
-    for p in processes:
-        p.start()
+    if process_count is None:
+        process_count = max(2, mp.cpu_count() - 2)
+    # A few chunks per process balance the load without sending every
+    # task on its own
+    size = max(1, math.ceil(len(tasks) / (process_count * chunks_per_process)))
+    chunks = [ tasks[i:i+size] for i in range(0, len(tasks), size) ]
 
-    # Add the tasks and process logs and results until we are done
-    logger.info("Creating benchmarks to run")
+    # Handle the logs of the pool processes as they arrive
+    logqueue = mp.Queue()
+    listener = logging.handlers.QueueListener(logqueue, *logging.getLogger().handlers,
+                                              respect_handler_level=True)
+    listener.start()
+    logger.info("Running %d benchmarks in %d chunks on %d processes", len(tasks), len(chunks), process_count)
+    logs = []
+    chunk_times = []
+    workers = {}
     total_time = time.perf_counter()
-    j = 0 # benchmark number counter
-    for start, end in paths:
-        process_subprocess_logs(logqueue)
-        for i in range(runs):
-            taskqueue.put((j, start, end))
-            j += 1
-    for i in range(process_count):
-        taskqueue.put(None)
-
-    while taskqueue.qsize() > process_count * 2:
-        process_subprocess_logs(logqueue)
-        process_result_queue(resultqueue, logs)
-        time.sleep(1) # Allow the CPU some rest
-
-    # Wait for all processes to finish and process results one final time
-    taskqueue.join()
-    process_subprocess_logs(logqueue)
-    for p in processes:
-        p.join()
-    process_result_queue(resultqueue, logs)
-    process_subprocess_logs(logqueue)
-    logger.info("Finished running benchmarks, total time spend: %f sec", time.perf_counter() - total_time)
+    try:
+        with mp.Pool(process_count, init_worker, (graph, time.time(), logqueue)) as pool:
+            # Collect the results of every chunk as soon as it is done
+            for results, chunk_time, pid, startup, memory in pool.imap_unordered(Astar_worker, chunks):
+                logs.extend(results)
+                chunk_times.append(chunk_time)
+                workers[pid] = (startup, memory)
+            total_time = time.perf_counter() - total_time
+    finally:
+        listener.stop()
+    logger.info("Finished running benchmarks, total time spend: %f sec", total_time)
+
+    # The time the planners take when the processes are evenly loaded,
+    # everything else is spent by the harness
+    planner_time = sum(r[8] for r in logs)
+    overhead = total_time - planner_time / process_count
+    logger.info("Harness overhead: %f sec (%.1f%% of the total, %.3f ms per task), in chunks: %f sec",
+                overhead, 100 * overhead / total_time, 1000 * overhead / len(tasks),
+                sum(chunk_times) - planner_time)
+    logger.info("Worker startup: %f sec on average, memory of %d workers: %d KiB (main process %d KiB)",
+                stat.mean(w[0] for w in workers.values()), len(workers),
+                sum(w[1] for w in workers.values()), worker_memory())
 
     logger.info("Generating A* sum statistics")
     logsT = list(zip(*logs)) # Transpose logs
+    # Only routes that were found have a meaningful length
+    found = [ r for r in logs if r[5] != math.inf ]
+    if len(found) < len(logs):
+        logger.info("No route was found for %d of %d benchmarks", len(logs) - len(found), len(logs))
     logger.info("                 |     Mean    |    Median   |   St. Dev.")
-    logger.info("Path length      | {:11.4f} | {:11.4f} | {:11.4f}".format(stat.mean(logsT[4]), stat.median(logsT[4]), stat.stdev(logsT[4])))
-    logger.info("Route length (m) | {:11.4f} | {:11.4f} | {:11.4f}".format(stat.mean(logsT[5]), stat.median(logsT[5]), stat.stdev(logsT[5])))
+    if len(found) > 1:
+        foundT = list(zip(*found))
+        logger.info("Path length      | {:11.4f} | {:11.4f} | {:11.4f}".format(stat.mean(foundT[4]), stat.median(foundT[4]), stat.stdev(foundT[4])))
+        logger.info("Route length (m) | {:11.4f} | {:11.4f} | {:11.4f}".format(stat.mean(foundT[5]), stat.median(foundT[5]), stat.stdev(foundT[5])))
     logger.info("Open set         | {:11.4f} | {:11.4f} | {:11.4f}".format(stat.mean(logsT[6]), stat.median(logsT[6]), stat.stdev(logsT[6])))
     logger.info("Closed set       | {:11.4f} | {:11.4f} | {:11.4f}".format(stat.mean(logsT[7]), stat.median(logsT[7]), stat.stdev(logsT[7])))
     logger.info("Run time (s)     | {:11.4f} | {:11.4f} | {:11.4f}".format(stat.mean(logsT[8]), stat.median(logsT[8]), stat.stdev(logsT[8])))
     logger.info("Total time spend in A*: %f sec", sum(logsT[8]))
 
+def CH_benchmark(runs=20, filename="benchmark.osm", sections=None):
+    logger = logging.getLogger('CH_benchmark')
+
+    logger.info("Setting up contraction hierarchy benchmark")
+    # The hierarchy needs a traversal graph, A* plans in the same graph
+    # so both solve the same problem
+    graph = load_graph(filename, traversal=True)
+    if sections is None:
+        sections = benchmark_sections(graph)
+    else:
+        sections = [ graph.index(s) for s in sections ]
+    paths = [ (start, graph.index(osmreader.traversal_goal(graph.name(end))))
+              for start, end in itertools.permutations(sections, 2) ]
+
+    ch = planners.ContractionHierarchy(graph)
+    ch.build()
+    edges = len(graph.targets)
+    logger.info("Preprocessing time: %f sec", ch.build_time)
+    logger.info("Shortcuts added: %d (%.2f per original edge)", ch.shortcuts, ch.shortcuts / max(1, edges))
+
+    heuristic = planners.CrowFliesHeuristic(graph)
+    check_route_lengths(graph, [ ch.query(start, end) for start, end in paths ],
+                        [ planners.Astar(graph, start, end, heuristic=heuristic) for start, end in paths ])
+
+    # Run the queries in this process so both planners are timed equally
+    astar_times = []
+    ch_times = []
+    for start, end in paths:
+        for i in range(runs):
+            start_time = time.perf_counter()
+            planners.Astar(graph, start, end, heuristic=heuristic)
+            astar_times.append(time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            ch.query(start, end)
+            ch_times.append(time.perf_counter() - start_time)
+
+    logger.info("                 |     Mean    |    Median   |   St. Dev.")
+    logger.info("A* run time (s)  | {:11.6f} | {:11.6f} | {:11.6f}".format(stat.mean(astar_times), stat.median(astar_times), stat.stdev(astar_times)))
+    logger.info("CH run time (s)  | {:11.6f} | {:11.6f} | {:11.6f}".format(stat.mean(ch_times), stat.median(ch_times), stat.stdev(ch_times)))
+    logger.info("Query speedup: %.2fx", sum(astar_times) / sum(ch_times))
+    # Preprocessing pays off after this many queries
+    saved = (sum(astar_times) - sum(ch_times)) / len(ch_times)
+    if saved > 0:
+        logger.info("Preprocessing pays off after %d queries", math.ceil(ch.build_time / saved))
+
+def Build_benchmark(filename="benchmark.osm", runs=3, processes=None):
+    logger = logging.getLogger('Build_benchmark')
+
+    logger.info("Setting up graph build benchmark")
+    osm = osmreader.MultiReader(filename)
+    osm.filter_unused_nodes(True)
+    if processes is None:
+        processes = sorted(set((1, 2, mp.cpu_count())))
+    results = []
+    for count in processes:
+        times = []
+        split_times = []
+        for i in range(runs):
+            # Building counts the sections of every way, start from scratch
+            for way in osm.ways.values():
+                way.sections = 0
+            builder = osmreader.DirectionalGraphBuilder(osm.nodes, osm.ways, processes=count)
+            builder.build()
+            times.append(builder.build_time)
+            split_times.append(builder.split_time)
+        results.append((count, times, split_times))
+    sections = len(builder.graph.nodes())
+    logger.info("Built %d sections from %d ways and %d nodes on %d cores", sections, len(osm.ways),
+                len(osm.nodes), mp.cpu_count())
+    logger.info("Processes |  Build (s)  |  Split (s)  | Speedup | Sections/sec")
+    serial = stat.median(results[0][1])
+    for count, times, split_times in results:
+        logger.info("{:9d} | {:11.4f} | {:11.4f} | {:7.2f} | {:12.0f}".format(count, stat.median(times),
+                    stat.median(split_times), serial / stat.median(times), sections / stat.median(times)))
+
+def reader_worker(reader, filename, resultqueue):
+    """Loads a file with a reader and reports the time and peak memory
+
+    Ran in a fresh process so the peak memory of earlier runs does not
+    count. The peak of the parser subprocesses of MultiReader is
+    reported separately.
+    """
+    start_time = time.perf_counter()
+    if reader == 'MultiReader':
+        osm = osmreader.MultiReader(filename)
+        nodes, ways = len(osm.nodes), len(osm.ways)
+    else:
+        osm = osmreader.ExpatReader(filename, two_pass=(reader == 'Two pass'))
+        nodes, ways = len(osm.node_ids), len(osm.way_ids)
+    time_taken = time.perf_counter() - start_time
+    # ru_maxrss is in KiB on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    resultqueue.put((time_taken, rss, child_rss, nodes, ways))
+
+def Reader_benchmark(filenames=("graphtest.osm", "benchmark.osm"), runs=3):
+    logger = logging.getLogger('Reader_benchmark')
+
+    resultqueue = mp.Queue()
+    for filename in filenames:
+        if not os.path.exists(filename):
+            logger.warning("Skipping %s, the file does not exist", filename)
+            continue
+        logger.info("Benchmarking readers on %s (%.1f MiB)", filename, os.path.getsize(filename) / 2**20)
+        logger.info("Reader      |  Time (s)  | Peak main (MiB) | Peak parser (MiB) |   Nodes   |   Ways")
+        for reader in ('MultiReader', 'ExpatReader', 'Two pass'):
+            results = []
+            for i in range(runs):
+                p = mp.Process(target=reader_worker, args=(reader, filename, resultqueue))
+                p.start()
+                results.append(resultqueue.get())
+                p.join()
+            time_taken = stat.median(r[0] for r in results)
+            rss = max(r[1] for r in results) / 1024
+            child_rss = max(r[2] for r in results) / 1024
+            nodes, ways = results[0][3:]
+            logger.info("{:11} | {:10.4f} | {:15.1f} | {:17.1f} | {:9d} | {:7d}".format(
+                reader, time_taken, rss, child_rss, nodes, ways))
+
+def environment():
+    """Returns a dict that describes the machine and code the benchmarks ran on"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': mp.cpu_count(),
+        'numpy': np.__version__ if np is not None else None,
+        'commit': commit,
+    }
+
+def measure(info, step, function, runs, setup=None, check=None):
+    """Times a step of the suite benchmark
+
+    Returns the record of the step and the result of the last run. When
+    the step raises an exception the error is recorded instead of the
+    times and the result is None.
+
+    Params:
+    info - The fields that describe the map, copied to the record
+    step - The name of the step
+    function - The function to time, called with the result of setup
+               when it is given
+    runs - The amount of times to run the function
+    setup - A function that prepares every run, it is not timed
+    check - A function that is called with the result of the last run,
+            it raises a ValueError when the result is wrong
+    """
+    logger = logging.getLogger('Suite_benchmark')
+    times = []
+    result = None
+    try:
+        for i in range(runs):
+            if setup is None:
+                start_time = time.perf_counter()
+                result = function()
+            else:
+                argument = setup()
+                start_time = time.perf_counter()
+                result = function(argument)
+            times.append(time.perf_counter() - start_time)
+        if check is not None:
+            check(result)
+    except Exception as e:
+        logger.warning("%s failed on %s %d: %s", step, info['map'], info['size'], e)
+        return dict(info, step=step, runs=len(times), error='{}: {}'.format(type(e).__name__, e)), None
+    record = dict(info, step=step, runs=runs, median=stat.median(times), mean=stat.mean(times),
+                  stdev=stat.stdev(times) if runs > 1 else 0.0, min=min(times))
+    logger.info("{:8} {:4d} | {:20} | {:11.6f}".format(info['map'], info['size'], step, record['median']))
+    return record, result
+
+def _reachable_pairs(graph, count, seed=0):
+    """Returns up to count random pairs of sections with a route between them"""
+    rng = random.Random(seed)
+    sections = graph.nodes()
+    pairs = []
+    for i in range(count * 10):
+        if len(pairs) == count:
+            break
+        start, end = rng.sample(sections, 2)
+        if planners.Astar(graph, start, end):
+            pairs.append((start, end))
+    return pairs
+
+def _suite_map(map_name, size, filename, runs, queries, directory, skip):
+    """Runs the suite benchmark on one map
+
+    Returns the records of all steps. Steps in skip are recorded as
+    skipped without running them.
+    """
+    info = {'map': map_name, 'size': size}
+    records = []
+
+    def step(name, function, setup=None, count=1, check=None):
+        if name in skip:
+            records.append(dict(info, step=name, skipped=True))
+            return None
+        record, result = measure(info, name, function, runs, setup, check)
+        record['count'] = count
+        records.append(record)
+        return result
+
+    def loaded():
+        return osmreader.MultiReader(filename)
+
+    def filtered():
+        osm = loaded()
+        osm.filter_unused_nodes(True)
+        osm.find_bounds()
+        return osm
+
+    def build(osm):
+        # Building counts the sections of every way, start from scratch
+        for way in osm.ways.values():
+            way.sections = 0
+        builder = osmreader.DirectionalGraphBuilder(osm.nodes, osm.ways)
+        builder.build()
+        return builder
+
+    step('load', loaded)
+    step('filter', lambda osm: osm.filter_unused_nodes(True), setup=loaded)
+    osm = filtered()
+    builder = step('build', build, setup=lambda: osm)
+    if builder is None:
+        builder = build(osm)
+    graph = step('csr', lambda: planners.CSRGraph.from_digraph(builder.graph))
+    if graph is None:
+        graph = planners.CSRGraph.from_digraph(builder.graph)
+    info.update(nodes=len(osm.nodes), ways=len(osm.ways), sections=len(graph.nodes()))
+    for record in records:
+        record.update(info)
+
+    # Plan the same random routes with every planner
+    pairs = _reachable_pairs(graph, queries)
+    count = len(pairs)
+    heuristic = planners.CrowFliesHeuristic(graph)
+    step('astar', lambda: [ planners.Astar(graph, s, e, heuristic=heuristic) for s, e in pairs ], count=count)
+    step('bidirectional', lambda: [ planners.bidirectional_search(graph, s, e) for s, e in pairs ], count=count)
+    step('ida_star', lambda: [ planners.ida_star(graph, s, e) for s, e in pairs ], count=count)
+    step('iterative_deepening', lambda: [ planners.iterative_deepening(graph, s, e) for s, e in pairs ],
+         count=count)
+
+    def landmarks():
+        lm = planners.LandmarkHeuristic(graph, base=heuristic)
+        lm.build()
+        return lm
+    lm = step('landmarks_build', landmarks)
+    if lm is not None:
+        step('astar_landmarks', lambda: [ planners.Astar(graph, s, e, heuristic=lm) for s, e in pairs ],
+             count=count)
+
+    # The hierarchy only works on the traversal graph, compare it with A*
+    # in that graph
+    traversal = step('traversal', lambda: planners.CSRGraph.from_digraph(builder.build_traversal_graph()))
+    if traversal is not None:
+        traversal_pairs = [ (traversal.index(graph.name(s)),
+                             traversal.index(osmreader.traversal_goal(graph.name(e)))) for s, e in pairs ]
+        traversal_heuristic = planners.CrowFliesHeuristic(traversal)
+        routes = step('astar_traversal', lambda: [ planners.Astar(traversal, s, e, heuristic=traversal_heuristic)
+                                                   for s, e in traversal_pairs ], count=count)
+
+        def hierarchy():
+            ch = planners.ContractionHierarchy(traversal)
+            ch.build()
+            return ch
+        ch = step('ch_build', hierarchy)
+        if ch is not None and routes is not None:
+            step('ch_query', lambda: [ ch.query(s, e) for s, e in traversal_pairs ], count=count,
+                 check=lambda result: check_route_lengths(traversal, result, routes))
+    origins = [ s for s, e in pairs ]
+    targets = [ e for s, e in pairs ]
+    step('distance_matrix', lambda: planners.distance_matrix(graph, origins, targets), count=count * count)
+
+    # The exporters draw the pygraph digraph, like main.py does
+    bounds = (osm.min_lat, osm.max_lat, osm.min_lon, osm.max_lon)
+    prefix = os.path.join(directory, '{}-{}-'.format(map_name, size))
+    step('export_map', lambda: osmreader.MapImageExporter(osm.nodes, osm.ways, *bounds).export(prefix + 'map.png'))
+    step('export_graph', lambda: osmreader.GraphMapExporter(builder.graph, *bounds).export(prefix + 'graph.png'))
+    if pairs:
+        start, end = (graph.name(section) for section in pairs[0])
+        path, open_set, closed_set = planners.Astar(builder.graph, start, end, True)
+        step('export_path', lambda: planners.GraphPathExporter(builder.graph, path, *bounds).export(
+             prefix + 'path.png'))
+        step('export_astar', lambda: planners.GraphAstarExporter(builder.graph, path, open_set, closed_set,
+             *bounds).export(prefix + 'astar.png'))
+    step('export_dot', lambda: osmreader.graph_to_file(builder.graph, prefix + 'dot.png'))
+    return records
+
+def compare_results(results, baseline, threshold=0.2, min_time=0.001):
+    """Compares suite benchmark records with those of a baseline
+
+    Records are matched on their map, size and step. Every matched
+    record gets the median of the baseline, the relative change and
+    whether it is a regression: slower than the baseline by more than
+    threshold. Steps that take less than min_time in both are never
+    regressions, their timings are mostly noise.
+
+    Returns the records that regressed.
+
+    Params:
+    results - The records of the suite benchmark
+    baseline - The records of an earlier run
+    threshold - The relative slowdown that counts as a regression
+    min_time - The median in seconds below which changes are ignored
+    """
+    logger = logging.getLogger('compare_results')
+    previous = { (r['map'], r['size'], r['step']): r['median'] for r in baseline if 'median' in r }
+    regressions = []
+    for record in results:
+        key = (record['map'], record['size'], record['step'])
+        if 'median' not in record or key not in previous:
+            continue
+        record['baseline'] = previous[key]
+        record['change'] = record['median'] / previous[key] - 1 if previous[key] > 0 else 0.0
+        record['regression'] = record['change'] > threshold and max(record['median'], previous[key]) >= min_time
+        if record['regression']:
+            regressions.append(record)
+            logger.warning("Regression in %s on %s %d: %f sec, was %f sec (%+.1f%%)", record['step'],
+                           record['map'], record['size'], record['median'], previous[key],
+                           100 * record['change'])
+    logger.info("Compared %d steps with the baseline, %d regressions above %.0f%%",
+                sum('baseline' in r for r in results), len(regressions), 100 * threshold)
+    return regressions
+
+def Suite_benchmark(sizes=(10, 20, 40), maps=tuple(synthetic.GENERATORS), runs=3, queries=10,
+                    output='benchmark-results.json', baseline=None, threshold=0.2,
+                    directory='benchmark-maps', max_step_time=30.0):
+    """Benchmarks every stage of mapbots on synthetic maps of growing size
+
+    For every map generator and size a map is written to directory and
+    loading, filtering, building, every planner and every exporter are
+    timed. A step of which the median exceeds max_step_time is skipped
+    on the larger maps of the same kind. The results are written as
+    JSON with a description of the environment, so they can be plotted
+    as scaling curves or used as the baseline of a later run.
+
+    Returns the regressions compared with the baseline.
+
+    Params:
+    sizes - The sizes of the maps, see synthetic
+    maps - The names of the generators in synthetic.GENERATORS
+    runs - The amount of times every step is timed
+    queries - The amount of routes every planner plans per run
+    output - The file to write the JSON results to
+    baseline - A JSON results file of an earlier run to compare with
+    threshold - The relative slowdown that counts as a regression
+    directory - The directory for the generated maps and images
+    max_step_time - The median in seconds after which a step is no
+                    longer run on larger maps
+    """
+    logger = logging.getLogger('Suite_benchmark')
+    for name in maps:
+        if name not in synthetic.GENERATORS:
+            raise ValueError("Unknown map generator {}, use one of {}".format(
+                             name, ', '.join(synthetic.GENERATORS)))
+    os.makedirs(directory, exist_ok=True)
+
+    records = []
+    for name in maps:
+        skip = set()
+        for size in sorted(sizes):
+            filename = os.path.join(directory, '{}-{}.osm'.format(name, size))
+            synthetic.GENERATORS[name](filename, size)
+            logger.info("Benchmarking %s map of size %d", name, size)
+            results = _suite_map(name, size, filename, runs, queries, directory, skip)
+            for record in results:
+                if record.get('median', 0) > max_step_time:
+                    logger.info("Skipping %s on %s maps larger than %d", record['step'], name, size)
+                    skip.add(record['step'])
+            records.extend(results)
+
+    regressions = []
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare_results(records, json.load(f)['results'], threshold)
+    with open(output, 'w') as f:
+        json.dump({'environment': environment(), 'baseline': baseline, 'threshold': threshold,
+                   'results': records}, f, indent=1)
+    logger.info("Wrote %d results to %s", len(records), output)
+    return regressions
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks mapbots on synthetic maps")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 20, 40],
+                        help="the sizes of the synthetic maps")
+    parser.add_argument('--maps', nargs='+', default=list(synthetic.GENERATORS),
+                        choices=list(synthetic.GENERATORS), help="the kinds of synthetic maps")
+    parser.add_argument('--runs', type=int, default=3, help="the amount of times every step is timed")
+    parser.add_argument('--queries', type=int, default=10, help="the routes planned per run")
+    parser.add_argument('--output', default='benchmark-results.json', help="the JSON file to write")
+    parser.add_argument('--baseline', help="a JSON file of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="the relative slowdown that counts as a regression")
+    parser.add_argument('--osm', help="also run the reader, build, A* and CH benchmarks on this OSM file")
+    args = parser.parse_args()
+
     setup_logging()
-    Astar_benchmark()
+    if args.osm:
+        Reader_benchmark((args.osm,))
+        Build_benchmark(args.osm)
+        Astar_benchmark(filename=args.osm)
+        CH_benchmark(filename=args.osm)
+    regressions = Suite_benchmark(args.sizes, args.maps, args.runs, args.queries, args.output, args.baseline,
+                                  args.threshold)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,266 @@
+"""Batched geodesic calculations on the WGS84 ellipsoid
+
+The functions take flat sequences of latitudes and longitudes in degrees
+so the lengths of many segments are calculated in one pass. NumPy is used
+when it is installed, otherwise the same formulas run in pure Python.
+
+Three methods are offered:
+HAVERSINE - Great circle distance on a sphere with the mean radius of the
+            earth. The error is at most 0.56% (about 0.3% typical), the
+            result is not a lower bound of the geodesic.
+VINCENTY - Vincenty's inverse formula on the ellipsoid, iterated until
+           the change is below 1e-12. Accurate to 0.5 mm; for the rare
+           (nearly antipodal) pairs where it does not converge the
+           Karney method is used.
+KARNEY - Karney's algorithm from geographiclib, accurate to 15 nm. It is
+         the method geopy uses but it is not vectorised.
+"""
+import array
+import logging
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+# The mean radius (2a + b) / 3 used by the haversine method
+MEAN_RADIUS = 6371008.8
+
+HAVERSINE = 'haversine'
+VINCENTY = 'vincenty'
+KARNEY = 'karney'
+METHODS = (HAVERSINE, VINCENTY, KARNEY)
+# The largest relative error of the haversine method
+HAVERSINE_ERROR = 0.0056
+
+_VINCENTY_TOLERANCE = 1e-12
+_VINCENTY_ITERATIONS = 200
+
+def distances(lat1, lon1, lat2, lon2, method=VINCENTY):
+    """Returns the lengths in metres between pairs of points
+
+    Returns an array of doubles with one length for every pair.
+
+    Params:
+    lat1 - The latitudes of the first points
+    lon1 - The longitudes of the first points
+    lat2 - The latitudes of the second points
+    lon2 - The longitudes of the second points
+    method - HAVERSINE, VINCENTY or KARNEY, see the module documentation
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown distance method {}".format(method))
+    if method == KARNEY:
+        return array.array('d', map(_karney, lat1, lon1, lat2, lon2))
+    if np is None:
+        function = _haversine if method == HAVERSINE else _vincenty
+        return array.array('d', map(function, lat1, lon1, lat2, lon2))
+
+    lat1, lon1, lat2, lon2 = (np.asarray(values, dtype=float) for values in (lat1, lon1, lat2, lon2))
+    if method == HAVERSINE:
+        result = _haversine_np(lat1, lon1, lat2, lon2)
+    else:
+        result = _vincenty_np(lat1, lon1, lat2, lon2)
+    return array.array('d', result.tobytes())
+
+def lower_bound_factor(method):
+    """Returns how much shorter than the geodesic a length can be
+
+    Multiplying a lower bound of the geodesic by this factor gives a
+    lower bound of the lengths calculated with the method.
+
+    Params:
+    method - HAVERSINE, VINCENTY or KARNEY, or None when unknown. Unknown
+             methods are assumed to be accurate.
+    """
+    return 1 - HAVERSINE_ERROR if method == HAVERSINE else 1.0
+
+def path_lengths(lats, lons, offsets, method=VINCENTY):
+    """Returns the lengths of many paths stored in flat arrays
+
+    The points of path i are at positions offsets[i] up to
+    offsets[i+1]. The lengths of all segments are calculated in one
+    batch and summed per path in order.
+
+    Params:
+    lats - The latitudes of the points of all paths
+    lons - The longitudes of the points of all paths
+    offsets - The start of every path, followed by the end of the last
+    method - HAVERSINE, VINCENTY or KARNEY, see the module documentation
+    """
+    segments = distances(lats[:-1], lons[:-1], lats[1:], lons[1:], method)
+    if np is not None and len(offsets) > 1:
+        offsets = np.asarray(offsets, dtype=np.int64)
+        counts = np.maximum(np.diff(offsets) - 1, 0)
+        # The segments inside every path, summed in order by bincount
+        inside = np.concatenate([ np.arange(start, start + count) for start, count in
+                                  zip(offsets[:-1].tolist(), counts.tolist()) ] or [np.empty(0, dtype=np.int64)])
+        paths = np.repeat(np.arange(len(counts)), counts)
+        lengths = np.bincount(paths, weights=np.frombuffer(segments, dtype=float)[inside],
+                              minlength=len(counts))
+        return array.array('d', lengths.tobytes())
+    lengths = array.array('d')
+    for i in range(len(offsets) - 1):
+        total = 0.0
+        # Skip the segment from the last point of the previous path
+        for j in range(offsets[i], offsets[i+1] - 1):
+            total += segments[j]
+        lengths.append(total)
+    return lengths
+
+def distance(p, q, method=VINCENTY):
+    """Returns the length in metres between two (lat, lon) points"""
+    return distances((p[0],), (p[1],), (q[0],), (q[1],), method)[0]
+
+def to_ecef(lat, lon):
+    """Converts a WGS84 (lat, lon) coordinate to an ECEF (x, y, z) tuple
+
+    Params:
+    lat - The latitude in degrees
+    lon - The longitude in degrees
+    """
+    phi = math.radians(lat)
+    lam = math.radians(lon)
+    sin_phi = math.sin(phi)
+    cos_phi = math.cos(phi)
+    n = WGS84_A / math.sqrt(1 - WGS84_E2 * sin_phi * sin_phi)
+    return (n * cos_phi * math.cos(lam),
+            n * cos_phi * math.sin(lam),
+            n * (1 - WGS84_E2) * sin_phi)
+
+def to_ecef_many(lats, lons):
+    """Converts many WGS84 coordinates to a list of ECEF (x, y, z) tuples"""
+    if np is None:
+        return list(map(to_ecef, lats, lons))
+    phi = np.radians(np.asarray(lats, dtype=float))
+    lam = np.radians(np.asarray(lons, dtype=float))
+    sin_phi = np.sin(phi)
+    cos_phi = np.cos(phi)
+    n = WGS84_A / np.sqrt(1 - WGS84_E2 * sin_phi * sin_phi)
+    xyz = np.column_stack((n * cos_phi * np.cos(lam),
+                           n * cos_phi * np.sin(lam),
+                           n * (1 - WGS84_E2) * sin_phi))
+    return [ tuple(point) for point in xyz.tolist() ]
+
+def _haversine(lat1, lon1, lat2, lon2):
+    """The haversine distance between two points"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    h = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * MEAN_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+def _haversine_np(lat1, lon1, lat2, lon2):
+    """The haversine distances between arrays of points"""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    h = np.sin((phi2 - phi1) / 2) ** 2 + \
+        np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2
+    return 2 * MEAN_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(h)))
+
+def _vincenty(lat1, lon1, lat2, lon2):
+    """Vincenty's inverse formula for two points"""
+    f = WGS84_F
+    big_l = math.radians((lon2 - lon1 + 180) % 360 - 180)
+    u1 = math.atan((1 - f) * math.tan(math.radians(lat1)))
+    u2 = math.atan((1 - f) * math.tan(math.radians(lat2)))
+    sin_u1, cos_u1 = math.sin(u1), math.cos(u1)
+    sin_u2, cos_u2 = math.sin(u2), math.cos(u2)
+
+    lam = big_l
+    for i in range(_VINCENTY_ITERATIONS):
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        sin_sigma = math.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+        if sin_sigma == 0:
+            return 0.0
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_u1 * cos_u2 * sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha * sin_alpha
+        cos_2sigma_m = cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha if cos2_alpha != 0 else 0.0
+        c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        previous = lam
+        lam = big_l + (1 - c) * f * sin_alpha * \
+            (sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m * cos_2sigma_m)))
+        if abs(lam - previous) < _VINCENTY_TOLERANCE:
+            break
+    else:
+        return _karney(lat1, lon1, lat2, lon2)
+
+    u_2 = cos2_alpha * (WGS84_A * WGS84_A - WGS84_B * WGS84_B) / (WGS84_B * WGS84_B)
+    big_a = 1 + u_2 / 16384 * (4096 + u_2 * (-768 + u_2 * (320 - 175 * u_2)))
+    big_b = u_2 / 1024 * (256 + u_2 * (-128 + u_2 * (74 - 47 * u_2)))
+    delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 *
+        (cos_sigma * (-1 + 2 * cos_2sigma_m * cos_2sigma_m) - big_b / 6 * cos_2sigma_m *
+         (-3 + 4 * sin_sigma * sin_sigma) * (-3 + 4 * cos_2sigma_m * cos_2sigma_m)))
+    return WGS84_B * big_a * (sigma - delta_sigma)
+
+def _vincenty_np(lat1, lon1, lat2, lon2):
+    """Vincenty's inverse formula for arrays of points"""
+    f = WGS84_F
+    big_l = np.radians((lon2 - lon1 + 180) % 360 - 180)
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    lam = big_l.copy()
+    sin_sigma, cos_sigma, sigma, cos2_alpha, cos_2sigma_m = (np.zeros(len(big_l)) for i in range(5))
+    # Only the pairs that have not converged are iterated, so every
+    # length is the same as when it would be calculated on its own
+    active = np.arange(len(big_l))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in range(_VINCENTY_ITERATIONS):
+            if not len(active):
+                break
+            a_sin_u1, a_cos_u1 = sin_u1[active], cos_u1[active]
+            a_sin_u2, a_cos_u2 = sin_u2[active], cos_u2[active]
+            sin_lam, cos_lam = np.sin(lam[active]), np.cos(lam[active])
+            a_sin_sigma = np.hypot(a_cos_u2 * sin_lam, a_cos_u1 * a_sin_u2 - a_sin_u1 * a_cos_u2 * cos_lam)
+            a_cos_sigma = a_sin_u1 * a_sin_u2 + a_cos_u1 * a_cos_u2 * cos_lam
+            a_sigma = np.arctan2(a_sin_sigma, a_cos_sigma)
+            sin_alpha = np.where(a_sin_sigma == 0, 0.0, a_cos_u1 * a_cos_u2 * sin_lam / a_sin_sigma)
+            a_cos2_alpha = 1 - sin_alpha * sin_alpha
+            a_cos_2sigma_m = np.where(a_cos2_alpha == 0, 0.0,
+                                      a_cos_sigma - 2 * a_sin_u1 * a_sin_u2 / a_cos2_alpha)
+            c = f / 16 * a_cos2_alpha * (4 + f * (4 - 3 * a_cos2_alpha))
+            previous = lam[active]
+            lam[active] = big_l[active] + (1 - c) * f * sin_alpha * \
+                (a_sigma + c * a_sin_sigma * (a_cos_2sigma_m + c * a_cos_sigma *
+                                              (-1 + 2 * a_cos_2sigma_m * a_cos_2sigma_m)))
+            sin_sigma[active] = a_sin_sigma
+            cos_sigma[active] = a_cos_sigma
+            sigma[active] = a_sigma
+            cos2_alpha[active] = a_cos2_alpha
+            cos_2sigma_m[active] = a_cos_2sigma_m
+            converged = (np.abs(lam[active] - previous) < _VINCENTY_TOLERANCE) | (a_sin_sigma == 0)
+            active = active[~converged]
+
+    u_2 = cos2_alpha * (WGS84_A * WGS84_A - WGS84_B * WGS84_B) / (WGS84_B * WGS84_B)
+    big_a = 1 + u_2 / 16384 * (4096 + u_2 * (-768 + u_2 * (320 - 175 * u_2)))
+    big_b = u_2 / 1024 * (256 + u_2 * (-128 + u_2 * (74 - 47 * u_2)))
+    delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 *
+        (cos_sigma * (-1 + 2 * cos_2sigma_m * cos_2sigma_m) - big_b / 6 * cos_2sigma_m *
+         (-3 + 4 * sin_sigma * sin_sigma) * (-3 + 4 * cos_2sigma_m * cos_2sigma_m)))
+    result = WGS84_B * big_a * (sigma - delta_sigma)
+    result[sin_sigma == 0] = 0.0
+    for i in active:
+        result[i] = _karney(lat1[i], lon1[i], lat2[i], lon2[i])
+    return result
+
+def _karney(lat1, lon1, lat2, lon2):
+    """Karney's geodesic distance between two points"""
+    return _wgs84().Inverse(lat1, lon1, lat2, lon2)['s12']
+
+def _wgs84():
+    """Returns the geographiclib WGS84 geodesic, imported when first used"""
+    from geographiclib.geodesic import Geodesic
+    return Geodesic.WGS84
@@ -1,6 +1,10 @@
 from osmreader.exportimage import MapImageExporter, graph_to_file, GraphMapExporter
 from osmreader.multireader import MultiReader
-from osmreader.graphbuilder import DirectionalGraphBuilder
+from osmreader.expatreader import ExpatReader
+from osmreader.pbfreader import PBFReader
+from osmreader.region import Region
+from osmreader.changes import ChangeSet, read_changes
+from osmreader.graphbuilder import DirectionalGraphBuilder, TraversalGraph, traversal_goal, traversal_sections
 import logging
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
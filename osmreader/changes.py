@@ -0,0 +1,84 @@
+import logging
+import xml.etree.cElementTree as ET
+
+from osmreader.elements import Node, Way
+from osmreader.multireader import open_osm, _parse_tags
+
+logger = logging.getLogger(__name__)
+
+# The actions of an osmChange file
+_ACTIONS = ('create', 'modify', 'delete')
+
+class ChangeSet:
+    def __init__(self):
+        """The changes of an osmChange (.osc) file
+
+        Only the latest state of every element is kept: a node that is
+        created and then modified is in nodes once, a way that is
+        modified and then deleted is only in deleted_ways.
+
+        nodes - The created and modified nodes as Node objects by id
+        ways - The created and modified ways as Way objects by id
+        deleted_nodes - The ids of the deleted nodes
+        deleted_ways - The ids of the deleted ways
+        """
+        self.nodes = {}
+        self.ways = {}
+        self.deleted_nodes = set()
+        self.deleted_ways = set()
+
+    def __len__(self):
+        return len(self.nodes) + len(self.ways) + len(self.deleted_nodes) + len(self.deleted_ways)
+
+def read_changes(filename):
+    """Reads an osmChange file into a ChangeSet
+
+    Relations are ignored. Files ending in .gz or .bz2 are decompressed
+    while they are parsed.
+
+    Params:
+    filename - The file which holds the osmChange XML
+    """
+    changes = ChangeSet()
+    action = None
+    with open_osm(filename) as source:
+        it = ET.iterparse(source, events=("start", "end"))
+        event, root = next(it)
+        if root.tag != 'osmChange':
+            raise ValueError("{} is not an osmChange file".format(filename))
+        for event, elem in it:
+            if elem.tag in _ACTIONS:
+                if event == 'start':
+                    action = elem.tag
+                else:
+                    action = None
+                    root.clear()
+                continue
+            if event != 'end' or elem.tag not in ('node', 'way', 'relation'):
+                continue
+            if action is None:
+                raise ValueError("A {} in {} is not inside create, modify or delete".format(elem.tag, filename))
+            id = int(elem.attrib['id'])
+            if elem.tag == 'node':
+                changes.nodes.pop(id, None)
+                changes.deleted_nodes.discard(id)
+                if action == 'delete':
+                    changes.deleted_nodes.add(id)
+                else:
+                    node = Node(id, elem.attrib['lat'], elem.attrib['lon'])
+                    node.tags = _parse_tags(elem)
+                    changes.nodes[id] = node
+            elif elem.tag == 'way':
+                changes.ways.pop(id, None)
+                changes.deleted_ways.discard(id)
+                if action == 'delete':
+                    changes.deleted_ways.add(id)
+                else:
+                    way = Way(id)
+                    way.tags = _parse_tags(elem)
+                    way.nodes = [ int(nd.attrib['ref']) for nd in elem.iterfind('nd') ]
+                    changes.ways[id] = way
+            elem.clear()
+    logger.info("Read %d node and %d way changes from %s", len(changes.nodes) + len(changes.deleted_nodes),
+                len(changes.ways) + len(changes.deleted_ways), filename)
+    return changes
@@ -1,4 +1,7 @@
 import array
+import bisect
+import collections.abc
+import heapq
 import logging
 
 logger = logging.getLogger(__name__)
@@ -38,3 +41,259 @@ class Way:
         if 'junction' in self.tags and self.tags['junction'] == 'roundabout':
             return True
         return False
+
+class NodeTable(collections.abc.Mapping):
+    def __init__(self):
+        """Nodes stored as columns of arrays instead of Node objects
+
+        The ids are kept sorted in an array, lat and lon are parallel
+        arrays and nodes are looked up by binary search. The ways of node
+        i are ways[way_offsets[i]:way_offsets[i+1]], tags are only stored
+        for the nodes that have them.
+
+        The table is a mapping from node id to a NodeView, which has the
+        same attributes as a Node, so it can be used where a dict of Node
+        objects was used. Use from_columns() to create a table and
+        set_ways() to fill in the ways.
+
+        Changes made with set_node(), delete(), add_way() and
+        remove_way() are kept as Node objects in changed and the ids in
+        deleted, so they cost the same for any size of table. The
+        columns do not include them until compact() is called.
+        """
+        self.ids = array.array('q')
+        self.lat = array.array('d')
+        self.lon = array.array('d')
+        self.tags = {}
+        self.way_offsets = array.array('q', [0])
+        self.ways = array.array('q')
+        self.changed = {}
+        self.deleted = set()
+        self._added = 0
+
+    @classmethod
+    def from_columns(cls, ids, lat, lon, tags=None):
+        """Creates a table from unsorted columns
+
+        When an id occurs more than once the last node is kept.
+
+        Params:
+        ids - The ids of the nodes
+        lat - The latitude of every node
+        lon - The longitude of every node
+        tags - A dict with the tags of nodes that have them by position
+        """
+        table = cls()
+        tags = tags or {}
+        if all(ids[i] < ids[i+1] for i in range(len(ids) - 1)):
+            table.ids = array.array('q', ids)
+            table.lat = array.array('d', lat)
+            table.lon = array.array('d', lon)
+            table.tags = dict(tags)
+        else:
+            order = sorted(range(len(ids)), key=ids.__getitem__)
+            # Keep the last of the nodes with the same id, the sort is stable
+            order = [ i for j, i in enumerate(order)
+                      if j + 1 == len(order) or ids[order[j+1]] != ids[i] ]
+            table.ids = array.array('q', (ids[i] for i in order))
+            table.lat = array.array('d', (lat[i] for i in order))
+            table.lon = array.array('d', (lon[i] for i in order))
+            table.tags = { j: tags[i] for j, i in enumerate(order) if i in tags }
+        table.way_offsets = array.array('q', bytes(8 * (len(table.ids) + 1)))
+        return table
+
+    def index(self, id):
+        """Returns the position of a node id in the columns
+
+        Raises KeyError when the node is not in the table.
+        """
+        i = bisect.bisect_left(self.ids, id)
+        if i == len(self.ids) or self.ids[i] != id:
+            raise KeyError(id)
+        return i
+
+    def set_ways(self, ways):
+        """Stores which ways reference every node
+
+        Params:
+        ways - A dict of Way objects by id. Every node they reference
+               must be in the table.
+        """
+        index = self.index
+        counts = array.array('q', bytes(8 * (len(self.ids) + 1)))
+        for way in ways.values():
+            for node in way.nodes:
+                counts[index(node) + 1] += 1
+        for i in range(len(self.ids)):
+            counts[i+1] += counts[i]
+        self.way_offsets = counts
+        position = array.array('q', counts[:-1])
+        self.ways = array.array('q', bytes(8 * counts[-1]))
+        for id, way in ways.items():
+            for node in way.nodes:
+                i = index(node)
+                self.ways[position[i]] = id
+                position[i] += 1
+
+    def set_node(self, id, lat, lon, tags=None):
+        """Creates a node or changes its position and tags
+
+        The ways of an existing node are kept.
+
+        Params:
+        id - The id of the node
+        lat - The latitude of the node
+        lon - The longitude of the node
+        tags - The tags of the node
+        """
+        node = self._changed_node(id, create=True)
+        node.lat = float(lat)
+        node.lon = float(lon)
+        node.tags = tags or {}
+
+    def delete(self, id):
+        """Removes a node from the table"""
+        if id not in self:
+            raise KeyError(id)
+        if self.changed.pop(id, None) is not None and not self._in_columns(id):
+            self._added -= 1
+        if self._in_columns(id):
+            self.deleted.add(id)
+
+    def add_way(self, id, way):
+        """Adds a way to the ways of a node"""
+        self._changed_node(id).ways.append(way)
+
+    def remove_way(self, id, way):
+        """Removes a way from the ways of a node once"""
+        self._changed_node(id).ways.remove(way)
+
+    def compact(self):
+        """Merges the changed and deleted nodes into the columns
+
+        Takes time proportional to the size of the table, the table is
+        changed in place so other references to it stay valid.
+        """
+        if not self.changed and not self.deleted:
+            return
+        logger.debug("Merging %d changed and %d deleted nodes into the columns",
+                     len(self.changed), len(self.deleted))
+        table = NodeTable()
+        kept = ( (id, i) for i, id in enumerate(self.ids)
+                 if id not in self.changed and id not in self.deleted )
+        for id, i in heapq.merge(kept, ( (id, -1) for id in sorted(self.changed) )):
+            if i < 0:
+                node = self.changed[id]
+                lat, lon, tags, ways = node.lat, node.lon, node.tags, node.ways
+            else:
+                lat, lon, tags = self.lat[i], self.lon[i], self.tags.get(i)
+                ways = self.ways[self.way_offsets[i]:self.way_offsets[i+1]]
+            if tags:
+                table.tags[len(table.ids)] = tags
+            table.ids.append(id)
+            table.lat.append(lat)
+            table.lon.append(lon)
+            table.ways.extend(ways)
+            table.way_offsets.append(len(table.ways))
+        self.__dict__.update(table.__dict__)
+
+    def select(self, positions):
+        """Returns a table with only the nodes at some positions
+
+        Params:
+        positions - The positions in the columns, in ascending order
+        """
+        table = NodeTable()
+        table.ids = array.array('q', (self.ids[i] for i in positions))
+        table.lat = array.array('d', (self.lat[i] for i in positions))
+        table.lon = array.array('d', (self.lon[i] for i in positions))
+        table.tags = { j: self.tags[i] for j, i in enumerate(positions) if i in self.tags }
+        for i in positions:
+            table.ways.extend(self.ways[self.way_offsets[i]:self.way_offsets[i+1]])
+            table.way_offsets.append(len(table.ways))
+        return table
+
+    def _in_columns(self, id):
+        """Returns whether a node id is in the columns"""
+        i = bisect.bisect_left(self.ids, id)
+        return i < len(self.ids) and self.ids[i] == id
+
+    def _changed_node(self, id, create=False):
+        """Returns the Node that holds the changes of a node
+
+        Params:
+        id - The id of the node
+        create - Create the node when it is not in the table
+        """
+        try:
+            return self.changed[id]
+        except KeyError:
+            pass
+        if id in self.deleted or not self._in_columns(id):
+            if not create:
+                raise KeyError(id)
+            node = Node(id, 0.0, 0.0)
+            self.deleted.discard(id)
+            if not self._in_columns(id):
+                self._added += 1
+        else:
+            view = self[id]
+            node = Node(id, view.lat, view.lon)
+            node.tags = dict(view.tags)
+            node.ways = view.ways
+        self.changed[id] = node
+        return node
+
+    def __getitem__(self, id):
+        try:
+            return self.changed[id]
+        except KeyError:
+            if id in self.deleted:
+                raise KeyError(id)
+            return NodeView(self, self.index(id))
+
+    def __contains__(self, id):
+        if id in self.changed:
+            return True
+        return id not in self.deleted and self._in_columns(id)
+
+    def __iter__(self):
+        if not self.changed and not self.deleted:
+            return iter(self.ids)
+        kept = ( id for id in self.ids if id not in self.changed and id not in self.deleted )
+        return heapq.merge(kept, sorted(self.changed))
+
+    def __len__(self):
+        return len(self.ids) - len(self.deleted) + self._added
+
+class NodeView:
+    """A node in a NodeTable with the attributes of a Node"""
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def id(self):
+        return self.table.ids[self.index]
+
+    @property
+    def lat(self):
+        return self.table.lat[self.index]
+
+    @property
+    def lon(self):
+        return self.table.lon[self.index]
+
+    @property
+    def tags(self):
+        return self.table.tags.get(self.index, {})
+
+    @property
+    def ways(self):
+        table = self.table
+        return table.ways[table.way_offsets[self.index]:table.way_offsets[self.index+1]]
+
+    def __str__(self):
+        return "{id} ({lat}, {lon})".format(id=self.id, lat=self.lat, lon=self.lon)
@@ -0,0 +1,221 @@
+import array
+import bisect
+import logging
+import time
+import xml.parsers.expat
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from osmreader.elements import NodeTable, Way
+from osmreader.multireader import CAR_TAGS, is_car_way, open_osm, tag_value
+
+logger = logging.getLogger(__name__)
+
+# The tags kept by default, the tags in CAR_TAGS are always kept
+DEFAULT_TAGS = frozenset(('oneway', 'junction', 'maxspeed', 'lanes', 'name', 'ref'))
+
+# The states of the parser
+_OUTSIDE = 0
+_NODE = 1
+_WAY = 2
+_SKIP = 3
+
+class ExpatReader:
+    def __init__(self, filename=None, *, tags=DEFAULT_TAGS, two_pass=False):
+        """Reads OSM XML into columns of arrays using expat
+
+        Unlike MultiReader no element trees or objects are created while
+        parsing. A small state machine on the expat callbacks appends
+        the nodes to the node_ids, node_lat and node_lon arrays. Highways
+        that can be travelled by car are stored as way_ids and their
+        node references in way_refs, the nodes of way i being
+        way_refs[way_offsets[i]:way_offsets[i+1]]. Only whitelisted tags
+        are kept: node_tags holds the tags of nodes that have them by
+        position, way_tags has the tags of every way.
+
+        Use elements() to get the nodes and ways in the format of
+        MultiReader for DirectionalGraphBuilder.
+
+        With two_pass the file is read twice, see load(), so nodes that
+        are not used by a car way are never stored.
+
+        Params:
+        filename - Name of a file to load. If the argument is None
+                   (default) then you need to call the load method
+                   yourself.
+        tags - The keys of the tags to keep, None keeps all tags
+        two_pass - Load files in two passes to save memory
+        """
+        self.logger = logging.getLogger('.'.join((__name__, type(self).__name__)))
+        self.tags = None if tags is None else frozenset(tags) | CAR_TAGS
+        self.node_ids = array.array('q')
+        self.node_lat = array.array('d')
+        self.node_lon = array.array('d')
+        self.node_tags = {}
+        self.way_ids = array.array('q')
+        self.way_offsets = array.array('q', [0])
+        self.way_refs = array.array('q')
+        self.way_tags = []
+        self.two_pass = two_pass
+        self._read_nodes = True
+        self._read_ways = True
+        self._needed = None
+
+        if filename is not None:
+            self.load(filename)
+
+    def load(self, filename):
+        """Parses an OSM file and appends its nodes and ways to the columns
+
+        Files ending in .gz or .bz2 are decompressed while they are
+        parsed.
+
+        When two_pass is set the first pass only reads the ways and
+        collects the ids of the nodes they use, the second pass only
+        reads those nodes. Peak memory then depends on the size of the
+        road network instead of the size of the file. Only nodes used by
+        the ways of this file are kept.
+
+        Params:
+        filename - The file which holds the OSM XML
+        """
+        if not self.two_pass:
+            self._parse(filename)
+            return
+
+        first_way = len(self.way_ids)
+        self._parse(filename, nodes=False)
+        refs = self.way_refs[self.way_offsets[first_way]:]
+        if np is not None:
+            self._needed = array.array('q', np.unique(np.frombuffer(refs, dtype=np.int64)).tobytes())
+        else:
+            self._needed = array.array('q', sorted(set(refs)))
+        del refs
+        self.logger.info("Reading the %d nodes used by %d ways", len(self._needed),
+                         len(self.way_ids) - first_way)
+        try:
+            self._parse(filename, ways=False)
+        finally:
+            self._needed = None
+
+    def _parse(self, filename, *, nodes=True, ways=True):
+        """Runs expat over a file
+
+        Params:
+        filename - The file which holds the OSM XML
+        nodes - Store the nodes
+        ways - Store the ways
+        """
+        self.logger.info("Parsing %s using expat", filename)
+        start_time = time.perf_counter()
+        self._state = _OUTSIDE
+        self._current_tags = {}
+        self._read_nodes = nodes
+        self._read_ways = ways
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        with open_osm(filename) as f:
+            parser.ParseFile(f)
+        self.logger.info("Parsed %d nodes and %d ways in %f sec", len(self.node_ids),
+                         len(self.way_ids), time.perf_counter() - start_time)
+
+    def _is_needed(self, id):
+        """Returns whether a node is used by the ways of the first pass"""
+        needed = self._needed
+        i = bisect.bisect_left(needed, id)
+        return i < len(needed) and needed[i] == id
+
+    def _start_element(self, name, attrs):
+        """Handles the start of an XML element"""
+        state = self._state
+        if name == 'nd':
+            if state == _WAY:
+                self.way_refs.append(int(attrs['ref']))
+        elif name == 'tag':
+            if state == _NODE or state == _WAY:
+                key = attrs['k']
+                if self.tags is None or key in self.tags:
+                    self._current_tags[key] = tag_value(attrs['v'])
+        elif name == 'node':
+            if not self._read_nodes:
+                self._state = _SKIP
+                return
+            id = int(attrs['id'])
+            if self._needed is not None and not self._is_needed(id):
+                self._state = _SKIP
+                return
+            self._state = _NODE
+            self._current_tags = {}
+            self.node_ids.append(id)
+            self.node_lat.append(float(attrs['lat']))
+            self.node_lon.append(float(attrs['lon']))
+        elif name == 'way':
+            if not self._read_ways:
+                self._state = _SKIP
+                return
+            self._state = _WAY
+            self._current_tags = {}
+            self._way_id = int(attrs['id'])
+        elif name == 'bounds':
+            self.min_lat = float(attrs['minlat'])
+            self.max_lat = float(attrs['maxlat'])
+            self.min_lon = float(attrs['minlon'])
+            self.max_lon = float(attrs['maxlon'])
+
+    def _end_element(self, name):
+        """Handles the end of an XML element"""
+        if self._state == _SKIP:
+            if name in ('node', 'way'):
+                self._state = _OUTSIDE
+        elif name == 'node':
+            if self._current_tags:
+                self.node_tags[len(self.node_ids) - 1] = self._current_tags
+            self._state = _OUTSIDE
+        elif name == 'way':
+            tags = self._current_tags
+            if 'highway' in tags and is_car_way(tags):
+                self.way_ids.append(self._way_id)
+                self.way_offsets.append(len(self.way_refs))
+                self.way_tags.append(tags)
+            else:
+                # Drop the node references of the way
+                del self.way_refs[self.way_offsets[-1]:]
+            self._state = _OUTSIDE
+
+    def find_bounds(self):
+        """Find map bounds when the file didn't specify them"""
+        try:
+            self.min_lat
+        except AttributeError:
+            self.min_lat = min(self.node_lat, default=180)
+            self.max_lat = max(self.node_lat, default=-180)
+            self.min_lon = min(self.node_lon, default=180)
+            self.max_lon = max(self.node_lon, default=-180)
+        self.logger.info("Area of map is defined by (%.4f, %.4f), (%.4f, %.4f)",
+                         self.min_lat, self.min_lon,
+                         self.max_lat, self.max_lon)
+
+    def elements(self):
+        """Returns the nodes as a NodeTable and the ways as Way objects
+
+        Only the nodes used by the ways are returned, like MultiReader
+        after filter_unused_nodes(True). The ways of every node are
+        filled in.
+        """
+        ways = {}
+        for i, id in enumerate(self.way_ids):
+            w = Way(id)
+            w.tags = self.way_tags[i]
+            w.nodes = self.way_refs[self.way_offsets[i]:self.way_offsets[i+1]].tolist()
+            ways[id] = w
+
+        nodes = NodeTable.from_columns(self.node_ids, self.node_lat, self.node_lon, self.node_tags)
+        used = sorted(set(nodes.index(node) for node in self.way_refs))
+        nodes = nodes.select(used)
+        nodes.set_ways(ways)
+        return nodes, ways
@@ -4,7 +4,6 @@ import math
 from PIL import Image, ImageDraw
 from pydotplus import graphviz
 from pygraph.readwrite import dot as graphtodot
-from weakref import WeakValueDictionary
 
 from util import MapExporter
 
@@ -32,8 +31,8 @@ class MapImageExporter(MapExporter):
         super(MapImageExporter, self).__init__(min_lat, max_lat, min_lon, max_lon, bg_color, enlargement)
         self.logger = logging.getLogger('.'.join((__name__, type(self).__name__)))
 
-        self.nodes = WeakValueDictionary(nodes)
-        self.ways = WeakValueDictionary(ways)
+        self.nodes = nodes
+        self.ways = ways
 
         self.node_color = node_color
         self.way_color = way_color
@@ -1,17 +1,58 @@
-import geopy.distance
+import array
+import bisect
 import logging
-import pygraph.classes.exceptions as graphexc
+import multiprocessing as mp
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from pygraph.classes.digraph import digraph
-from pygraph.classes.exceptions import AdditionError
+
+import geodesic
+from osmreader.elements import NodeTable
 
 logger = logging.getLogger(__name__)
 
+# Suffixes of the node names in a traversal graph
+TRAVERSAL_FORWARD = '+'
+TRAVERSAL_BACKWARD = '-'
+TRAVERSAL_GOAL = '$'
+
+class TraversalGraph(digraph):
+    """A digraph of section traversals
+
+    See DirectionalGraphBuilder.build_traversal_graph(). The planners
+    check the traversal attribute to skip filtering neighbours on the
+    side they are entered from.
+    """
+    traversal = True
+
 class DirectionalGraphBuilder:
-    def __init__(self, nodes, ways):
+    def __init__(self, nodes, ways, *, distance_method=geodesic.VINCENTY, processes=1):
+        """Builds a section graph out of nodes and ways
+
+        Params:
+        nodes - The nodes of the map, like MultiReader.nodes
+        ways - The ways of the map, like MultiReader.ways
+        distance_method - How the lengths of sections are calculated,
+                          one of the methods in geodesic. HAVERSINE is
+                          the fastest but its lengths may be shorter than
+                          the geodesic. The method is stored as the
+                          distance_method of the graph so the heuristics
+                          can lower their estimates to match.
+        processes - The amount of processes that split ways into
+                    sections and measure them, see build()
+        """
+        if distance_method not in geodesic.METHODS:
+            raise ValueError("Unknown distance method {}".format(distance_method))
         self.logger = logging.getLogger('.'.join((__name__, type(self).__name__)))
         self.nodes = nodes
         self.ways = ways
+        self.distance_method = distance_method
+        self.processes = processes
         self.graph = digraph()
 
     def build(self):
@@ -34,61 +75,220 @@ class DirectionalGraphBuilder:
           Because every section is looped over bidirectional crossroads
           are handled correctly. Sections which can be travelled in both
           directions are thus bidirectional
+
+        With more than one process the ways are split and the sections
+        measured by a process pool, see _split_parallel(). The graph is
+        the same as when it is built by one process.
         """
         # Split a way into its subsections between intersections
         self.logger.info("Splitting ways into sections that connect intersections")
-        for way in self.ways:
-            # The first node is also the first junction in a way
-            last_junction = self.ways[way].nodes[0]
-
-            # Check if this way consists of multiple sections
-            for node in self.ways[way].nodes[1:]:
-                if len(self.nodes[node].ways) > 1:
-                    # A junction in the middle of the way has been found
-                    self._build_section(way, last_junction, node)
-
-                    # Move the last junction marker so the next section
-                    # starts at the right place
-                    last_junction = node
-            else:
-                # Handle ways that have a dead end
-                if last_junction != self.ways[way].nodes[-1]:
-                    self._build_section(way, last_junction, self.ways[way].nodes[-1])
-                # The last element in a roundabout should be connected
-                # to the first element
-                try:
-                    if self.ways[way].nodes[0] == self.ways[way].nodes[-1]:
-                        first = ''.join([str(way), '_', '0'])
-                        last = ''.join([str(way), '_', str(self.ways[way].sections-1)])
-                        self.graph.add_edge((last, first))
-                except KeyError:
-                    pass # The way is not a roundabout
-                except AdditionError:
-                    logger.warning("Tried adding a roundabout connection between %s and %s while it already existed",
-                                 first, last)
+        start_time = time.perf_counter()
+        # The sections of every way as (name, start node, end node) and
+        # the sections that start or end at every node as (name, way,
+        # whether the section starts at the node)
+        self._sections = {}
+        self._endpoints = {}
+        if self.processes > 1:
+            self._split_parallel()
+        else:
+            self._split_serial()
+        self.split_time = time.perf_counter() - start_time
 
         # Connect ways to other ways
         self.logger.info("Connecting ways to other ways")
-        for current_way in self.ways:
-            for section in range(self.ways[current_way].sections):
-                name = ''.join([str(current_way), '_', str(section)])
+        for current_way, sections in self._sections.items():
+            oneway = self.ways[current_way].is_oneway()
+            for name, section_start, section_end in sections:
                 # Only try to connect the start of a section to another
                 # section if the current way is bidirectional
-                if not self.ways[current_way].is_oneway():
-                    section_start = self.graph.node_attributes(name)['start_node']
+                if not oneway:
                     self._connect_sections(current_way, name, section_start)
 
                 # Connect the end of the way to other ways
-                section_end = self.graph.node_attributes(name)['end_node']
-                # Loop over all the ways that the current section start
-                # should be connected with
                 self._connect_sections(current_way, name, section_end)
+        sections = len(self.graph.nodes())
+        self.build_time = time.perf_counter() - start_time
+        self.logger.info("Built %d sections in %f sec (%.0f sections/sec)", sections,
+                         self.build_time, sections / max(self.build_time, 1e-9))
+        # Lets caches built on the graph detect that it changed
+        self.graph.version = getattr(self.graph, 'version', 0) + 1
+        self.graph.distance_method = self.distance_method
         self.logger.info("Finished building the graph")
 
+    def update(self, ways, nodes=()):
+        """Updates the graph after ways and nodes changed
+
+        Only the changed ways and the ways through the changed nodes are
+        split again. Their old sections are removed from the graph and
+        the new sections are numbered from 0 like in build(), sections
+        that are not created again no longer exist. The new sections are
+        connected to each other and to the unchanged sections at their
+        end points, so the graph is the same as when it would be built
+        from scratch, except for the order of edges. The time this takes
+        depends on the amount of changes, not on the size of the map.
+
+        Derived data such as a RouteCache, CrowFliesHeuristic or
+        LandmarkHeuristic should be told about the changed sections with
+        their invalidate() method. The version of the graph is increased.
+        When the update added sections or connections, or made sections
+        shorter, any route may have become shorter and self.shortened is
+        set: a RouteCache must then be emptied completely. Otherwise
+        sections were only removed or made longer, and only the routes
+        through them have to be dropped, see RouteCache.invalidate().
+
+        Must be called after build(). Returns the names of all sections
+        that were removed, created or created again.
+
+        Params:
+        ways - The ids of the created, changed and deleted ways
+        nodes - The ids of nodes that moved or became or stopped being
+                junctions, see MultiReader.apply_changes()
+        """
+        if not hasattr(self, '_endpoints'):
+            raise ValueError("The graph must be built before it can be updated")
+        start_time = time.perf_counter()
+        resplit = set(ways)
+        for node in nodes:
+            if node in self.nodes:
+                resplit.update(self.nodes[node].ways)
+
+        # Remove the old sections of the ways
+        changed = set()
+        old = {}
+        for way in resplit:
+            for name, start_node, end_node in self._sections.pop(way, ()):
+                old[name] = self._section_shape(name)
+                self.graph.del_node(name)
+                changed.add(name)
+                for node in (start_node, end_node):
+                    endpoints = [ e for e in self._endpoints[node] if e[0] != name ]
+                    if endpoints:
+                        self._endpoints[node] = endpoints
+                    else:
+                        del self._endpoints[node]
+
+        # Split the ways that still exist again
+        self._start_measuring()
+        present = sorted(way for way in resplit if way in self.ways)
+        for way in present:
+            self.ways[way].sections = 0
+            self._split_way(way)
+        self._measure_sections()
+
+        # Connect the new sections in both directions
+        for way in present:
+            oneway = self.ways[way].is_oneway()
+            for name, section_start, section_end in self._sections.get(way, ()):
+                changed.add(name)
+                if not oneway:
+                    self._connect_sections(way, name, section_start)
+                self._connect_sections(way, name, section_end)
+                for node, starts in ((section_start, True), (section_end, False)):
+                    if not starts and oneway:
+                        continue
+                    self._connect_to_section(resplit, name, node)
+
+        self.shortened = any(_shortens(old.get(name), self._section_shape(name))
+                             for way in present for name, start, end in self._sections.get(way, ()))
+        self.graph.version = getattr(self.graph, 'version', 0) + 1
+        self.logger.info("Updated %d ways and %d sections in %f sec", len(resplit), len(changed),
+                         time.perf_counter() - start_time)
+        return changed
+
+    def _section_shape(self, name):
+        """Returns what decides the routes through a section
+
+        A tuple of the length, the start and end node, and the sets of
+        neighbours and incidents of the section.
+        """
+        attrs = self.graph.node_attributes(name)
+        return (attrs['length'], attrs['start_node'], attrs['end_node'],
+                set(self.graph.neighbors(name)), set(self.graph.incidents(name)))
+
+    def _connect_to_section(self, resplit, name, node):
+        """Connects the unchanged sections at a node to a new section
+
+        The reverse of _connect_sections(): the sections at node that
+        are left there get an edge to the section, which may be entered
+        from node.
+
+        Params:
+        resplit - The ways that were split again, their sections are
+                  connected by _connect_sections()
+        name - The name of the new section
+        node - The node ID of the endpoint of the new section
+        """
+        for other_name, other_way, starts in self._endpoints.get(node, ()):
+            if other_way in resplit:
+                continue
+            # Sections are left through their end, or through their
+            # start if they are bidirectional
+            if not starts or not self.ways[other_way].is_oneway():
+                _add_new_edge(self.graph, other_name, name)
+
+    def build_traversal_graph(self):
+        """Builds a graph of section traversals from the section graph.
+
+        Every section that can be travelled in the direction of its
+        nodes gets a '<section>+' node, every section that can be
+        travelled against that direction a '<section>-' node. The
+        attributes of these nodes are oriented in the direction of
+        travel: the start is where the section is entered and the end
+        where it is left. Edges only connect a traversal to traversals
+        that start where it ends, so the planners can follow the edges
+        without checking from which side a section was entered.
+
+        To plan routes between sections each section also gets a node
+        with its own name that is only used as a start, and a
+        '<section>$' node that is only used as a goal, see
+        traversal_goal(). The start has a length of 0 and leads to the
+        traversals of its section and to its own goal, so a route from a
+        section to itself costs nothing. Use traversal_sections() to
+        convert a planned path back to sections.
+
+        Must be called after build(). Returns a TraversalGraph.
+        """
+        self.logger.info("Building the section traversal graph")
+        graph = TraversalGraph()
+        graph.distance_method = self.distance_method
+        states = {}
+        for section in self.graph.nodes():
+            attrs = self.graph.node_attributes(section)
+            graph.add_node(section, attrs=dict(attrs, section=section, length=0.0))
+            graph.add_node(traversal_goal(section), attrs=dict(attrs, section=section))
+            graph.add_edge((section, traversal_goal(section)))
+            states[section] = [ ''.join([section, TRAVERSAL_FORWARD]) ]
+            graph.add_node(states[section][0], attrs=dict(attrs, section=section,
+                                                          direction=TRAVERSAL_FORWARD))
+            if not self.ways[attrs['way']].is_oneway():
+                states[section].append(''.join([section, TRAVERSAL_BACKWARD]))
+                graph.add_node(states[section][1], attrs=dict(attrs, section=section,
+                               direction=TRAVERSAL_BACKWARD,
+                               start_node=attrs['end_node'], start_point=attrs['end_point'],
+                               end_node=attrs['start_node'], end_point=attrs['start_point'],
+                               path=attrs['path'][::-1]))
+            # The start can leave through either end
+            for state in states[section]:
+                graph.add_edge((section, state))
+
+        for section in self.graph.nodes():
+            for neighbour in self.graph.neighbors(section):
+                for state in states[section]:
+                    exit_node = graph.node_attributes(state)['end_node']
+                    for other in states[neighbour]:
+                        if graph.node_attributes(other)['start_node'] != exit_node:
+                            continue
+                        _add_new_edge(graph, state, other)
+                        # The goal can be entered in any allowed direction
+                        _add_new_edge(graph, state, traversal_goal(neighbour))
+        self.logger.info("Finished building the traversal graph with %d traversals",
+                         sum(len(s) for s in states.values()))
+        return graph
+
     def _connect_sections(self, current_way, name, node):
         """Connects a section to all the sections that it is connected with.
 
-        Connects a section to all the sections that are connected to one
+        Connects a section to all the sections that start or end at one
         of its endpoints (node). It checks whether a way is oneway to
         make junctions oneway.
 
@@ -97,67 +297,165 @@ class DirectionalGraphBuilder:
         name - The name of the section in which the endpoint lives
         node - The node ID of the endpoint
         """
-        # Loop over all the ways that the current section should be
-        # connected with for this endpoint
-        for other_way in self.nodes[node].ways:
+        for other_name, other_way, starts in self._endpoints.get(node, ()):
             # Skip connecting a section to other sections in this way
             # This has already been done when creating sections and has
             # side effects like self-referencing sections
             if current_way == other_way:
                 continue
-            for other_section in range(self.ways[other_way].sections):
-                other_name = ''.join([str(other_way), '_', str(other_section)])
-                other_attrs = self.graph.node_attributes(other_name)
-                # We can always connect from the current way to the
-                # start of another section
-                if other_attrs['start_node'] == node:
-                    try:
-                        self.graph.add_edge((name, other_name))
-                    except graphexc.AdditionError:
-                        # Ignore adding the same edge twice
-                        pass
-
-                # Only connect to the end of another section if it is
-                # bidirectional
-                if not self.ways[other_way].is_oneway() and other_attrs['end_node'] == node:
-                    try:
-                        self.graph.add_edge((name, other_name))
-                    except graphexc.AdditionError:
-                        # Ignore adding the same edge twice
-                        pass
-
-    def _build_section(self, way, start_node, end_node):
+            # We can always connect from the current way to the start of
+            # another section, only connect to the end of another section
+            # if it is bidirectional
+            if starts or not self.ways[other_way].is_oneway():
+                _add_new_edge(self.graph, name, other_name)
+
+    def _split_serial(self):
+        """Splits all ways into sections and measures them"""
+        self._start_measuring()
+        for way in self.ways:
+            self._split_way(way)
+        self._measure_sections()
+
+    def _split_way(self, way):
+        """Splits a way into sections, see _split_serial()"""
+        nodes = self.ways[way].nodes
+        # The first node is also the first junction in a way
+        last_junction = 0
+
+        # Check if this way consists of multiple sections
+        for position in range(1, len(nodes)):
+            if len(self.nodes[nodes[position]].ways) > 1:
+                # A junction in the middle of the way has been found
+                self._build_section(way, last_junction, position)
+
+                # Move the last junction marker so the next section
+                # starts at the right place
+                last_junction = position
+        # Handle ways that have a dead end
+        if nodes[last_junction] != nodes[-1]:
+            self._build_section(way, last_junction, len(nodes) - 1)
+        self._close_roundabout(way)
+
+    def _split_parallel(self):
+        """Splits all ways into sections in a process pool
+
+        The node references of all ways and the coordinates of the nodes
+        are copied into shared memory once. Every process handles a
+        shard of consecutive ways: it finds the junctions, measures the
+        sections and writes their end positions and lengths into shared
+        output arrays, at slots reserved for every way. The sections are
+        then added to the graph in the order of the ways, so the graph,
+        including the order of edges, is the same as a serial build.
+        """
+        way_ids = list(self.ways)
+        refs = array.array('q')
+        way_offsets = array.array('q', [0])
+        for way in way_ids:
+            refs.extend(self.ways[way].nodes)
+            way_offsets.append(len(refs))
+        ids, lat, lon, junction = _node_columns(self.nodes)
+        # Way i has at most one section per pair of nodes, its slots
+        # start at way_offsets[i] - i
+        slots = max(len(refs) - len(way_ids), 0)
+        shared = {'refs': _shared('q', refs), 'way_offsets': _shared('q', way_offsets),
+                  'ids': _shared('q', ids), 'lat': _shared('d', lat), 'lon': _shared('d', lon),
+                  'junction': _shared('B', junction), 'positions': _shared('q', len(refs)),
+                  'counts': _shared('q', len(way_ids)), 'ends': _shared('q', slots),
+                  'lengths': _shared('d', slots)}
+        shards = _shards(way_offsets, self.processes * 4)
+        self.logger.info("Splitting %d ways in %d shards using %d processes", len(way_ids),
+                         len(shards), self.processes)
+        with mp.Pool(self.processes, _init_split, (shared, self.distance_method)) as pool:
+            pool.starmap(_split_shard, shards)
+
+        views = dict((name, _view(values)) for name, values in shared.items())
+        positions, counts, ends, lengths = (views[name] for name in ('positions', 'counts', 'ends', 'lengths'))
+        lat, lon = views['lat'], views['lon']
+        for i, way in enumerate(way_ids):
+            first = way_offsets[i]
+            start = 0
+            for slot in range(first - i, first - i + counts[i]):
+                end = ends[slot]
+                path = [ (lat[n], lon[n]) for n in positions[first+start:first+end+1] ]
+                self._build_section(way, start, end, path, lengths[slot])
+                start = end
+            self._close_roundabout(way)
+
+    def _close_roundabout(self, way):
+        """Connects the last section of a roundabout to the first"""
+        nodes = self.ways[way].nodes
+        if nodes[0] == nodes[-1] and way in self._sections:
+            first = self._sections[way][0][0]
+            last = self._sections[way][-1][0]
+            if self.graph.has_edge((last, first)):
+                logger.warning("Tried adding a roundabout connection between %s and %s while it already existed",
+                               first, last)
+            else:
+                self.graph.add_edge((last, first))
+
+    def _start_measuring(self):
+        """Starts collecting the sections to measure in one batch"""
+        # The paths of all sections in flat arrays, their lengths are
+        # calculated in one batch once all ways are split
+        self._lats = array.array('d')
+        self._lons = array.array('d')
+        self._offsets = array.array('q', [0])
+        self._unmeasured = []
+
+    def _measure_sections(self):
+        """Calculates the lengths of the sections built since _start_measuring()"""
+        self.logger.info("Calculating the lengths of %d sections", len(self._unmeasured))
+        lengths = geodesic.path_lengths(self._lats, self._lons, self._offsets, self.distance_method)
+        for attrs, length in zip(self._unmeasured, lengths):
+            attrs['length'] = length
+        self._start_measuring()
+
+    def _build_section(self, way, start, end, path=None, length=None):
         """Builds a section out a way and adds it to the graph.
 
-        Given a way and two nodes in that way this function will
-        construct a section and add it as a node to the graph. It will
-        calculate the length and all the intermediary lat/lon
-        coordinates in that section and store those in the graph too.
+        Given a way and the positions of two nodes in that way this
+        function will construct a section and add it as a node to the
+        graph. It stores all the intermediary lat/lon coordinates in that
+        section in the graph too. Unless it is given the length is filled
+        in by _measure_sections().
 
         Params:
         way - The way to build the section for
-        start_node - The ID of the node the section should start at
-        end_node - The ID of the node the section should end at
+        start - The position in the way of the node the section should
+                start at
+        end - The position in the way of the node the section should end
+              at, after start
+        path - The (lat, lon) coordinates of the nodes from start to end,
+               looked up when None
+        length - The length of the section, None to measure it later
         """
-        # Calculate the length of the section
-        s = self.ways[way].nodes.index(start_node)
-        # Make sure the end is always further in the sequence than the
-        # start
-        e = self.ways[way].nodes.index(end_node, s+1) + 1
-        path = [ (self.nodes[n].lat, self.nodes[n].lon) for n in self.ways[way].nodes[s:e] ]
-        length = calculate_distance(path)
+        nodes = self.ways[way].nodes
+        start_node = nodes[start]
+        end_node = nodes[end]
+        if path is None:
+            path = [ (self.nodes[n].lat, self.nodes[n].lon) for n in nodes[start:end+1] ]
+        if length is None:
+            for lat, lon in path:
+                self._lats.append(lat)
+                self._lons.append(lon)
+            self._offsets.append(len(self._lats))
 
         # Add the section to the graph as a node
         name = ''.join([str(way), '_', str(self.ways[way].sections)])
         attrs = {'start_node': start_node,
-                 'start_point': (self.nodes[start_node].lat, self.nodes[start_node].lon),
+                 'start_point': path[0],
                  'end_node': end_node,
-                 'end_point': (self.nodes[end_node].lat, self.nodes[end_node].lon),
+                 'end_point': path[-1],
                  'tags': self.ways[way].tags,
                  'way': way,
                  'length': length,
                  'path': path}
         self.graph.add_node(name, attrs=attrs)
+        if length is None:
+            self._unmeasured.append(attrs)
+        self._sections.setdefault(way, []).append((name, start_node, end_node))
+        self._endpoints.setdefault(start_node, []).append((name, way, True))
+        self._endpoints.setdefault(end_node, []).append((name, way, False))
 
         # Create edges between sections if there are any
         if self.ways[way].sections > 0:
@@ -168,25 +466,172 @@ class DirectionalGraphBuilder:
         self.ways[way].sections += 1
 
 
-def calculate_distance(points):
+def traversal_goal(section):
+    """Returns the node to use as goal for a section in a traversal graph"""
+    return ''.join([str(section), TRAVERSAL_GOAL])
+
+def traversal_sections(path):
+    """Converts a path through a traversal graph to a path of sections"""
+    sections = [ state.rstrip(''.join([TRAVERSAL_FORWARD, TRAVERSAL_BACKWARD, TRAVERSAL_GOAL]))
+                 for state in path ]
+    # The start is followed by a traversal or the goal of its own section
+    return sections[:1] + sections[2:]
+
+def _shortens(old, new):
+    """Returns whether a changed section may make routes shorter
+
+    Params:
+    old - The shape of the section before the change or None when it
+          is new, see DirectionalGraphBuilder._section_shape()
+    new - The shape of the section after the change
+    """
+    if old is None:
+        return True
+    # Moved end points change which turns are allowed
+    return new[0] < old[0] or new[1:3] != old[1:3] or not new[3] <= old[3] or not new[4] <= old[4]
+
+def _add_new_edge(graph, u, v):
+    """Adds an edge to a graph unless it already exists"""
+    if not graph.has_edge((u, v)):
+        graph.add_edge((u, v))
+
+def _node_columns(nodes):
+    """Returns the sorted ids, lat, lon and junction flags of nodes
+
+    A node is a junction when it is referenced more than once by the
+    ways.
+
+    Params:
+    nodes - A NodeTable or a dict of Node objects
+    """
+    if isinstance(nodes, NodeTable):
+        nodes.compact()
+        if np is not None:
+            junction = (np.diff(np.frombuffer(nodes.way_offsets, dtype=np.int64)) > 1).astype(np.uint8)
+            junction = junction.tobytes()
+        else:
+            offsets = nodes.way_offsets
+            junction = bytes(offsets[i+1] - offsets[i] > 1 for i in range(len(nodes.ids)))
+        return nodes.ids, nodes.lat, nodes.lon, junction
+    ids = array.array('q', sorted(nodes))
+    return (ids, array.array('d', (nodes[id].lat for id in ids)), array.array('d', (nodes[id].lon for id in ids)),
+            bytes(len(nodes[id].ways) > 1 for id in ids))
+
+def _shared(typecode, values):
+    """Creates a shared array with a size or a copy of values"""
+    if isinstance(values, int):
+        return mp.RawArray(typecode, max(values, 1))
+    values = memoryview(values).cast('B')
+    shared = mp.RawArray(typecode, max(len(values) // array.array(typecode).itemsize, 1))
+    memoryview(shared).cast('B')[:len(values)] = values
+    return shared
+
+def _view(shared):
+    """Returns a memoryview of a shared array with its typecode"""
+    return memoryview(shared).cast('B').cast(shared._type_._type_)
+
+def _shards(way_offsets, count):
+    """Divides ways into about count ranges with the same amount of nodes"""
+    ways = len(way_offsets) - 1
+    size = max(way_offsets[-1] // max(count, 1), 1)
+    shards = []
+    start = 0
+    while start < ways:
+        stop = bisect.bisect_left(way_offsets, way_offsets[start] + size, start + 1)
+        stop = min(max(stop, start + 1), ways)
+        shards.append((start, stop))
+        start = stop
+    return shards
+
+# The shared arrays of the build, set in every process of the pool
+_split_arrays = None
+_split_method = None
+
+def _init_split(shared, method):
+    """Initialises a process that splits ways, ran by the process pool"""
+    global _split_arrays, _split_method
+    _split_arrays = dict((name, _view(values)) for name, values in shared.items())
+    _split_method = method
+
+def _split_shard(start, stop):
+    """Splits the ways start up to stop into sections, ran in a process pool
+
+    Writes the positions of the nodes of the ways, the amount of
+    sections of every way and the end position in its way and the
+    length of every section to the shared arrays. See
+    DirectionalGraphBuilder._split_parallel().
+    """
+    a = _split_arrays
+    refs, way_offsets, junction, positions = a['refs'], a['way_offsets'], a['junction'], a['positions']
+    first, last = way_offsets[start], way_offsets[stop]
+    ids = a['ids']
+    if np is not None:
+        sorted_ids = np.frombuffer(ids, dtype=np.int64)
+        way_refs = np.frombuffer(refs, dtype=np.int64)[first:last]
+        found = np.searchsorted(sorted_ids, way_refs)
+        # A node that is not loaded gets the position of the next id
+        missing = (found == len(sorted_ids)) | (sorted_ids[np.minimum(found, len(sorted_ids) - 1)] != way_refs)
+        if missing.any():
+            raise KeyError(int(way_refs[missing.argmax()]))
+        np.frombuffer(positions, dtype=np.int64)[first:last] = found
+    else:
+        for i in range(first, last):
+            position = bisect.bisect_left(ids, refs[i])
+            if position == len(ids) or ids[position] != refs[i]:
+                raise KeyError(refs[i])
+            positions[i] = position
+
+    # The nodes of every section, measured in one batch
+    points = array.array('q')
+    offsets = array.array('q', [0])
+    slots = array.array('q')
+    ends, counts = a['ends'], a['counts']
+    for i in range(start, stop):
+        begin, end = way_offsets[i], way_offsets[i+1]
+        slot = begin - i
+        last_junction = 0
+        # The same rules as DirectionalGraphBuilder._split_serial()
+        splits = [ p for p in range(1, end - begin) if junction[positions[begin+p]] ]
+        if refs[begin + (splits[-1] if splits else 0)] != refs[end-1]:
+            splits.append(end - begin - 1)
+        for p in splits:
+            points.extend(positions[begin+last_junction:begin+p+1])
+            offsets.append(len(points))
+            slots.append(slot)
+            ends[slot] = p
+            slot += 1
+            last_junction = p
+        counts[i] = len(splits)
+
+    lat, lon = a['lat'], a['lon']
+    if np is not None:
+        points = np.frombuffer(points, dtype=np.int64)
+        lats = np.frombuffer(lat, dtype=float)[points]
+        lons = np.frombuffer(lon, dtype=float)[points]
+    else:
+        lats = [ lat[p] for p in points ]
+        lons = [ lon[p] for p in points ]
+    lengths = a['lengths']
+    for slot, length in zip(slots, geodesic.path_lengths(lats, lons, offsets, _split_method)):
+        lengths[slot] = length
+
+def calculate_distance(points, method=geodesic.VINCENTY):
     """Calculates distance as the crow flies between a series of points.
 
     Takes a sequence of points and calculates the distance between each
     consecutive pair of points and returns the total distance. The
     distance is the distance over a surface of a sphere so the points
     are a (latitude, longitude) tuple. The distance is calculated using
-    the Vincenty method.
+    the Vincenty method by default, see geodesic for the others.
 
     Params:
     points - A list of (lat, lon) tuples for which the distance needs to
              be calculated.
+    method - The geodesic method to calculate the distance with
     """
     if len(points) < 2:
         raise ValueError("points must be a sequence with at least two components")
 
-    total = 0.0
-    last_point = points[0]
-    for point in points[1:]:
-        total += geopy.distance.distance(last_point, point).m
-        last_point = point
-    return total
+    lats = [ point[0] for point in points ]
+    lons = [ point[1] for point in points ]
+    return geodesic.path_lengths(lats, lons, (0, len(points)), method)[0]
@@ -1,28 +1,50 @@
 import array
+import bz2
+import gzip
 import logging
 import logging.handlers
 import multiprocessing as mp
 import pygraph.classes.exceptions as graphexc
+import os
 import queue
+import re
 import xml.etree.cElementTree as ET
 import time
 
 from pygraph.classes.digraph import digraph
-from osmreader.elements import Node, Way
+from osmreader.elements import NodeTable, Way
+from osmreader.region import Region
 
 logger = logging.getLogger(__name__)
 
-def _xml_parser(logqueue, conn, filename):
-    """Parses XML and puts it in a queue, ran as a subprocess
+# The kinds of messages sent by _xml_parser
+BOUNDS = 0
+NODE_BATCH = 1
+WAY_BATCH = 2
 
-    Parses the OSM XML and puts the elements in a queue where they can
-    be processed by other parts of the program.
+# The start of the elements at which a file may be split into shards
+_SHARD_BOUNDARY = re.compile(rb'<(?:node|way|relation)[\s/>]')
+# The amount of bytes read at once when parsing a shard
+_SHARD_READ_SIZE = 1024*1024
+
+def _xml_parser(logqueue, conn, filename, batch_size=10000, region=None):
+    """Parses XML and sends it in compact batches, ran as a subprocess
+
+    Parses the OSM XML and converts the elements to plain values before
+    sending them, so the main process does not have to unpickle and
+    walk ElementTree elements. Nodes and ways are sent in batches of at
+    most batch_size elements (see _NodeBatch and _WayBatch), ways
+    without a highway tag are dropped here already, just like nodes
+    outside the region. Batches are sent in the order of the file and
+    end with None.
 
     Params:
     logqueue - The queue where log records have to end up in
-    conn - Connection where parsed elements end up in so they can be
+    conn - Connection where parsed batches end up in so they can be
            handled by the rest of the programs
     filename - The filename of the XML file to parse
+    batch_size - The maximum amount of elements in a batch
+    region - The Region to keep the nodes of, None keeps all nodes
     """
     # Use only a QueueHandler for the process that runs this code
     # This prevents the process to writing to the log file while the
@@ -38,7 +60,8 @@ def _xml_parser(logqueue, conn, filename):
 
     # Parse the root element of the XML
     try:
-        it = ET.iterparse(filename, events=("start", "end"))
+        source = open_osm(filename)
+        it = ET.iterparse(source, events=("start", "end"))
     except Exception:
         import traceback
         logger.error("Failed to load the XML file %s\n%s", filename, traceback.format_exc())
@@ -48,20 +71,333 @@ def _xml_parser(logqueue, conn, filename):
         event, root = next(it)
         logger.info("Loaded XML file with OSM API version %s", root.attrib['version'])
 
+        batch = None
         for event, elem in it:
             if event == "end":
-                if elem.tag in ("bounds", "node", "way"):
-                    conn.send(elem)
+                if elem.tag == "node":
+                    if not isinstance(batch, _NodeBatch):
+                        _send_batch(conn, batch)
+                        batch = _NodeBatch(region)
+                    batch.add(elem)
+                elif elem.tag == "way":
+                    if not isinstance(batch, _WayBatch):
+                        _send_batch(conn, batch)
+                        batch = _WayBatch()
+                    batch.add(elem)
+                elif elem.tag == "bounds":
+                    _send_batch(conn, batch)
+                    batch = None
+                    conn.send((BOUNDS, tuple(float(elem.attrib[key]) for key in
+                                             ('minlat', 'maxlat', 'minlon', 'maxlon'))))
+                if batch is not None and len(batch) >= batch_size:
+                    _send_batch(conn, batch)
+                    batch = None
 
                 root.clear()
+        _send_batch(conn, batch)
+        source.close()
 
     logger.info("Finished parsing XML, exiting parser subprocess")
     conn.send(None)
 
+def open_osm(filename):
+    """Opens an OSM XML file for reading bytes
+
+    Files ending in .gz or .bz2 are decompressed while they are read.
+
+    Params:
+    filename - The OSM XML file
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    elif filename.endswith('.bz2'):
+        return bz2.open(filename, 'rb')
+    return open(filename, 'rb')
+
+def is_compressed(filename):
+    """Returns whether open_osm() decompresses a file"""
+    return filename.endswith(('.gz', '.bz2'))
+
+def _init_shard_parser(logqueue):
+    """Sets up logging for the processes that parse shards"""
+    h = logging.handlers.QueueHandler(logqueue)
+    root = logging.getLogger()
+    root.handlers = []
+    root.addHandler(h)
+
+def _find_shards(filename, count):
+    """Splits an OSM XML file into byte ranges that can be parsed apart
+
+    Every range except the first starts at a <node, <way or <relation
+    element. These only occur at the top level of an OSM file, so no
+    element is split. The first range holds the XML declaration, the
+    root element and the bounds.
+
+    Returns a list of (start, end) tuples in file order.
+
+    Params:
+    filename - The OSM XML file
+    count - The desired amount of ranges, there may be less
+    """
+    size = os.path.getsize(filename)
+    starts = [0]
+    with open(filename, 'rb') as f:
+        for i in range(1, count):
+            position = max(size * i // count, starts[-1] + 1)
+            if position >= size:
+                break
+            f.seek(position)
+            # Read on until the start of an element has been found, keep
+            # a few bytes so tags that straddle two reads are found
+            data = b''
+            while True:
+                chunk = f.read(_SHARD_READ_SIZE)
+                if not chunk:
+                    break
+                data += chunk
+                match = _SHARD_BOUNDARY.search(data)
+                if match is not None:
+                    break
+                keep = data[-16:]
+                position += len(data) - len(keep)
+                data = keep
+            if not chunk:
+                break
+            starts.append(position + match.start())
+    return list(zip(starts, starts[1:] + [size]))
+
+def _parse_shard(filename, start, end, batch_size, last, region=None):
+    """Parses a byte range of an OSM XML file, ran in a process pool
+
+    The range is parsed as if it were a complete file by adding the
+    missing start or end of the root element.
+
+    Returns the list of messages _xml_parser would have sent for the
+    elements in the range, without the final None.
+
+    Params:
+    filename - The OSM XML file
+    start - The first byte of the range, see _find_shards()
+    end - The byte after the range
+    batch_size - The maximum amount of elements in a batch
+    last - Whether the range is the end of the file
+    region - The Region to keep the nodes of, None keeps all nodes
+    """
+    logger = logging.getLogger('.'.join((__name__, '_parse_shard')))
+    logger.debug("Parsing bytes %d to %d of %s", start, end, filename)
+    messages = []
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    batch = None
+
+    def handle_events():
+        nonlocal root, batch
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == "node":
+                if not isinstance(batch, _NodeBatch):
+                    _keep_batch(messages, batch)
+                    batch = _NodeBatch(region)
+                batch.add(elem)
+            elif elem.tag == "way":
+                if not isinstance(batch, _WayBatch):
+                    _keep_batch(messages, batch)
+                    batch = _WayBatch()
+                batch.add(elem)
+            elif elem.tag == "bounds":
+                _keep_batch(messages, batch)
+                batch = None
+                messages.append((BOUNDS, tuple(float(elem.attrib[key]) for key in
+                                               ('minlat', 'maxlat', 'minlon', 'maxlon'))))
+            else:
+                continue
+            if batch is not None and len(batch) >= batch_size:
+                _keep_batch(messages, batch)
+                batch = None
+            root.clear()
+
+    if start > 0:
+        parser.feed(b'<osm>')
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = f.read(min(remaining, _SHARD_READ_SIZE))
+            if not data:
+                raise ValueError("{} changed while it was being parsed".format(filename))
+            remaining -= len(data)
+            parser.feed(data)
+            handle_events()
+    if not last:
+        parser.feed(b'</osm>')
+    parser.close()
+    handle_events()
+    _keep_batch(messages, batch)
+    return messages
+
+def _star_parse_shard(args):
+    """Calls _parse_shard() with a tuple of arguments"""
+    return _parse_shard(*args)
+
+def _keep_batch(messages, batch):
+    """Adds a batch that has elements in it to a list of messages"""
+    if batch is not None and len(batch) > 0:
+        messages.append(batch.message())
+
+def _send_batch(conn, batch):
+    """Sends a batch that has elements in it"""
+    if batch is not None and len(batch) > 0:
+        conn.send(batch.message())
+
+class _NodeBatch:
+    def __init__(self, region=None):
+        """Collects node elements as arrays of ids and coordinates
+
+        Only the tags of nodes that have them are stored, by position in
+        the batch.
+
+        Params:
+        region - The Region to keep the nodes of, None keeps all nodes
+        """
+        self.region = region
+        self.ids = array.array('q')
+        self.coords = array.array('d')
+        self.tags = {}
+
+    def add(self, elem):
+        """Adds a node XML element to the batch unless it is outside the region"""
+        attrib = elem.attrib
+        lat = float(attrib['lat'])
+        lon = float(attrib['lon'])
+        if self.region is not None and not self.region.contains(lat, lon):
+            return
+        self.append(int(attrib['id']), lat, lon, _parse_tags(elem) if len(elem) else None)
+
+    def append(self, id, lat, lon, tags):
+        """Adds a node to the batch without checking the region
+
+        Params:
+        id - The id of the node
+        lat - The latitude of the node
+        lon - The longitude of the node
+        tags - The converted tags of the node, may be empty or None
+        """
+        if tags:
+            self.tags[len(self.ids)] = tags
+        self.ids.append(id)
+        self.coords.append(lat)
+        self.coords.append(lon)
+
+    def message(self):
+        return (NODE_BATCH, self.ids, self.coords, self.tags)
+
+    def __len__(self):
+        return len(self.ids)
+
+class _WayBatch:
+    def __init__(self):
+        """Collects highway elements as arrays of ids and node references
+
+        The nodes of way i are refs[offsets[i]:offsets[i+1]].
+        """
+        self.ids = array.array('q')
+        self.offsets = array.array('q', [0])
+        self.refs = array.array('q')
+        self.tags = []
+
+    def add(self, elem):
+        """Adds a way XML element to the batch unless it is no highway"""
+        tags = _parse_tags(elem)
+        if 'highway' not in tags:
+            return
+        self.append(int(elem.attrib['id']), (int(node.attrib['ref']) for node in elem.iterfind('nd')), tags)
+
+    def append(self, id, refs, tags):
+        """Adds a way to the batch without checking whether it is a highway
+
+        Params:
+        id - The id of the way
+        refs - The ids of the nodes of the way
+        tags - The converted tags of the way
+        """
+        self.ids.append(id)
+        self.refs.extend(refs)
+        self.offsets.append(len(self.refs))
+        self.tags.append(tags)
+
+    def message(self):
+        return (WAY_BATCH, self.ids, self.offsets, self.refs, self.tags)
+
+    def __len__(self):
+        return len(self.ids)
+
+def _parse_tags(elem):
+    """Parses all 'tag' subtags of a XML Element
+
+    Is given a XML Element and parses all children which are a tag.
+    It tries to convert the value of the tag to int or float if
+    possible, see tag_value().
+
+    Params:
+    elem - an XML Element that possibly contains one or more 'tag'
+           child elements.
+    """
+    return { tag.attrib['k']: tag_value(tag.attrib['v']) for tag in elem.iterfind("tag") }
+
+def tag_value(value):
+    """Converts the value of an OSM tag to int or float if possible
+
+    Params:
+    value - The value of the tag as found in the XML
+    """
+    # Try to convert the tag to a boolean
+    if value.lower in ('t', 'true', 'y', 'yes'):
+        return True
+    elif value.lower in ('f', 'false', 'n', 'no'):
+        return False
+
+    # Try to convert the tag to a integer
+    if value.isdigit():
+        return int(value)
+    try:
+        return float(value)
+    except:
+        return value
+
+# The tags that decide whether a way can be travelled by car
+CAR_TAGS = frozenset(('highway', 'access', 'motorcar', 'motor_vehicle', 'public_transport'))
+
+def is_car_way(tags):
+    """Returns whether a highway can be travelled by car
+
+    Params:
+    tags - The tags of the way, which must include highway
+    """
+    # Remove based on highway type
+    types = ('cycleway', 'path', 'footway', 'steps', 'services',
+             'pedestrian', 'bus_guideway', 'track')
+    if tags['highway'] in types:
+        return False
+    # Remove based on access restrictions
+    restrictions = (False, 'agricultural', 'delivery', 'no')
+    if ('access' in tags and tags['access'] in restrictions) or \
+            ('motorcar' in tags and tags['motorcar'] in restrictions) or \
+            ('motor_vehicle' in tags and tags['motor_vehicle'] in restrictions):
+        return False
+    # Remove public transport related
+    public = ('platform',)
+    if ('public_transport' in tags and tags['public_transport'] in public):
+        return False
+    return True
+
 class MultiReader:
     """Uses multiprocessing to split XML parsing and parsing nodes."""
     def __init__(self, filename=None, *args, handle_log_interval=2,
-                 max_elements_handled=10000):
+                 max_elements_handled=10000, batch_size=10000, processes=1,
+                 region=None, way_policy='clip'):
         """Initialises the reader and optionally loads a file.
 
         Params:
@@ -79,14 +415,37 @@ class MultiReader:
                                in the queue to handle. If the queue is
                                empty then the load function will move on
                                to doing other things.
+        batch_size - The maximum amount of nodes or ways the parser
+                     subprocess sends at once.
+        processes - The amount of processes that parse the XML. With more
+                    than one the file is split into shards that are
+                    parsed in a process pool, see load(). Use
+                    mp.cpu_count() to use all cores.
+        region - Only load the part of the map inside this region, a
+                 Region, a (min_lat, max_lat, min_lon, max_lon) tuple or
+                 a list of (lat, lon) corners. Nodes outside it are
+                 dropped while parsing and the bounds of the map are set
+                 to the bounding box of the region.
+        way_policy - What to do with ways that leave the region: 'clip'
+                     cuts them into the pieces inside the region, the
+                     first piece keeps the id of the way and the others
+                     get negative ids. 'inside' drops them.
         """
         self.logger = logging.getLogger('.'.join((__name__, type(self).__name__)))
-        self.nodes = {}
+        self.nodes = NodeTable()
         self.ways = {}
         self.junctions = array.array('q')
         self.graph = digraph()
 
         self.max_elements_handled = max_elements_handled
+        self.batch_size = batch_size
+        self.processes = processes
+        self.region = Region.create(region)
+        if way_policy not in ('clip', 'inside'):
+            raise ValueError("Unknown way policy {}".format(way_policy))
+        self.way_policy = way_policy
+        self._next_piece_id = -1
+        self._region_nodes = None
 
         # Set up logging
         self.logqueue = mp.Queue()
@@ -101,8 +460,16 @@ class MultiReader:
         """Parses data from an OSM file and stores it in memory.
 
         Starts a subprocess that reads the XML and parses. It is then
-        passed back through a queue and handled. OSM Data gets stored in
-        class members.
+        passed back through a pipe in batches and handled. OSM Data gets
+        stored in class members.
+
+        When more than one process is used the file is split into byte
+        ranges that start at a node, way or relation element. The ranges
+        are parsed in a process pool and their batches are handled in
+        file order, so the result is the same as with one process.
+
+        Files ending in .gz or .bz2 are decompressed while they are
+        parsed, they are always parsed by a single process.
 
         Params:
         filename - The file which holds the OSM XML
@@ -112,9 +479,47 @@ class MultiReader:
         elif len(filename) == 0:
             raise ValueError("Filename must not be empty")
 
+        # Collect the nodes in columns, starting with those of earlier
+        # loads, and turn them into a table afterwards
+        self.nodes.compact()
+        self._node_ids = array.array('q', self.nodes.ids)
+        self._node_lat = array.array('d', self.nodes.lat)
+        self._node_lon = array.array('d', self.nodes.lon)
+        self._node_tags = dict(self.nodes.tags)
+        if self.region is not None:
+            self.min_lat, self.max_lat, self.min_lon, self.max_lon = self.region.bounds
+        self._parse(filename)
+        self.nodes = NodeTable.from_columns(self._node_ids, self._node_lat, self._node_lon, self._node_tags)
+        del self._node_ids, self._node_lat, self._node_lon, self._node_tags
+        self._region_nodes = None
+        self.logger.info("Found %d nodes", len(self.nodes))
+        self.logger.info("Found %d ways", len(self.ways))
+        # Handle log one more time just to be sure
+        self._handle_log_queue(True)
+
+        # Filter the ways to remove those that can not be traveled by car
+        self._filter_noncar_ways()
+
+        # Add references from nodes to ways that reference those nodes
+        self.logger.info("Adding back-references from nodes to ways")
+        self.nodes.set_ways(self.ways)
+
+    def _parse(self, filename):
+        """Parses a file and handles the batches, see load()"""
+        if self.processes > 1 and is_compressed(filename):
+            self.logger.info("Compressed files can not be split, parsing %s in one process", filename)
+            self._load_stream(filename)
+        elif self.processes > 1:
+            self._load_shards(filename)
+        else:
+            self._load_stream(filename)
+
+    def _load_stream(self, filename):
+        """Parses a file in a single subprocess, see load()"""
         # Create and start XML parser subprocess
         receive_conn, send_conn = mp.Pipe(duplex=False)
-        parser = mp.Process(target=_xml_parser, args=(self.logqueue, send_conn, filename))
+        parser = mp.Process(target=_xml_parser, args=(self.logqueue, send_conn, filename,
+                                                          self.batch_size, self.region))
         parser.start()
 
         # Main loop
@@ -124,52 +529,54 @@ class MultiReader:
             # Handle (all) queued log messages
             self._handle_log_queue()
 
-            # Handle XML elements
+            # Handle batches of XML elements
             handled = 0
             while receive_conn.poll() and handled <= self.max_elements_handled:
-                handled += 1
-                # Get the next element in the XML file
-                elem = receive_conn.recv()
+                # Get the next batch of elements in the XML file
+                message = receive_conn.recv()
                 # Finish if there are no more elements to parse
-                if elem is None:
+                if message is None:
                     running = False
-                # Handle elements
-                else:
-                    if elem.tag == "bounds":
-                        self.min_lat = float(elem.attrib['minlat'])
-                        self.max_lat = float(elem.attrib['maxlat'])
-                        self.min_lon = float(elem.attrib['minlon'])
-                        self.max_lon = float(elem.attrib['maxlon'])
-                        self.logger.info("Area of map is defined by (%.4f, %.4f), (%.4f, %.4f)",
-                                         self.min_lat, self.min_lon,
-                                         self.max_lat, self.max_lon)
-                    elif elem.tag == "node":
-                        n = self._parse_node(elem)
-                        self.nodes[n.id] = n
-                    elif elem.tag == "way":
-                        try:
-                            w = self._parse_way(elem)
-                        except MultiReader.UnusedWayException:
-                            # This way is not used so don't register it
-                            pass
-                        else:
-                            self.ways[w.id] = w
+                    break
+                handled += self._handle_message(message)
 
         parser.join()
         self.logger.info("Finished multiprocess main loop")
-        self.logger.info("Found %d nodes", len(self.nodes))
-        self.logger.info("Found %d ways", len(self.ways))
-        # Handle log one more time just to be sure
-        self._handle_log_queue(True)
-
-        # Filter the ways to remove those that can not be traveled by car
-        self._filter_noncar_ways()
 
-        # Add references from nodes to ways that reference those nodes
-        self.logger.info("Adding back-references from nodes to ways")
-        for way in self.ways:
-            for node in self.ways[way].nodes:
-                self.nodes[node].ways.append(way)
+    def _load_shards(self, filename):
+        """Parses a file in shards using a process pool, see load()"""
+        shards = _find_shards(filename, self.processes * 4)
+        self.logger.info("Parsing %s in %d shards using %d processes", filename, len(shards), self.processes)
+        tasks = [ (filename, start, end, self.batch_size, i == len(shards) - 1, self.region)
+                  for i, (start, end) in enumerate(shards) ]
+        with mp.Pool(self.processes, _init_shard_parser, (self.logqueue,)) as pool:
+            # imap returns the shards in file order
+            for messages in pool.imap(_star_parse_shard, tasks):
+                self._handle_log_queue()
+                for message in messages:
+                    self._handle_message(message)
+        self.logger.info("Finished parsing shards")
+
+    def _handle_message(self, message):
+        """Handles a message from a parser
+
+        Returns the amount of elements in the message.
+        """
+        kind = message[0]
+        if kind == NODE_BATCH:
+            return self._handle_nodes(*message[1:])
+        elif kind == WAY_BATCH:
+            return self._handle_ways(*message[1:])
+        elif kind == BOUNDS:
+            if self.region is not None:
+                # The bounds of the region are used instead
+                return 1
+            self.min_lat, self.max_lat, self.min_lon, self.max_lon = message[1]
+            self.logger.info("Area of map is defined by (%.4f, %.4f), (%.4f, %.4f)",
+                             self.min_lat, self.min_lon,
+                             self.max_lat, self.max_lon)
+            return 1
+        return 0
 
     def _handle_log_queue(self, ignore_timer=False):
         """Reads log records in queue and passes them on to be logged.
@@ -200,70 +607,90 @@ class MultiReader:
             pass
         self.log_last_handled = time.time()
 
-    def _parse_node(self, elem):
-        """Parses a node XML element to the Node class.
+    def _handle_nodes(self, ids, coords, tags):
+        """Stores a batch of nodes sent by the parser subprocess
+
+        Returns the amount of nodes in the batch.
 
         Params:
-        elem - an XML Element that has a node tag (does not check
-               whether it is actually a node tag)
+        ids - The ids of the nodes
+        coords - The latitude and longitude of every node, one after
+                 the other
+        tags - The tags of nodes that have them by position in the batch
         """
-        n = Node(elem.attrib['id'], elem.attrib['lat'], elem.attrib['lon'])
-        n.tags = self._parse_tags(elem)
-        return n
+        first = len(self._node_ids)
+        self._node_ids.extend(ids)
+        self._node_lat.extend(coords[0::2])
+        self._node_lon.extend(coords[1::2])
+        for i, node_tags in tags.items():
+            self._node_tags[first + i] = node_tags
+        if self._region_nodes is not None:
+            self._region_nodes.update(ids)
+        return len(ids)
 
-    def _parse_way(self, elem):
-        """Parses a way XML element to the Way class.
+    def _handle_ways(self, ids, offsets, refs, tags):
+        """Stores a batch of ways sent by the parser subprocess
 
-        Raises an exception when a way is not a 'highway', buildings,
-        fields, lakes and others are all described by ways but they are
-        useless for pathfinding. The exception is meant to filter these.
+        Returns the amount of ways in the batch.
 
         Params:
-        elem - an XML Element that has a way tag (does not check whether
-               it is actually a way tag)
+        ids - The ids of the ways
+        offsets - The start of the nodes of every way in refs, plus the
+                  end of the last way
+        refs - The ids of the nodes of all ways
+        tags - The tags of every way
         """
-        w = Way(elem.attrib['id'])
-        w.tags = self._parse_tags(elem)
-        if 'highway' not in w.tags.keys():
-            raise MultiReader.UnusedWayException
-        w.nodes = [int(node.attrib['ref']) for node in elem.findall('nd')]
-        return w
+        ways = self.ways
+        for i, id in enumerate(ids):
+            nodes = refs[offsets[i]:offsets[i+1]].tolist()
+            if self.region is not None:
+                for piece_id, piece in self._clip_way(id, nodes):
+                    w = Way(piece_id)
+                    w.tags = tags[i]
+                    w.nodes = piece
+                    ways[piece_id] = w
+                continue
+            w = Way(id)
+            w.tags = tags[i]
+            w.nodes = nodes
+            ways[id] = w
+        return len(ids)
 
-    def _parse_tags(self, elem):
-        """Parses all 'tag' subtags of a XML Element
+    def _clip_way(self, id, nodes):
+        """Cuts a way into the pieces inside the region
 
-        Is given a XML Element and parses all children which are a tag.
-        It tries to convert the value of the tag to int or float if
-        possible.
+        Returns a list of (id, nodes) tuples following the way policy,
+        see the constructor. Pieces of a single node are dropped.
 
         Params:
-        elem - an XML Element that possibly contains one or more 'tag'
-               child elements.
+        id - The id of the way
+        nodes - The ids of the nodes of the way
         """
-        if elem.find("tag") == None:
-            return {}
-        ret = {}
-        for tag in elem.findall("tag"):
-            key = tag.attrib['k']
-            value = tag.attrib['v']
-
-            # Try to convert the tag to a boolean
-            if value.lower in ('t', 'true', 'y', 'yes'):
-                ret[key] = True
-                continue
-            elif value.lower in ('f', 'false', 'n', 'no'):
-                ret[key] = False
+        if self._region_nodes is None:
+            # Nodes come before ways in OSM files, so all nodes in the
+            # region are known by now
+            self._region_nodes = set(self._node_ids)
+        inside = self._region_nodes
+        if self.way_policy == 'inside':
+            return [(id, nodes)] if all(node in inside for node in nodes) else []
+
+        pieces = []
+        piece = []
+        for node in nodes + [None]:
+            if node in inside:
+                piece.append(node)
                 continue
-
-            # Try to convert the tag to a integer
-            if value.isdigit():
-                ret[key] = int(value)
-                continue
-            try:
-                ret[key] = float(value)
-            except:
-                ret[key] = value
-        return ret
+            if len(piece) > 1:
+                pieces.append(piece)
+            piece = []
+        result = []
+        for i, piece in enumerate(pieces):
+            if i == 0:
+                result.append((id, piece))
+            else:
+                result.append((self._next_piece_id, piece))
+                self._next_piece_id -= 1
+        return result
 
     def filter_unused_nodes(self, aggressive=False):
         """Removes certain nodes from the list.
@@ -276,36 +703,106 @@ class MultiReader:
                      data
         """
         self.logger.info("Removing unused nodes")
+        self.nodes.compact()
         keep = set()
 
         # All nodes that are part of a way should be kept
         for way in self.ways:
-            keep.update(self.ways[way].nodes)
+            keep.update(self.nodes.index(node) for node in self.ways[way].nodes)
 
         if not aggressive:
-            keep.update([node for node in self.nodes if len(self.nodes[node].tags) > 0])
+            keep.update(self.nodes.tags)
 
         self.logger.info("Removing %d nodes", len(self.nodes) - len(keep))
-        # Build a new dict out of the IDs stored in the set, then move
-        # it to the class variable
-        new = {}
-        while keep:
-            node = keep.pop()
-            new[node] = self.nodes[node]
-        self.nodes = new
+        # Build a new table out of the positions stored in the set, then
+        # move it to the class variable
+        self.nodes = self.nodes.select(sorted(keep))
+
+    def apply_changes(self, changes):
+        """Applies the changes of an osmChange file to the nodes and ways
+
+        Only the changed nodes and ways are touched, so the time this
+        takes depends on the size of the changes and not on the size of
+        the map. Changed ways that can't be travelled by car are removed
+        like they are when loading, ways that use a node that is not
+        loaded are skipped. With a region, nodes outside it are ignored
+        and ways that use them are removed.
+
+        Returns the ids of the created, modified and deleted ways and
+        the ids of the nodes that moved or became or stopped being a
+        junction. Pass both to DirectionalGraphBuilder.update() to
+        update a graph built from this reader.
+
+        Params:
+        changes - A ChangeSet, see osmreader.changes.read_changes()
+        """
+        if self.region is not None and self.way_policy == 'clip':
+            raise ValueError("Changes can't be applied to ways that are clipped to a region")
+        nodes = self.nodes
+        ways = set()
+        moved = set()
+        # The amount of ways of every touched node before the changes
+        before = {}
+
+        def remove_way(id):
+            way = self.ways.pop(id, None)
+            if way is None:
+                return
+            ways.add(id)
+            for node in way.nodes:
+                before.setdefault(node, len(nodes[node].ways))
+                nodes.remove_way(node, id)
+
+        for id, node in changes.nodes.items():
+            if self.region is not None and not self.region.contains(node.lat, node.lon):
+                if id in nodes:
+                    for way in set(nodes[id].ways):
+                        remove_way(way)
+                    nodes.delete(id)
+                continue
+            if id in nodes:
+                old = nodes[id]
+                if (old.lat, old.lon) != (node.lat, node.lon):
+                    moved.add(id)
+            nodes.set_node(id, node.lat, node.lon, node.tags)
+
+        for id in changes.deleted_ways | changes.ways.keys():
+            remove_way(id)
+        skipped = 0
+        for id, way in changes.ways.items():
+            if 'highway' not in way.tags or not is_car_way(way.tags):
+                continue
+            if not all(node in nodes for node in way.nodes):
+                skipped += 1
+                continue
+            self.ways[id] = way
+            ways.add(id)
+            for node in way.nodes:
+                before.setdefault(node, len(nodes[node].ways))
+                nodes.add_way(node, id)
+
+        for id in changes.deleted_nodes:
+            if id in nodes and not nodes[id].ways:
+                nodes.delete(id)
+        if skipped:
+            self.logger.warning("Skipped %d changed ways that use nodes which are not loaded", skipped)
+
+        junctions = set( node for node, count in before.items()
+                         if node in nodes and (count > 1) != (len(nodes[node].ways) > 1) )
+        self.logger.info("Changed %d ways, moved %d nodes and changed %d junctions",
+                         len(ways), len(moved), len(junctions))
+        return ways, moved | junctions
 
     def find_bounds(self):
         """Find map bounds when the file didn't specify them"""
         try:
             self.min_lat
         except AttributeError:
-            self.min_lat = self.min_lon = 180
-            self.max_lat =  self.max_lon = -180
-            for id, n in self.nodes.items():
-                self.min_lat = min(self.min_lat, n.lat)
-                self.max_lat = max(self.max_lat, n.lat)
-                self.min_lon = min(self.min_lon, n.lon)
-                self.max_lon = max(self.max_lon, n.lon)
+            self.nodes.compact()
+            self.min_lat = min(self.nodes.lat, default=180)
+            self.max_lat = max(self.nodes.lat, default=-180)
+            self.min_lon = min(self.nodes.lon, default=180)
+            self.max_lon = max(self.nodes.lon, default=-180)
         self.logger.info("Area of map is defined by (%.4f, %.4f), (%.4f, %.4f)",
                          self.min_lat, self.min_lon,
                          self.max_lat, self.max_lon)
@@ -313,31 +810,11 @@ class MultiReader:
     def _filter_noncar_ways(self):
         """Removes all ways that can't be travelled by car."""
         self.logger.info("Removing all non-car ways")
-        remove = set()
-        # Remove based on highway type
-        types = ('cycleway', 'path', 'footway', 'steps', 'services',
-                 'pedestrian', 'bus_guideway', 'track')
-        for way_id, way in self.ways.items():
-            if way.tags['highway'] in types:
-                remove.add(way_id)
-        # Remove based on access restrictions
-        restrictions = (False, 'agricultural', 'delivery', 'no')
-        for way_id, way in self.ways.items():
-            if ('access' in way.tags and way.tags['access'] in restrictions) or \
-                    ('motorcar' in way.tags and way.tags['motorcar'] in restrictions) or \
-                    ('motor_vehicle' in way.tags and way.tags['motor_vehicle'] in restrictions):
-                remove.add(way_id)
-        # Remove public transport related
-        public = ('platform',)
-        for way_id, way in self.ways.items():
-            if ('public_transport' in way.tags and way.tags['public_transport'] in public):
-                remove.add(way_id)
-
+        remove = [ way_id for way_id, way in self.ways.items() if not is_car_way(way.tags) ]
 
         self.logger.info("Removing %d ways that can't be travelled by car", len(remove))
         # Remove the ways
-        while remove:
-            way = remove.pop()
+        for way in remove:
             del self.ways[way]
 
     class UnusedWayException(Exception):
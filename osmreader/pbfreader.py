@@ -0,0 +1,298 @@
+import collections
+import logging
+import multiprocessing as mp
+import struct
+import time
+import zlib
+
+from osmreader.multireader import MultiReader, BOUNDS, _NodeBatch, _WayBatch, \
+                                  _init_shard_parser, _keep_batch, tag_value
+
+logger = logging.getLogger(__name__)
+
+# The features a file may require that this reader supports
+SUPPORTED_FEATURES = frozenset(('OsmSchema-V0.6', 'DenseNodes', 'HistoricalInformation'))
+# Limits set by the PBF format
+_MAX_HEADER_SIZE = 64*1024
+_MAX_BLOB_SIZE = 32*1024*1024
+
+class PBFReader(MultiReader):
+    """Reads OSM PBF files into the same structures as MultiReader."""
+    def __init__(self, filename=None, *, processes=None, **kwargs):
+        """Initialises the reader and optionally loads a file.
+
+        The file is read in the main process, the blocks are decompressed
+        and decoded by a pool of worker processes. Decoded blocks are
+        handled in file order, so the nodes and ways are the same as when
+        the file would have been converted to XML and read by
+        MultiReader.
+
+        Params:
+        filename - Name of a .osm.pbf file to load. If the argument is
+                   None (default) then you need to call the load method
+                   yourself.
+        processes - The amount of processes that decode blocks, all
+                    cores when None. With 1 the blocks are decoded in
+                    the main process.
+        See MultiReader for the other parameters.
+        """
+        if processes is None:
+            processes = mp.cpu_count()
+        super(PBFReader, self).__init__(filename, processes=processes, **kwargs)
+
+    def _parse(self, filename):
+        """Reads the blocks of a PBF file and handles them, see load()"""
+        self.logger.info("Decoding %s using %d processes", filename, self.processes)
+        start_time = time.perf_counter()
+        with open(filename, 'rb') as f:
+            blocks = _read_blocks(f)
+            tasks = self._data_blocks(blocks)
+            if self.processes > 1:
+                with mp.Pool(self.processes, _init_shard_parser, (self.logqueue,)) as pool:
+                    # Keep a few blocks per process in flight, so blocks are
+                    # decoded in parallel without reading the whole file
+                    pending = collections.deque()
+                    for task in tasks:
+                        pending.append(pool.apply_async(_decode_block, task))
+                        if len(pending) >= self.processes * 2:
+                            self._handle_messages(pending.popleft().get())
+                    while pending:
+                        self._handle_messages(pending.popleft().get())
+            else:
+                for task in tasks:
+                    self._handle_messages(_decode_block(*task))
+        self.logger.info("Decoded %s in %f sec", filename, time.perf_counter() - start_time)
+
+    def _data_blocks(self, blocks):
+        """Handles the header block and yields the arguments to decode data blocks"""
+        for kind, blob in blocks:
+            if kind == 'OSMHeader':
+                self._handle_header(_read_blob(blob))
+            elif kind == 'OSMData':
+                yield (blob, self.batch_size, self.region)
+            else:
+                self.logger.debug("Skipping a block of unknown type %s", kind)
+
+    def _handle_messages(self, messages):
+        """Handles the messages of a decoded block"""
+        self._handle_log_queue()
+        for message in messages:
+            self._handle_message(message)
+
+    def _handle_header(self, data):
+        """Checks the required features and reads the bounding box of a file"""
+        for number, wire, value in _fields(data):
+            if number == 1:
+                # HeaderBBox, in nanodegrees
+                box = {}
+                for box_number, box_wire, box_value in _fields(value):
+                    box[box_number] = _zigzag(box_value) / 1e9
+                if len(box) == 4:
+                    self._handle_message((BOUNDS, (box[4], box[3], box[1], box[2])))
+            elif number == 4:
+                feature = str(value, 'utf-8')
+                if feature not in SUPPORTED_FEATURES:
+                    raise ValueError("The PBF file requires the unsupported feature {}".format(feature))
+
+
+def _read_blocks(f):
+    """Yields the type and the raw blob of every block in a PBF file"""
+    while True:
+        size = f.read(4)
+        if not size:
+            return
+        if len(size) < 4:
+            raise ValueError("The PBF file is truncated")
+        length, = struct.unpack('>I', size)
+        if length > _MAX_HEADER_SIZE:
+            raise ValueError("The PBF file has a block header of {} bytes".format(length))
+        kind = None
+        datasize = 0
+        for number, wire, value in _fields(f.read(length)):
+            if number == 1:
+                kind = str(value, 'utf-8')
+            elif number == 3:
+                datasize = value
+        if datasize > _MAX_BLOB_SIZE:
+            raise ValueError("The PBF file has a block of {} bytes".format(datasize))
+        blob = f.read(datasize)
+        if len(blob) < datasize:
+            raise ValueError("The PBF file is truncated")
+        yield kind, blob
+
+def _read_blob(blob):
+    """Returns the uncompressed data of a Blob message"""
+    raw_size = None
+    for number, wire, value in _fields(blob):
+        if number == 1:
+            return bytes(value)
+        elif number == 2:
+            raw_size = value
+        elif number == 3:
+            data = zlib.decompress(value)
+            if raw_size is not None and len(data) != raw_size:
+                raise ValueError("A PBF block has the wrong size after decompressing")
+            return data
+        elif number in (4, 5, 6, 7):
+            raise ValueError("The PBF file uses an unsupported compression")
+    raise ValueError("A PBF block has no data")
+
+def _decode_block(blob, batch_size, region):
+    """Decodes a PrimitiveBlock, ran in a process pool
+
+    Returns the list of messages that _xml_parser would have sent for
+    the elements in the block: batches of nodes and highways.
+
+    Params:
+    blob - The raw Blob message of the block
+    batch_size - The maximum amount of elements in a batch
+    region - The Region to keep the nodes of, None keeps all nodes
+    """
+    data = memoryview(_read_blob(blob))
+    strings = []
+    groups = []
+    granularity = 100
+    lat_offset = lon_offset = 0
+    for number, wire, value in _fields(data):
+        if number == 1:
+            strings = [ str(s, 'utf-8') for n, w, s in _fields(value) if n == 1 ]
+        elif number == 2:
+            groups.append(value)
+        elif number == 17:
+            granularity = value
+        elif number == 19:
+            lat_offset = _signed(value)
+        elif number == 20:
+            lon_offset = _signed(value)
+
+    # Tags are converted like the tags in XML files
+    values = {}
+    def tag(key, value):
+        if value not in values:
+            values[value] = tag_value(strings[value])
+        return strings[key], values[value]
+
+    messages = []
+    batch = None
+    def node(id, lat, lon, tags):
+        nonlocal batch
+        # Dividing the integers gives the same floats as parsing the XML
+        lat = (lat_offset + granularity * lat) / 1e9
+        lon = (lon_offset + granularity * lon) / 1e9
+        if region is not None and not region.contains(lat, lon):
+            return
+        if not isinstance(batch, _NodeBatch):
+            _keep_batch(messages, batch)
+            batch = _NodeBatch()
+        batch.append(id, lat, lon, tags)
+        if len(batch) >= batch_size:
+            _keep_batch(messages, batch)
+            batch = None
+
+    for group in groups:
+        for number, wire, value in _fields(group):
+            if number == 1:
+                fields = _message(value)
+                tags = dict(tag(k, v) for k, v in zip(_packed(fields.get(2, b'')),
+                                                      _packed(fields.get(3, b''))))
+                node(_zigzag(fields.get(1, 0)), _zigzag(fields.get(8, 0)), _zigzag(fields.get(9, 0)), tags)
+            elif number == 2:
+                fields = _message(value)
+                ids = _delta(_packed(fields.get(1, b''), True))
+                lats = _delta(_packed(fields.get(8, b''), True))
+                lons = _delta(_packed(fields.get(9, b''), True))
+                keys_vals = _packed(fields.get(10, b''))
+                position = 0
+                for i in range(len(ids)):
+                    tags = {}
+                    while position < len(keys_vals) and keys_vals[position] != 0:
+                        k, v = tag(keys_vals[position], keys_vals[position+1])
+                        tags[k] = v
+                        position += 2
+                    position += 1
+                    node(ids[i], lats[i], lons[i], tags)
+            elif number == 3:
+                fields = _message(value)
+                tags = dict(tag(k, v) for k, v in zip(_packed(fields.get(2, b'')),
+                                                      _packed(fields.get(3, b''))))
+                if 'highway' not in tags:
+                    continue
+                if not isinstance(batch, _WayBatch):
+                    _keep_batch(messages, batch)
+                    batch = _WayBatch()
+                batch.append(_signed(fields.get(1, 0)), _delta(_packed(fields.get(8, b''), True)), tags)
+                if len(batch) >= batch_size:
+                    _keep_batch(messages, batch)
+                    batch = None
+    _keep_batch(messages, batch)
+    return messages
+
+def _varint(data, position):
+    """Decodes the varint at a position, returns it and the next position"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+def _zigzag(value):
+    """Decodes a zigzag encoded sint"""
+    return (value >> 1) ^ -(value & 1)
+
+def _signed(value):
+    """Decodes a two's complement int64 read as varint"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _fields(data):
+    """Yields the number, wire type and value of the fields of a message
+
+    Varints and fixed width values are returned as int, length delimited
+    values as a slice of data.
+    """
+    position = 0
+    end = len(data)
+    while position < end:
+        key, position = _varint(data, position)
+        number = key >> 3
+        wire = key & 7
+        if wire == 0:
+            value, position = _varint(data, position)
+        elif wire == 2:
+            length, position = _varint(data, position)
+            value = data[position:position+length]
+            position += length
+        elif wire == 1:
+            value = int.from_bytes(data[position:position+8], 'little')
+            position += 8
+        elif wire == 5:
+            value = int.from_bytes(data[position:position+4], 'little')
+            position += 4
+        else:
+            raise ValueError("Unsupported protobuf wire type {}".format(wire))
+        yield number, wire, value
+
+def _message(data):
+    """Returns the fields of a message as a dict, the last value wins"""
+    return { number: value for number, wire, value in _fields(data) }
+
+def _packed(data, zigzag=False):
+    """Decodes a packed repeated varint field"""
+    values = []
+    position = 0
+    end = len(data)
+    while position < end:
+        value, position = _varint(data, position)
+        values.append(value)
+    if zigzag:
+        return [ (value >> 1) ^ -(value & 1) for value in values ]
+    return values
+
+def _delta(values):
+    """Undoes delta coding in place and returns the values"""
+    for i in range(1, len(values)):
+        values[i] += values[i-1]
+    return values
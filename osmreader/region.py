@@ -0,0 +1,69 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Region:
+    def __init__(self, polygon):
+        """An area of the map that loading can be restricted to
+
+        Points on the border count as inside for bounding boxes, for
+        other polygons points exactly on the border may fall either way.
+
+        Params:
+        polygon - The corners of the area as (lat, lon) tuples, the
+                  polygon is closed automatically
+        """
+        self.polygon = [ (float(lat), float(lon)) for lat, lon in polygon ]
+        if len(self.polygon) < 3:
+            raise ValueError("A region needs at least 3 corners")
+        lats = [ lat for lat, lon in self.polygon ]
+        lons = [ lon for lat, lon in self.polygon ]
+        self.min_lat = min(lats)
+        self.max_lat = max(lats)
+        self.min_lon = min(lons)
+        self.max_lon = max(lons)
+        self.is_box = len(self.polygon) == 4 and \
+            set(lats) == {self.min_lat, self.max_lat} and set(lons) == {self.min_lon, self.max_lon} and \
+            len(set(self.polygon)) == 4
+
+    @classmethod
+    def from_bbox(cls, min_lat, max_lat, min_lon, max_lon):
+        """Creates a region from a bounding box"""
+        return cls([(min_lat, min_lon), (min_lat, max_lon), (max_lat, max_lon), (max_lat, min_lon)])
+
+    @classmethod
+    def create(cls, region):
+        """Converts the region arguments of the readers to a Region
+
+        Params:
+        region - A Region, a (min_lat, max_lat, min_lon, max_lon) tuple
+                 or a list of (lat, lon) corners
+        """
+        if region is None or isinstance(region, Region):
+            return region
+        region = list(region)
+        if len(region) == 4 and all(isinstance(value, (int, float)) for value in region):
+            return cls.from_bbox(*region)
+        return cls(region)
+
+    @property
+    def bounds(self):
+        """The bounding box as (min_lat, max_lat, min_lon, max_lon)"""
+        return (self.min_lat, self.max_lat, self.min_lon, self.max_lon)
+
+    def contains(self, lat, lon):
+        """Returns whether a point lies in the region"""
+        if lat < self.min_lat or lat > self.max_lat or lon < self.min_lon or lon > self.max_lon:
+            return False
+        if self.is_box:
+            return True
+        # Count the edges that a ray from the point crosses
+        inside = False
+        polygon = self.polygon
+        lat1, lon1 = polygon[-1]
+        for lat2, lon2 in polygon:
+            if (lat1 > lat) != (lat2 > lat) and \
+                    lon < lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1):
+                inside = not inside
+            lat1, lon1 = lat2, lon2
+        return inside
@@ -1,7 +1,15 @@
 import logging
 
-from planners.iterdeep import iterative_deepening
+from planners.iterdeep import iterative_deepening, ida_star
 from planners.exporters import GraphPathExporter, GraphAstarExporter
 from planners.astar import Astar
+from planners.bidirectional import bidirectional_search
+from planners.heuristics import CrowFliesHeuristic
+from planners.landmarks import LandmarkHeuristic
+from planners.ch import ContractionHierarchy
+from planners.csr import CSRGraph
+from planners.snapshot import save_snapshot, load_snapshot, StaleSnapshotError
+from planners.matrix import distance_matrix, DistanceMatrix
+from planners.cache import RouteCache
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
@@ -1,14 +1,15 @@
-import geopy.distance as gdistance
-import heapq
 import logging
 import time
 
+import geodesic
 from planners.common import *
+from planners.csr import CSRGraph, EDGE_ENTERS_END, EDGE_LEAVES_START, EDGE_LEAVES_END
 from planners.exporters import GraphAstarExporter
+from planners.heuristics import CrowFliesHeuristic
 
 logger = logging.getLogger(__name__)
 
-def Astar(graph, start, goal, with_data=False):
+def Astar(graph, start, goal, with_data=False, heuristic=None):
     """Finds a path in a graph using the A* algorithm
 
     Params:
@@ -18,72 +19,149 @@ def Astar(graph, start, goal, with_data=False):
     with_data - When False will only return the path that has been
                 found. When True will return a tuple of the path, the
                 open set and the closed set.
+    heuristic - The object used to estimate h(n), see
+                planners.heuristics.CrowFliesHeuristic (default). Reuse
+                the same object for multiple searches on a graph to
+                avoid recalculating estimates.
+
+    The graph can be a pygraph digraph or a planners.csr.CSRGraph, the
+    latter is much faster. Sections of a CSRGraph are numbered, use its
+    index() and name() methods to convert from and to section names.
     """
     logger = logging.getLogger('.'.join((__name__, 'A*')))
     logger.info('Using A* to plan a route from %s to %s', start, goal)
 
-    fringe = []
+    if heuristic is None:
+        heuristic = CrowFliesHeuristic(graph)
+    if isinstance(graph, CSRGraph):
+        return _Astar_csr(graph, start, goal, with_data, heuristic, logger)
+
+    traversal = is_traversal_graph(graph)
+    fringe = PriorityQueue()
     closed = set()
     ancestors = {}
     g = {}
     g[start] = 0
 
-    heapq.heappush(fringe, (predicted_cost(graph, start, goal), start))
+    fringe.push(start, heuristic.estimate(start, goal))
 
     start_time = time.perf_counter()
     while fringe:
-        cur_cost, current = heapq.heappop(fringe)
+        cur_cost, current = fringe.pop()
         if current == goal:
             path = construct_path(ancestors, current)
             logger.info('Found a path with length %d using A* in %f sec. Sections searched: %d, sections to search: %d',
                         len(path), time.perf_counter() - start_time, len(closed), len(fringe))
             if with_data:
-                open_set = [ item[1] for item in fringe ]
-                return (path, open_set, closed)
+                return (path, fringe.items(), closed)
             return path
 
         closed.add(current)
 
         neighbours = graph.neighbors(current)
-        if current != start:
+        exit_node = None
+        if current != start and not traversal:
             entered_side = find_side_entered(graph, ancestors[current], current)
             if entered_side == ENTERED_START:
-                exit_node = graph.node_attributes(current)['end_point']
+                exit_node = graph.node_attributes(current)['end_node']
             else:
-                exit_node = graph.node_attributes(current)['start_point']
+                exit_node = graph.node_attributes(current)['start_node']
             neighbours = filter_neighbours(graph, entered_side, current, neighbours)
 
-        for neighbour in neighbours:
-            # Skip a neighbour if we have already expanded it
-            if neighbour in closed:
-                continue
+        new_g = g[current] + graph.node_attributes(current)['length']
+        # Skip neighbours that have been expanded or that are already
+        # queued with a better cost
+        update = [ n for n in neighbours if n not in closed and
+                  (n not in fringe or new_g < g[n]) ]
+        if not update:
+            continue
+        if traversal and current != start:
+            # Traversals are always entered at their start
+            sides = [ENTERED_START] * len(update)
+        elif exit_node is None:
+            sides = None
+        else:
+            sides = [ ENTERED_START if graph.node_attributes(n)['start_node'] == exit_node else ENTERED_END
+                      for n in update ]
+        for neighbour, h in zip(update, heuristic.estimate_many(update, goal, sides)):
+            ancestors[neighbour] = current
+            g[neighbour] = new_g
+            # Adds the neighbour or updates its position in the fringe
+            fringe.push(neighbour, new_g + h)
+    logger.info('No path found using A* in %f sec. Sections searched: %d',
+                time.perf_counter() - start_time, len(closed))
+    if with_data:
+        return (None, fringe.items(), closed)
+    return None
+
+def _Astar_csr(graph, start, goal, with_data, heuristic, logger):
+    """A* implementation that works directly on the arrays of a CSRGraph
+
+    Instead of comparing section attributes to filter neighbours it
+    uses the edge flags that were calculated when the graph was built.
+    See Astar() for the parameters.
+    """
+    fringe = PriorityQueue()
+    closed = set()
+    ancestors = {}
+    entered = {}
+    g = {}
+    g[start] = 0
 
-            new_g = g[current] + graph.node_attributes(current)['length']
-
-            for cost, section in fringe:
-                if section == neighbour and new_g < cost:
-                    # Update neighbour in the fringe
-                    ancestors[neighbour] = current
-                    g[neighbour] = new_g
-                    if current != start:
-                        f = new_g + predicted_cost_fast(graph, neighbour, goal, exit_node)
-                    else:
-                        f = new_g + predicted_cost(graph, neighbour, goal)
-                    # Replace the element in the fringe
-                    fringe.remove( (cost, section) )
-                    heapq.heapify(fringe)
-                    heapq.heappush(fringe, (f, neighbour))
-                    break
-            else:
-                # Neighbour is not in the fringe yet
-                ancestors[neighbour] = current
-                g[neighbour] = new_g
-                if current != start:
-                    f = new_g + predicted_cost_fast(graph, neighbour, goal, exit_node)
-                else:
-                    f = new_g + predicted_cost(graph, neighbour, goal)
-                heapq.heappush(fringe, (f, neighbour))
-    print("fell through")
+    offsets = graph.offsets
+    targets = graph.targets
+    flags = graph.edge_flags
+    length = graph.length
+
+    fringe.push(start, heuristic.estimate(start, goal))
+
+    start_time = time.perf_counter()
+    while fringe:
+        cur_cost, current = fringe.pop()
+        if current == goal:
+            path = construct_path(ancestors, current)
+            logger.info('Found a path with length %d using A* in %f sec. Sections searched: %d, sections to search: %d',
+                        len(path), time.perf_counter() - start_time, len(closed), len(fringe))
+            if with_data:
+                return (path, fringe.items(), closed)
+            return path
+
+        closed.add(current)
+
+        # Only leave a section at the opposite end of where it was entered
+        if current == start or graph.traversal:
+            leaves = EDGE_LEAVES_START | EDGE_LEAVES_END
+        elif entered[current] == ENTERED_START:
+            leaves = EDGE_LEAVES_END
+        else:
+            leaves = EDGE_LEAVES_START
+
+        new_g = g[current] + length[current]
+        update = []
+        sides = []
+        for edge in range(offsets[current], offsets[current+1]):
+            if not flags[edge] & leaves:
+                continue
+            neighbour = targets[edge]
+            # Skip neighbours that have been expanded or that are already
+            # queued with a better cost
+            if neighbour in closed or (neighbour in fringe and new_g >= g[neighbour]):
+                continue
+            update.append(neighbour)
+            sides.append(ENTERED_END if flags[edge] & EDGE_ENTERS_END else ENTERED_START)
+        if not update:
+            continue
+        estimates = heuristic.estimate_many(update, goal, sides if current != start else None)
+        for neighbour, side, h in zip(update, sides, estimates):
+            ancestors[neighbour] = current
+            entered[neighbour] = side
+            g[neighbour] = new_g
+            fringe.push(neighbour, new_g + h)
+    logger.info('No path found using A* in %f sec. Sections searched: %d',
+                time.perf_counter() - start_time, len(closed))
+    if with_data:
+        return (None, [], closed)
+    return None
 
 def cost(graph, path):
     """Calculates g(n) based on the length of a path
@@ -104,10 +182,8 @@ def predicted_cost(graph, current, goal):
     """
     cattrs = graph.node_attributes(current)
     gattrs = graph.node_attributes(goal)
-    return min(gdistance.distance(cattrs['start_point'], gattrs['start_point']).m,
-               gdistance.distance(cattrs['start_point'], gattrs['end_point']).m,
-               gdistance.distance(cattrs['end_point'], gattrs['start_point']).m,
-               gdistance.distance(cattrs['end_point'], gattrs['end_point']).m)
+    return min(_distances((cattrs['start_point'], cattrs['end_point']),
+                          (gattrs['start_point'], gattrs['end_point'])))
 
 
 def predicted_cost_fast(graph, current, goal, entered_node):
@@ -128,11 +204,15 @@ def predicted_cost_fast(graph, current, goal, entered_node):
     cattrs = graph.node_attributes(current)
     gattrs = graph.node_attributes(goal)
     if cattrs['start_point'] == entered_node:
-        return min(gdistance.distance(cattrs['end_point'], gattrs['start_point']).m,
-                   gdistance.distance(cattrs['end_point'], gattrs['end_point']).m)
+        return min(_distances((cattrs['end_point'],), (gattrs['start_point'], gattrs['end_point'])))
     else:
-        return min(gdistance.distance(cattrs['start_point'], gattrs['start_point']).m,
-                   gdistance.distance(cattrs['start_point'], gattrs['end_point']).m)
+        return min(_distances((cattrs['start_point'],), (gattrs['start_point'], gattrs['end_point'])))
+
+def _distances(points, others):
+    """Calculates the geodesics from all points to all others in one batch"""
+    pairs = [ (p, q) for p in points for q in others ]
+    return geodesic.distances([ p[0] for p, q in pairs ], [ p[1] for p, q in pairs ],
+                              [ q[0] for p, q in pairs ], [ q[1] for p, q in pairs ])
 
 def construct_path(ancestors, end):
     """Constructs the path based on ancestor information
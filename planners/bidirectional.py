@@ -0,0 +1,172 @@
+import logging
+import math
+import time
+
+from planners.common import *
+
+logger = logging.getLogger(__name__)
+
+def bidirectional_search(graph, start, goal, with_data=False, heuristic=None):
+    """Finds a path by searching from both the start and the goal
+
+    The forward search follows the neighbours of sections, the backward
+    search follows the incidents (predecessors). Both searches only
+    continue at the opposite end of where a section was entered, just
+    like Astar. The searches keep the best cost of every (section,
+    entered side) state instead of every section: the shortest way to a
+    section is not always the shortest way to leave it at the end the
+    route needs, and without the side a meeting of both searches can't
+    prove the route optimal. The start may be left through either end
+    and the goal may be entered from either end. The direction with the
+    smaller fringe is expanded first.
+
+    Without a heuristic this is a bidirectional Dijkstra search that
+    stops when the smallest costs in both fringes together can not
+    improve the best path. With a heuristic it is a symmetric
+    bidirectional A* search that stops when either smallest estimated
+    cost can not improve the best path. The backward search needs a
+    lower bound of the cost from the start, the heuristic must offer
+    that as estimate_reverse().
+
+    Params:
+    graph - The graph to do the search in
+    start - The start node
+    goal - The goal node of the search
+    with_data - When False will only return the path that has been
+                found. When True will return a tuple of the path, the
+                open set and the closed set of both directions combined.
+    heuristic - The object used to estimate h(n), for example
+                planners.heuristics.CrowFliesHeuristic. When None both
+                searches are Dijkstra searches.
+    """
+    logger = logging.getLogger('.'.join((__name__, 'bidirectional_search')))
+    logger.info('Using bidirectional search to plan a route from %s to %s', start, goal)
+    if heuristic is not None and not hasattr(heuristic, 'estimate_reverse'):
+        raise ValueError("{} can't estimate the cost from the start for the backward search".format(
+                         type(heuristic).__name__))
+
+    traversal = is_traversal_graph(graph)
+    # Traversals are always entered at their start
+    sides = (ENTERED_START,) if traversal else (ENTERED_START, ENTERED_END)
+    fringes = (PriorityQueue(), PriorityQueue())
+    closed = (set(), set())
+    # The costs of states: the cost up to entering a section forward, the
+    # cost from entering a section up to the goal backward
+    g = ({}, {})
+    # The state before another state in the forward direction and the
+    # state after another state in the backward direction
+    parents = ({}, {})
+    best = math.inf
+    meeting = None
+    path = None
+
+    if start == goal:
+        best, path = 0.0, [start]
+    else:
+        g[0][(start, None)] = 0.0
+        fringes[0].push((start, None), _estimate(heuristic, start, goal))
+        for side in sides:
+            g[1][(goal, side)] = 0.0
+            fringes[1].push((goal, side), _estimate_reverse(heuristic, goal, start, side))
+
+    start_time = time.perf_counter()
+    while fringes[0] and fringes[1]:
+        top_forward = fringes[0].peek()[0]
+        top_backward = fringes[1].peek()[0]
+        if heuristic is None and top_forward + top_backward >= best:
+            break
+        if heuristic is not None and max(top_forward, top_backward) >= best:
+            break
+
+        forward = len(fringes[0]) <= len(fringes[1])
+        direction = 0 if forward else 1
+        cost, state = fringes[direction].pop()
+        closed[direction].add(state)
+        current, entered_side = state
+
+        if forward:
+            new_g = g[0][state] + graph.node_attributes(current)['length']
+            neighbours = graph.neighbors(current)
+            if entered_side is not None and not traversal:
+                neighbours = filter_neighbours(graph, entered_side, current, neighbours)
+            successors = []
+            for neighbour in neighbours:
+                side = ENTERED_START if traversal else find_side_entered(graph, current, neighbour)
+                successors.append(((neighbour, side), new_g))
+        else:
+            successors = []
+            for previous in graph.incidents(current):
+                if not traversal and find_side_entered(graph, previous, current) != entered_side:
+                    continue
+                new_g = g[1][state] + graph.node_attributes(previous)['length']
+                if previous == start:
+                    successors.append(((start, None), new_g))
+                    continue
+                # The sides from which previous can be entered to leave
+                # it towards current
+                for side in sides:
+                    if traversal or filter_neighbours(graph, side, previous, [current]):
+                        successors.append(((previous, side), new_g))
+
+        for successor, new_g in successors:
+            if successor in closed[direction]:
+                continue
+            if successor in fringes[direction] and new_g >= g[direction][successor]:
+                continue
+            parents[direction][successor] = state
+            g[direction][successor] = new_g
+            section, side = successor
+            if forward:
+                h = _estimate(heuristic, section, goal, side)
+            else:
+                h = _estimate_reverse(heuristic, section, start, side)
+            fringes[direction].push(successor, new_g + h)
+
+            # Check whether the searches meet at this state
+            if successor in g[1-direction] and new_g + g[1-direction][successor] < best:
+                best = new_g + g[1-direction][successor]
+                meeting = successor
+
+    if meeting is not None:
+        path = _construct_path(parents, meeting)
+    if path is None:
+        logger.info('No path found using bidirectional search in %f sec', time.perf_counter() - start_time)
+    else:
+        logger.info('Found a path with length %d using bidirectional search in %f sec. Sections searched: %d, sections to search: %d',
+                    len(path), time.perf_counter() - start_time,
+                    len(closed[0]) + len(closed[1]), len(fringes[0]) + len(fringes[1]))
+    if with_data:
+        return (path, _sections(fringes[0].items() + fringes[1].items()),
+                set(_sections(closed[0] | closed[1])))
+    return path
+
+def _estimate(heuristic, section, goal, entered_side=None):
+    """Returns h(n) from a heuristic or 0 when there is no heuristic"""
+    if heuristic is None:
+        return 0.0
+    return heuristic.estimate(section, goal, entered_side)
+
+def _estimate_reverse(heuristic, section, start, entered_side=None):
+    """Returns the estimated cost from start to section or 0 without heuristic"""
+    if heuristic is None:
+        return 0.0
+    return heuristic.estimate_reverse(section, start, entered_side)
+
+def _construct_path(parents, meeting):
+    """Builds the section path through the state where both searches met"""
+    path = []
+    state = meeting
+    while state in parents[0]:
+        state = parents[0][state]
+        path.append(state[0])
+    path.reverse()
+    path.append(meeting[0])
+    state = meeting
+    while state in parents[1]:
+        state = parents[1][state]
+        path.append(state[0])
+    return path
+
+def _sections(states):
+    """Returns the sections of (section, entered side) states"""
+    return list(dict.fromkeys(section for section, side in states))
@@ -0,0 +1,181 @@
+import collections
+import logging
+import sys
+
+from planners.common import DijkstraSearch
+
+logger = logging.getLogger(__name__)
+
+_FLOAT_SIZE = sys.getsizeof(0.0)
+
+class RouteCache:
+    def __init__(self, graph, *, max_entries=4096, max_bytes=64*1024*1024,
+                 max_trees=16):
+        """Caches planned routes in front of the planners
+
+        Routes are stored by (start, goal, planner, profile) and the
+        keyword arguments of the planner, and evicted in least recently
+        used order once there are more than max_entries routes or their
+        estimated size exceeds max_bytes.
+
+        When no planner is given routes are taken from Dijkstra search
+        trees (see planners.common.DijkstraSearch), one per start. When
+        only the goal changes the tree of the start is continued instead
+        of starting a new search. Trees count towards max_bytes and at
+        most max_trees of them are kept.
+
+        The cache is emptied when the graph changes: graphs built by
+        DirectionalGraphBuilder carry a version that is compared on
+        every lookup. Call invalidate() after changing a graph by hand.
+        After DirectionalGraphBuilder.update() call invalidate() when
+        routes may have become shorter, otherwise invalidate(changed,
+        longer_only=True) keeps the routes that avoid the changes.
+
+        Params:
+        graph - The graph the routes are planned in
+        max_entries - The maximum amount of cached routes
+        max_bytes - The maximum estimated memory use of routes and trees
+        max_trees - The maximum amount of search trees to keep
+        """
+        self.logger = logging.getLogger('.'.join((__name__, type(self).__name__)))
+        self.graph = graph
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_trees = max_trees
+        self.hits = 0
+        self.misses = 0
+        self.tree_hits = 0
+        self._routes = collections.OrderedDict()
+        self._trees = collections.OrderedDict()
+        self._bytes = 0
+        self._version = getattr(graph, 'version', None)
+
+    def route(self, start, goal, planner=None, profile=None, **kwargs):
+        """Returns the route from start to goal, planning it when needed
+
+        Params:
+        start - The start section
+        goal - The goal section
+        planner - A planner function like planners.Astar, called as
+                  planner(graph, start, goal, **kwargs). When None the
+                  route is taken from a Dijkstra search tree.
+        profile - A hashable description of the costs the route was
+                  planned with, for example the heuristic or vehicle
+                  type. Routes of different profiles are kept apart.
+        kwargs - Passed on to the planner, for example the heuristic.
+                 They are part of the key, so they must be hashable.
+        """
+        self._check_version()
+        key = (start, goal, planner, profile, tuple(sorted(kwargs.items())))
+        try:
+            path, size = self._routes[key]
+        except KeyError:
+            pass
+        else:
+            self._routes.move_to_end(key)
+            self.hits += 1
+            return path
+
+        self.misses += 1
+        if planner is None:
+            tree = self._take_tree(start, profile)
+            path = tree.path(goal)
+            self._store_tree((start, profile), tree)
+        else:
+            path = planner(self.graph, start, goal, **kwargs)
+        size = _path_size(path)
+        self._routes[key] = (path, size)
+        self._bytes += size
+        self._evict()
+        return path
+
+    def invalidate(self, sections=None, *, longer_only=False):
+        """Removes cached routes and trees
+
+        Removing only the routes and trees that contain changed sections
+        is not enough when routes may have become shorter, for example
+        through an added section. The remaining routes therefore still
+        count as cached for the old version of the graph, and once the
+        graph version changed the next lookup empties the cache, unless
+        longer_only is set.
+
+        Params:
+        sections - Only remove routes and trees that contain one of
+                   these sections. When None everything is removed.
+        longer_only - The sections were only removed or made longer, so
+                      the other routes are still the shortest and the
+                      cache is kept for the current version of the
+                      graph. See DirectionalGraphBuilder.update().
+        """
+        if sections is None:
+            self._routes.clear()
+            self._trees.clear()
+            self._bytes = 0
+            self._version = getattr(self.graph, 'version', None)
+        else:
+            sections = set(sections)
+            for key, (path, size) in list(self._routes.items()):
+                if path is None or not sections.isdisjoint(path) or \
+                        key[0] in sections or key[1] in sections:
+                    del self._routes[key]
+                    self._bytes -= size
+            for key, (tree, size) in list(self._trees.items()):
+                if not sections.isdisjoint(tree.settled) or not sections.isdisjoint(tree.ancestors):
+                    del self._trees[key]
+                    self._bytes -= size
+            if longer_only:
+                self._version = getattr(self.graph, 'version', None)
+
+    def stats(self):
+        """Returns a dict with the counters and the size of the cache"""
+        return {'hits': self.hits, 'misses': self.misses, 'tree_hits': self.tree_hits,
+                'routes': len(self._routes), 'trees': len(self._trees),
+                'bytes': self._bytes}
+
+    def __len__(self):
+        return len(self._routes)
+
+    def _take_tree(self, start, profile):
+        """Removes the search tree of a start from the cache or creates one
+
+        The size of a tree changes while it is searched, so it is taken
+        out of the cache and stored again with _store_tree() afterwards.
+        """
+        try:
+            tree, size = self._trees.pop((start, profile))
+        except KeyError:
+            return DijkstraSearch(self.graph, start)
+        self.tree_hits += 1
+        self._bytes -= size
+        return tree
+
+    def _store_tree(self, key, tree):
+        """Adds a search tree to the cache as the most recently used one"""
+        size = sys.getsizeof(tree.settled) + sys.getsizeof(tree.ancestors) + \
+               _FLOAT_SIZE * len(tree.settled)
+        self._trees[key] = (tree, size)
+        self._bytes += size
+
+    def _evict(self):
+        """Evicts the least recently used routes and trees"""
+        while len(self._trees) > self.max_trees:
+            key, (tree, size) = self._trees.popitem(last=False)
+            self._bytes -= size
+        while self._routes and (len(self._routes) > self.max_entries or self._bytes > self.max_bytes):
+            key, (path, size) = self._routes.popitem(last=False)
+            self._bytes -= size
+        while self._trees and self._bytes > self.max_bytes:
+            key, (tree, size) = self._trees.popitem(last=False)
+            self._bytes -= size
+
+    def _check_version(self):
+        """Empties the cache if the graph changed since it was filled"""
+        if getattr(self.graph, 'version', None) != self._version:
+            self.logger.info('The graph changed, emptying the route cache')
+            self.invalidate()
+
+
+def _path_size(path):
+    """Estimates the memory used by a cached path"""
+    # The section names are shared with the graph, only count the list
+    return sys.getsizeof(path)
@@ -0,0 +1,330 @@
+import array
+import heapq
+import logging
+import math
+import time
+
+from planners.common import PriorityQueue, is_traversal_graph
+
+logger = logging.getLogger(__name__)
+
+class ContractionHierarchy:
+    def __init__(self, graph, *, witness_limit=64):
+        """Answers point to point queries using a contraction hierarchy
+
+        During preprocessing (build()) sections are contracted one by
+        one in order of importance. When a section is removed from the
+        graph shortcut edges are added between its neighbours, unless a
+        witness search finds a path between them that is at least as
+        short. Every shortcut remembers the section it bypasses so
+        routes can be unpacked to sections of the original graph.
+        Queries run a bidirectional Dijkstra that only moves up in the
+        hierarchy, which settles very few sections.
+
+        The costs are the same as those used by the planners: moving
+        from a section to a neighbour costs the length of the section
+        that is left. Contraction and queries follow the edges as they
+        are, so the graph has to be a traversal graph (see
+        DirectionalGraphBuilder.build_traversal_graph()) in which every
+        edge is a valid turn. On a section graph the routes could turn
+        around inside a section, such graphs raise a ValueError. Plan
+        from a section to traversal_goal() of the goal section.
+
+        Params:
+        graph - The traversal graph to build the hierarchy for
+        witness_limit - The maximum amount of sections a witness search
+                        may settle before giving up. Lower values speed
+                        up preprocessing but add more shortcuts.
+        """
+        if not is_traversal_graph(graph):
+            raise ValueError("A contraction hierarchy needs a traversal graph, the neighbours of a "
+                             "section graph depend on the side a section is entered from")
+        self.logger = logging.getLogger('.'.join((__name__, type(self).__name__)))
+        self.graph = graph
+        self.witness_limit = witness_limit
+        self.rank = {}
+        self.up = {}
+        self.down = {}
+        self.middle = {}
+        self.shortcuts = 0
+        self.build_time = 0.0
+
+    def build(self):
+        """Orders and contracts all sections of the graph
+
+        Sections are ordered by their edge difference (shortcuts that
+        would be added minus the edges that are removed) plus the
+        amount of neighbours that have already been contracted, which
+        spreads the contraction evenly over the graph. Priorities are
+        updated lazily: a section is only contracted when its
+        recalculated priority is still the lowest, and the shortcuts
+        found while recalculating it are the ones that get added.
+        """
+        self.logger.info('Building contraction hierarchy')
+        start_time = time.perf_counter()
+        out_edges = {}
+        in_edges = {}
+        for section in self.graph.nodes():
+            length = self.graph.node_attributes(section)['length']
+            out_edges.setdefault(section, {})
+            in_edges.setdefault(section, {})
+            for neighbour in self.graph.neighbors(section):
+                if neighbour != section:
+                    out_edges[section][neighbour] = length
+                    in_edges.setdefault(neighbour, {})[section] = length
+        self.rank = {}
+        self.up = { s: {} for s in out_edges }
+        self.down = { s: {} for s in out_edges }
+        self.middle = {}
+        self.shortcuts = 0
+        contracted_neighbours = dict.fromkeys(out_edges, 0)
+
+        queue = PriorityQueue()
+        for section in out_edges:
+            queue.push(section, self._priority(section, out_edges, in_edges, contracted_neighbours)[0])
+
+        while queue:
+            priority, section = queue.pop()
+            # Lazy update, contract only if the section is still the least
+            # important one
+            priority, shortcuts = self._priority(section, out_edges, in_edges, contracted_neighbours)
+            if queue and priority > queue.peek()[0]:
+                queue.push(section, priority)
+                continue
+
+            for u, w, cost in shortcuts:
+                if w not in out_edges[u] or cost < out_edges[u][w]:
+                    if w not in out_edges[u]:
+                        self.shortcuts += 1
+                    out_edges[u][w] = cost
+                    in_edges[w][u] = cost
+                    self.middle[(u, w)] = section
+
+            # Move the edges of the section to the hierarchy
+            self.rank[section] = len(self.rank)
+            for w, cost in out_edges.pop(section).items():
+                self.up[section][w] = cost
+                del in_edges[w][section]
+                contracted_neighbours[w] += 1
+            for u, cost in in_edges.pop(section).items():
+                self.down[section][u] = cost
+                del out_edges[u][section]
+                contracted_neighbours[u] += 1
+
+        self.build_time = time.perf_counter() - start_time
+        self.logger.info('Built contraction hierarchy for %d sections with %d shortcuts in %f sec',
+                         len(self.rank), self.shortcuts, self.build_time)
+
+    def query(self, start, goal, with_data=False):
+        """Finds the shortest path between two sections
+
+        Returns the path as a list of sections, like planners.Astar, or
+        None when there is no path.
+
+        Params:
+        start - The start section
+        goal - The goal section
+        with_data - When True return a tuple of the path, the sections
+                    still queued and the sections settled by the search
+        """
+        forward = {start: (0.0, None)}
+        backward = {goal: (0.0, None)}
+        queues = (PriorityQueue(), PriorityQueue())
+        queues[0].push(start, 0.0)
+        queues[1].push(goal, 0.0)
+        settled = set()
+        best, meeting = (0.0, start) if start == goal else (float('inf'), None)
+
+        # Alternate between the directions, a direction is done when its
+        # smallest queued distance can not improve the best route
+        active = [True, True]
+        while any(active):
+            for direction in (0, 1):
+                queue = queues[direction]
+                if not queue or queue.peek()[0] >= best:
+                    active[direction] = False
+                    continue
+                d, current = queue.pop()
+                settled.add(current)
+                if direction == 0:
+                    dist, other, edges = forward, backward, self.up[current]
+                else:
+                    dist, other, edges = backward, forward, self.down[current]
+                if current in other and d + other[current][0] < best:
+                    best, meeting = d + other[current][0], current
+                # Only edges to more important sections are stored
+                for neighbour, cost in edges.items():
+                    new_d = d + cost
+                    if neighbour not in dist or new_d < dist[neighbour][0]:
+                        dist[neighbour] = (new_d, current)
+                        queue.push(neighbour, new_d)
+
+        if meeting is None:
+            path = None
+        else:
+            path = self._unpack_path(forward, backward, meeting)
+        if with_data:
+            return (path, queues[0].items() + queues[1].items(), settled)
+        return path
+
+    def distance_table(self, origins, targets):
+        """Calculates the distances between many origins and targets
+
+        Uses buckets: an upward search from every target stores its
+        distance at every section it settles, after which an upward
+        search from every origin only has to look at the buckets of the
+        sections it settles. This takes len(origins) + len(targets)
+        small searches instead of one query for every pair.
+
+        Returns the distances as a flat array of doubles, row by row:
+        the distance from origins[i] to targets[j] is at
+        i * len(targets) + j. Unreachable targets have distance inf.
+
+        Params:
+        origins - The sections to start from
+        targets - The sections to go to
+        """
+        buckets = {}
+        for j, target in enumerate(targets):
+            for section, d in self._upward_search(target, self.down).items():
+                buckets.setdefault(section, []).append((j, d))
+
+        columns = len(targets)
+        table = array.array('d', [math.inf]) * (len(origins) * columns)
+        for i, origin in enumerate(origins):
+            row = i * columns
+            for section, d in self._upward_search(origin, self.up).items():
+                for j, target_d in buckets.get(section, ()):
+                    if d + target_d < table[row + j]:
+                        table[row + j] = d + target_d
+        return table
+
+    def _upward_search(self, start, edges):
+        """Returns the distances of all sections reachable going upwards
+
+        Params:
+        start - The section to search from
+        edges - self.up to search forward, self.down to search backward
+        """
+        dist = {start: 0.0}
+        settled = {}
+        queue = PriorityQueue()
+        queue.push(start, 0.0)
+        while queue:
+            d, current = queue.pop()
+            settled[current] = d
+            for neighbour, cost in edges[current].items():
+                new_d = d + cost
+                if new_d < dist.get(neighbour, math.inf):
+                    dist[neighbour] = new_d
+                    queue.push(neighbour, new_d)
+        return settled
+
+    def __call__(self, graph, start, goal, with_data=False):
+        """Allows the hierarchy to be used like the other planners"""
+        return self.query(start, goal, with_data)
+
+    def _priority(self, section, out_edges, in_edges, contracted_neighbours):
+        """Calculates the importance of a section, lower is contracted first
+
+        Returns a tuple of the priority and the shortcuts that
+        contracting the section would add, see _contract().
+        """
+        shortcuts = self._contract(section, out_edges, in_edges)
+        removed = len(out_edges[section]) + len(in_edges[section])
+        return len(shortcuts) - removed + contracted_neighbours[section], shortcuts
+
+    def _contract(self, section, out_edges, in_edges):
+        """Determines the shortcuts needed when a section gets contracted
+
+        Returns a list of (from, to, cost) shortcuts, the graph is not
+        changed.
+
+        Params:
+        section - The section to contract
+        out_edges - The outgoing edges of the remaining graph
+        in_edges - The incoming edges of the remaining graph
+        """
+        shortcuts = []
+        targets = out_edges[section]
+        for u, in_cost in in_edges[section].items():
+            needed = { w: in_cost + out_cost for w, out_cost in targets.items() if w != u }
+            if not needed:
+                continue
+            witness = self._witness_search(u, section, needed, out_edges)
+            for w, cost in needed.items():
+                if witness.get(w, math.inf) > cost:
+                    shortcuts.append((u, w, cost))
+        return shortcuts
+
+    def _witness_search(self, source, avoid, needed, out_edges):
+        """Searches for paths from source that do not use avoid
+
+        Runs a Dijkstra search that stops once a path that is at least
+        as short as the needed cost has been found to every target, the
+        distance exceeds the largest needed cost or witness_limit
+        sections have been settled. Returns the distances that were
+        found.
+
+        Params:
+        source - The section to search from
+        avoid - The section that is being contracted
+        needed - The cost of the route through avoid to every target
+        out_edges - The outgoing edges of the remaining graph
+        """
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = set()
+        limit = max(needed.values())
+        remaining = len(needed)
+        while heap and len(settled) < self.witness_limit:
+            d, current = heapq.heappop(heap)
+            if current in settled:
+                continue
+            if d > limit:
+                break
+            settled.add(current)
+            for neighbour, cost in out_edges[current].items():
+                new_d = d + cost
+                if neighbour == avoid or new_d >= dist.get(neighbour, math.inf):
+                    continue
+                if new_d <= needed.get(neighbour, -1.0) and dist.get(neighbour, math.inf) > needed[neighbour]:
+                    remaining -= 1
+                dist[neighbour] = new_d
+                if remaining == 0:
+                    return dist
+                heapq.heappush(heap, (new_d, neighbour))
+        return dist
+
+    def _unpack_path(self, forward, backward, meeting):
+        """Builds the section path from both search trees and unpacks it"""
+        path = [meeting]
+        current = meeting
+        while forward[current][1] is not None:
+            previous = forward[current][1]
+            path.extend(reversed(self._unpack_edge(previous, current)))
+            path.append(previous)
+            current = previous
+        path.reverse()
+        current = meeting
+        while backward[current][1] is not None:
+            following = backward[current][1]
+            path.extend(self._unpack_edge(current, following))
+            path.append(following)
+            current = following
+        return path
+
+    def _unpack_edge(self, u, w):
+        """Returns the sections between u and w that a shortcut bypasses"""
+        sections = []
+        stack = [(u, w)]
+        while stack:
+            a, b = stack.pop()
+            middle = self.middle.get((a, b))
+            if middle is None:
+                if a != u:
+                    sections.append(a)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+        return sections
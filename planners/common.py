@@ -1,10 +1,22 @@
+import heapq
+import itertools
 import logging
+import math
 
 logger = logging.getLogger(__name__)
 
 ENTERED_START = 0
 ENTERED_END = 1
 
+def is_traversal_graph(graph):
+    """Returns whether a graph connects section traversals
+
+    In a traversal graph (see DirectionalGraphBuilder) every edge
+    already continues at the end where a section is left, so the
+    neighbours do not have to be filtered.
+    """
+    return getattr(graph, 'traversal', False)
+
 def find_side_entered(graph, previous, current):
     """Find out from which side a section was entered
 
@@ -47,3 +59,224 @@ def filter_neighbours(graph, entered_side, parent, neighbours):
         elif entered_side == ENTERED_END and node_info['start_node'] in (neighbour_info['start_node'], neighbour_info['end_node']):
             new_neighbours.append(neighbour)
     return new_neighbours
+
+class PriorityQueue:
+    """A binary heap where the priority of queued items can be changed
+
+    Items are addressable: pushing an item that is already queued
+    replaces its priority instead of adding it a second time. The old
+    heap entry is marked as removed and skipped when it surfaces, this
+    keeps both push and pop at O(log n) regardless of the queue size.
+    Items with equal priority are popped in insertion order.
+    """
+    _REMOVED = object()
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def push(self, item, priority):
+        """Adds an item or changes the priority of a queued item
+
+        Params:
+        item - The item to queue, must be hashable
+        priority - The priority of the item, lower is popped earlier
+        """
+        entry = self._entries.get(item)
+        if entry is not None:
+            entry[2] = PriorityQueue._REMOVED
+        entry = [priority, next(self._counter), item]
+        self._entries[item] = entry
+        heapq.heappush(self._heap, entry)
+
+    def decrease_key(self, item, priority):
+        """Lowers the priority of an item if it is queued with a higher one
+
+        Returns True when the item was (re)queued, False when it is
+        already queued with an equal or lower priority.
+
+        Params:
+        item - The item to update or add
+        priority - The new priority for the item
+        """
+        entry = self._entries.get(item)
+        if entry is not None and entry[0] <= priority:
+            return False
+        self.push(item, priority)
+        return True
+
+    def pop(self):
+        """Removes and returns the (priority, item) with lowest priority
+
+        Raises KeyError when the queue is empty.
+        """
+        heap = self._heap
+        while heap:
+            priority, count, item = heapq.heappop(heap)
+            if item is not PriorityQueue._REMOVED:
+                del self._entries[item]
+                return priority, item
+        raise KeyError("pop from an empty priority queue")
+
+    def peek(self):
+        """Returns the (priority, item) with lowest priority, not removing it"""
+        heap = self._heap
+        while heap and heap[0][2] is PriorityQueue._REMOVED:
+            heapq.heappop(heap)
+        if not heap:
+            raise KeyError("peek into an empty priority queue")
+        return heap[0][0], heap[0][2]
+
+    def remove(self, item):
+        """Removes an item from the queue, raises KeyError if not queued"""
+        entry = self._entries.pop(item)
+        entry[2] = PriorityQueue._REMOVED
+
+    def priority(self, item):
+        """Returns the priority an item is queued with"""
+        return self._entries[item][0]
+
+    def items(self):
+        """Returns a list of all the items that are queued"""
+        return list(self._entries)
+
+    def __contains__(self, item):
+        return item in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __bool__(self):
+        return bool(self._entries)
+
+def shortest_distances(graph, source, backward=False):
+    """Calculates the distance from a section to all reachable sections
+
+    Runs Dijkstra's algorithm over the graph as it is, without filtering
+    neighbours on the side they are entered from. The distances are
+    therefore lower bounds of the distances the planners find. Like in
+    the planners the cost of moving from a section to a neighbour is
+    the length of the section that is left.
+
+    Returns a dict that maps every reachable section to its distance.
+
+    Params:
+    graph - The graph to search through
+    source - The section to calculate the distances from
+    backward - When True calculate the distance from every section to
+               source instead, by following edges in reverse
+    """
+    dist = {source: 0.0}
+    done = set()
+    fringe = PriorityQueue()
+    fringe.push(source, 0.0)
+    while fringe:
+        d, current = fringe.pop()
+        done.add(current)
+        if backward:
+            for previous in graph.incidents(current):
+                if previous in done:
+                    continue
+                new_d = d + graph.node_attributes(previous)['length']
+                if fringe.decrease_key(previous, new_d):
+                    dist[previous] = new_d
+        else:
+            new_d = d + graph.node_attributes(current)['length']
+            for neighbour in graph.neighbors(current):
+                if neighbour not in done and fringe.decrease_key(neighbour, new_d):
+                    dist[neighbour] = new_d
+    return dist
+
+def dijkstra(graph, start, targets=None):
+    """Builds a shortest path tree from a section with Dijkstra's algorithm
+
+    Neighbours are filtered on the side they are entered from, like the
+    planners do, so the distances match the routes of Astar. The search
+    stops as soon as all targets are settled.
+
+    Returns a tuple of a dict with the distance of every settled section
+    and a dict with the ancestor of every reached section, see
+    planners.astar.construct_path().
+
+    Params:
+    graph - The graph to search through
+    start - The section to start from
+    targets - The sections to find, when None all sections are searched
+    """
+    search = DijkstraSearch(graph, start)
+    search.run(targets)
+    return search.settled, search.ancestors
+
+class DijkstraSearch:
+    def __init__(self, graph, start):
+        """A Dijkstra search that can be continued for more targets
+
+        The search only settles as many sections as needed to answer
+        the targets asked for so far. Asking for a target that has not
+        been settled yet continues the search where it stopped.
+
+        Params:
+        graph - The graph to search through
+        start - The section to start from
+        """
+        self.graph = graph
+        self.start = start
+        self.settled = {}
+        self.ancestors = {}
+        self._traversal = is_traversal_graph(graph)
+        self._g = {start: 0.0}
+        self._fringe = PriorityQueue()
+        self._fringe.push(start, 0.0)
+
+    def run(self, targets=None):
+        """Continues the search until all targets are settled
+
+        Params:
+        targets - The sections to settle, when None the search runs
+                  until all reachable sections are settled
+        """
+        graph = self.graph
+        settled = self.settled
+        ancestors = self.ancestors
+        g = self._g
+        fringe = self._fringe
+        remaining = None if targets is None else set(targets).difference(settled)
+        if remaining is not None and not remaining:
+            return
+        while fringe:
+            cost, current = fringe.pop()
+            settled[current] = cost
+
+            neighbours = graph.neighbors(current)
+            if current != self.start and not self._traversal:
+                entered_side = find_side_entered(graph, ancestors[current], current)
+                neighbours = filter_neighbours(graph, entered_side, current, neighbours)
+            new_g = cost + graph.node_attributes(current)['length']
+            for neighbour in neighbours:
+                if neighbour in settled or (neighbour in fringe and new_g >= g[neighbour]):
+                    continue
+                ancestors[neighbour] = current
+                g[neighbour] = new_g
+                fringe.push(neighbour, new_g)
+
+            if remaining is not None:
+                remaining.discard(current)
+                if not remaining:
+                    break
+
+    def distance(self, target):
+        """Returns the length of the route to target, inf if there is none"""
+        self.run((target,))
+        return self.settled.get(target, math.inf)
+
+    def path(self, target):
+        """Returns the route to target as a list of sections or None"""
+        self.run((target,))
+        if target not in self.settled:
+            return None
+        path = [target]
+        while path[-1] in self.ancestors:
+            path.append(self.ancestors[path[-1]])
+        path.reverse()
+        return path
@@ -0,0 +1,182 @@
+import array
+import logging
+
+from planners.common import ENTERED_START, ENTERED_END
+
+logger = logging.getLogger(__name__)
+
+# Flags stored for every edge, see CSRGraph
+EDGE_ENTERS_END = 1
+EDGE_LEAVES_START = 2
+EDGE_LEAVES_END = 4
+
+class CSRGraph:
+    def __init__(self):
+        """A frozen, compact graph of sections in compressed sparse rows
+
+        Sections are numbered 0..n-1. The neighbours of section i are
+        targets[offsets[i]:offsets[i+1]], the incidents are
+        sources[in_offsets[i]:in_offsets[i+1]]. All section data lives in
+        parallel arrays indexed by section number, the geometry is kept
+        in one flat array of coordinates.
+
+        The graph offers the same read-only methods as a pygraph digraph
+        (nodes, neighbors, incidents, node_attributes) using the section
+        numbers as nodes, so it can be used by the planners and the
+        exporters. Use index() and name() to translate between section
+        numbers and the names used by DirectionalGraphBuilder.
+
+        For every edge it also stores at which end of the section the
+        edge leaves and at which end of the neighbour it arrives, so the
+        planners can filter neighbours without looking at attributes.
+
+        Use from_digraph() to create a CSRGraph. Converting a traversal
+        graph keeps it a traversal graph. See planners.snapshot to store
+        a CSRGraph on disk and memory map it again.
+        """
+        self.traversal = False
+        self.distance_method = None
+        self.bounds = None
+        self.snapshot = None
+        self.names = []
+        self._ids = None
+        self.offsets = array.array('q', [0])
+        self.targets = array.array('q')
+        self.edge_flags = array.array('B')
+        self.in_offsets = array.array('q', [0])
+        self.sources = array.array('q')
+        self.length = array.array('d')
+        self.start_node = array.array('q')
+        self.end_node = array.array('q')
+        self.way = array.array('q')
+        self.start_lat = array.array('d')
+        self.start_lon = array.array('d')
+        self.end_lat = array.array('d')
+        self.end_lon = array.array('d')
+        self.path_offsets = array.array('q', [0])
+        self.path_coords = array.array('d')
+        self._way_tags = {}
+        self._load_way_tags = None
+
+    @classmethod
+    def from_digraph(cls, graph):
+        """Creates a CSRGraph from a graph made by DirectionalGraphBuilder
+
+        Params:
+        graph - The digraph to convert, sections need the attributes
+                that DirectionalGraphBuilder sets
+        """
+        logger.info('Converting a graph with %d sections to CSR', len(graph.nodes()))
+        csr = cls()
+        csr.traversal = getattr(graph, 'traversal', False)
+        csr.distance_method = getattr(graph, 'distance_method', None)
+        csr.names = sorted(graph.nodes())
+        for name in csr.names:
+            attrs = graph.node_attributes(name)
+            csr.length.append(attrs['length'])
+            csr.start_node.append(attrs['start_node'])
+            csr.end_node.append(attrs['end_node'])
+            csr.way.append(attrs['way'])
+            csr.start_lat.append(attrs['start_point'][0])
+            csr.start_lon.append(attrs['start_point'][1])
+            csr.end_lat.append(attrs['end_point'][0])
+            csr.end_lon.append(attrs['end_point'][1])
+            for lat, lon in attrs['path']:
+                csr.path_coords.append(lat)
+                csr.path_coords.append(lon)
+            csr.path_offsets.append(len(csr.path_coords))
+            csr.way_tags.setdefault(attrs['way'], attrs['tags'])
+
+        for i, name in enumerate(csr.names):
+            for neighbour in sorted(csr.ids[n] for n in graph.neighbors(name)):
+                csr.targets.append(neighbour)
+                csr.edge_flags.append(csr._edge_flags(i, neighbour))
+            csr.offsets.append(len(csr.targets))
+            csr.sources.extend(sorted(csr.ids[n] for n in graph.incidents(name)))
+            csr.in_offsets.append(len(csr.sources))
+        return csr
+
+    def __reduce_ex__(self, protocol):
+        """Pickles a graph mapped from a snapshot as the snapshot file name
+
+        Other processes then map the same file instead of receiving a
+        copy of every array, so unpickling takes the same time for any
+        size of graph and all processes share the pages of the file.
+        """
+        if self.snapshot is not None:
+            # Imported here because planners.snapshot imports this module
+            from planners.snapshot import load_snapshot
+            return (load_snapshot, (self.snapshot,))
+        return super(CSRGraph, self).__reduce_ex__(protocol)
+
+    @property
+    def ids(self):
+        """A dict from section name to section number, built when first used"""
+        if self._ids is None:
+            self._ids = { name: i for i, name in enumerate(self.names) }
+        return self._ids
+
+    @property
+    def way_tags(self):
+        """A dict with the tags of every way, loaded when first used"""
+        if self._load_way_tags is not None:
+            self._way_tags = self._load_way_tags()
+            self._load_way_tags = None
+        return self._way_tags
+
+    def _edge_flags(self, u, v):
+        """Calculates the flags of the edge from section u to section v"""
+        u_ends = (self.start_node[u], self.end_node[u])
+        v_ends = (self.start_node[v], self.end_node[v])
+        flags = 0
+        if self.start_node[v] not in u_ends:
+            flags |= EDGE_ENTERS_END
+        if u_ends[0] in v_ends:
+            flags |= EDGE_LEAVES_START
+        if u_ends[1] in v_ends:
+            flags |= EDGE_LEAVES_END
+        return flags
+
+    def index(self, name):
+        """Returns the section number of a section name"""
+        return self.ids[name]
+
+    def name(self, section):
+        """Returns the section name of a section number"""
+        return self.names[section]
+
+    def entered_side(self, edge):
+        """Returns ENTERED_START or ENTERED_END for the target of an edge"""
+        return ENTERED_END if self.edge_flags[edge] & EDGE_ENTERS_END else ENTERED_START
+
+    def nodes(self):
+        return list(range(len(self.length)))
+
+    def neighbors(self, section):
+        return self.targets[self.offsets[section]:self.offsets[section+1]].tolist()
+
+    def incidents(self, section):
+        return self.sources[self.in_offsets[section]:self.in_offsets[section+1]].tolist()
+
+    def has_node(self, section):
+        return 0 <= section < len(self.length)
+
+    def node_attributes(self, section):
+        """Returns the attributes of a section in the digraph format"""
+        coords = self.path_coords[self.path_offsets[section]:self.path_offsets[section+1]].tolist()
+        way = self.way[section]
+        return {'name': self.names[section],
+                'start_node': self.start_node[section],
+                'start_point': (self.start_lat[section], self.start_lon[section]),
+                'end_node': self.end_node[section],
+                'end_point': (self.end_lat[section], self.end_lon[section]),
+                'tags': self.way_tags[way],
+                'way': way,
+                'length': self.length[section],
+                'path': list(zip(coords[0::2], coords[1::2]))}
+
+    def __len__(self):
+        return len(self.length)
+
+    def __contains__(self, section):
+        return self.has_node(section)
@@ -0,0 +1,213 @@
+import collections
+import logging
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from geodesic import lower_bound_factor, to_ecef, to_ecef_many
+from planners.common import ENTERED_START, ENTERED_END
+from planners.csr import CSRGraph
+
+logger = logging.getLogger(__name__)
+
+# The straight line through the earth is never longer than the geodesic
+# over its surface. This factor absorbs the rounding error in the
+# iterative geodesic calculation so the estimate stays a lower bound.
+SAFETY_FACTOR = 0.9999
+
+def chord(p, q):
+    """Calculates the straight line distance between two ECEF points"""
+    return math.sqrt((p[0]-q[0])**2 + (p[1]-q[1])**2 + (p[2]-q[2])**2)
+
+def _end_points(graph, section):
+    """Returns the (lat, lon) start and end point of a section
+
+    Reads the arrays of a CSRGraph directly, node_attributes() would
+    also load the tags of all ways.
+    """
+    if isinstance(graph, CSRGraph):
+        return ((graph.start_lat[section], graph.start_lon[section]),
+                (graph.end_lat[section], graph.end_lon[section]))
+    attrs = graph.node_attributes(section)
+    return attrs['start_point'], attrs['end_point']
+
+def _nearest(p, q, r):
+    """Returns the chord from p to the closest of q and r"""
+    dq = (p[0]-q[0])**2 + (p[1]-q[1])**2 + (p[2]-q[2])**2
+    dr = (p[0]-r[0])**2 + (p[1]-r[1])**2 + (p[2]-r[2])**2
+    return math.sqrt(dq if dq < dr else dr)
+
+
+class CrowFliesHeuristic:
+    def __init__(self, graph, *, max_goals=16):
+        """Estimates h(n) as the crow flies for sections in a graph
+
+        The end points of every section are converted to ECEF vectors
+        once, after that an estimate only costs a few multiplications.
+        The estimate is the chord between the point where a section is
+        entered and the nearest end point of the goal. This chord is a
+        lower bound on the geodesic, and thus on the section lengths
+        that the DirectionalGraphBuilder calculates, so the heuristic is
+        admissible. Because the section itself is part of the remaining
+        route the estimate is also consistent, A* never has to reopen a
+        closed section. Estimates are cached per goal.
+
+        Lengths measured with the haversine method can be up to 0.56%
+        shorter than the geodesic. When the distance_method of the graph
+        is geodesic.HAVERSINE the estimates are lowered by that amount.
+
+        Params:
+        graph - The graph that contains the sections
+        max_goals - The amount of goals to keep cached estimates for
+        """
+        self.logger = logging.getLogger('.'.join((__name__, type(self).__name__)))
+        self.graph = graph
+        self.max_goals = max_goals
+        self.factor = SAFETY_FACTOR * lower_bound_factor(getattr(graph, 'distance_method', None))
+        self._points = {}
+        self._goals = collections.OrderedDict()
+
+    def prepare(self, sections=None):
+        """Converts the end points of sections to ECEF in one batch
+
+        Calling this is optional, sections that have not been prepared
+        are converted the first time they are estimated.
+
+        Params:
+        sections - The sections to convert, all sections in the graph
+                   when None
+        """
+        if sections is None:
+            sections = self.graph.nodes()
+        sections = [ s for s in sections if s not in self._points ]
+        self.logger.debug('Converting %d sections to ECEF', len(sections))
+        if np is None:
+            for section in sections:
+                self._section_points(section)
+            return
+
+        coords = []
+        for section in sections:
+            coords.extend(_end_points(self.graph, section))
+        if not coords:
+            return
+        xyz = to_ecef_many([ lat for lat, lon in coords ], [ lon for lat, lon in coords ])
+        for i, section in enumerate(sections):
+            self._points[section] = (xyz[2*i], xyz[2*i+1])
+
+    def invalidate(self, sections=None):
+        """Forgets the points and estimates of changed sections
+
+        Params:
+        sections - The sections that changed, all sections when None
+        """
+        if sections is None:
+            self._points.clear()
+        else:
+            for section in sections:
+                self._points.pop(section, None)
+        # Estimates are cheap to calculate again, forget them all
+        self._goals.clear()
+
+    def estimate(self, section, goal, entered_side=None):
+        """Estimates the cost of travelling from a section to the goal
+
+        Params:
+        section - The section to calculate h(n) for
+        goal - The goal of the search
+        entered_side - The side from which section is entered, should
+                       be ENTERED_START or ENTERED_END. When None the
+                       section may be entered from either end.
+        """
+        cache = self._goal_cache(goal)
+        key = (section, entered_side)
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        goal_start, goal_end = self._section_points(goal)
+        start, end = self._section_points(section)
+        if entered_side == ENTERED_START:
+            h = _nearest(start, goal_start, goal_end)
+        elif entered_side == ENTERED_END:
+            h = _nearest(end, goal_start, goal_end)
+        else:
+            h = min(_nearest(start, goal_start, goal_end), _nearest(end, goal_start, goal_end))
+        h *= self.factor
+        cache[key] = h
+        return h
+
+    def estimate_reverse(self, section, start, entered_side=None):
+        """Estimates the cost of travelling from the start to a section
+
+        The chord is the same in both directions, so this is estimate()
+        with the start as goal. Used by the backward search of
+        planners.bidirectional_search.
+
+        Params:
+        section - The section to calculate the estimate for
+        start - The start of the search
+        entered_side - The side from which section is entered
+        """
+        return self.estimate(section, start, entered_side)
+
+    def estimate_many(self, sections, goal, entered_sides=None):
+        """Estimates the cost to the goal for a batch of sections
+
+        Returns a list with an estimate for each section in sections.
+
+        Params:
+        sections - The sections to calculate h(n) for
+        goal - The goal of the search
+        entered_sides - A sequence with the side every section is
+                        entered from, see estimate(). When None every
+                        section may be entered from either end.
+        """
+        if entered_sides is None:
+            entered_sides = [None] * len(sections)
+        if np is None or len(sections) < 8:
+            return [ self.estimate(s, goal, side) for s, side in zip(sections, entered_sides) ]
+
+        cache = self._goal_cache(goal)
+        result = [ cache.get((s, side)) for s, side in zip(sections, entered_sides) ]
+        todo = [ i for i, h in enumerate(result) if h is None ]
+        if not todo:
+            return result
+        self.prepare([ sections[i] for i in todo ])
+        goal_points = np.array(self._section_points(goal))
+        entries = np.empty((len(todo), 2, 3))
+        for row, i in enumerate(todo):
+            start, end = self._points[sections[i]]
+            side = entered_sides[i]
+            entries[row, 0] = end if side == ENTERED_END else start
+            entries[row, 1] = start if side == ENTERED_START else end
+        # Distance from both possible entries to both goal end points
+        diff = entries[:, :, None, :] - goal_points[None, None, :, :]
+        h = np.sqrt((diff * diff).sum(axis=3)).min(axis=(1, 2)) * self.factor
+        for row, i in enumerate(todo):
+            result[i] = cache[(sections[i], entered_sides[i])] = float(h[row])
+        return result
+
+    def _section_points(self, section):
+        """Returns the ECEF (start, end) points of a section"""
+        try:
+            return self._points[section]
+        except KeyError:
+            start, end = _end_points(self.graph, section)
+            points = (to_ecef(*start), to_ecef(*end))
+            self._points[section] = points
+            return points
+
+    def _goal_cache(self, goal):
+        """Returns the estimate cache for a goal, evicting the oldest goal"""
+        try:
+            self._goals.move_to_end(goal)
+            return self._goals[goal]
+        except KeyError:
+            cache = self._goals[goal] = {}
+            if len(self._goals) > self.max_goals:
+                self._goals.popitem(last=False)
+            return cache
@@ -1,18 +1,21 @@
 import logging
+import math
 import time
+import warnings
 
 logger = logging.getLogger(__name__)
 
-from planners.common import filter_neighbours, find_side_entered
-from pygraph.classes.digraph import digraph
+from planners.common import *
+from planners.heuristics import CrowFliesHeuristic
 
-def iterative_deepening(graph, start_node, goal_node, max_depth=64, min_depth=1):
+def iterative_deepening(graph, start_node, goal_node, max_depth=64, min_depth=None, *, growth=0.0):
     """Find a route in a graph using iterative deepening.
 
-    Uses a standard Depth First Search algorithm to find a path.
-    Prevents getting stuck in loops by using the iterative deepening
-    method. The DFS will only look for a path with a limited length. The
-    limit will be increased if a path could not be found.
+    Uses iterative deepening A* (see ida_star()) to find a path of at
+    most max_depth sections after the start node. The depth first
+    searches are repeated with an increasing limit on the path cost
+    instead of on the path length, so the path is the shortest path
+    within the depth limit.
 
     Params:
     graph - The graph to do the search on
@@ -20,63 +23,151 @@ def iterative_deepening(graph, start_node, goal_node, max_depth=64, min_depth=1)
     goal_node - The node that is the end point of the route
     max_depth - The maximum depth iterative deepening wil go to when
                 trying to find a path
-    min_depth - The first path length limit to use
+    min_depth - Deprecated and ignored, the first cost limit is derived
+                from the heuristic instead
+    growth - The minimum relative increase of the cost limit, see
+             ida_star(). A growth of 0.05 is faster but the path may be
+             up to 5% longer than the shortest path.
     """
     logger = logging.getLogger('.'.join((__name__, 'iterative_deepening')))
+    if min_depth is not None:
+        warnings.warn("min_depth of iterative_deepening() is ignored, the first cost limit is derived "
+                      "from the heuristic", DeprecationWarning, stacklevel=2)
     logger.info('Starting looking for a route from %s to %s using IDDFS (max depth: %d)',
                 start_node, goal_node, max_depth)
+    return ida_star(graph, start_node, goal_node, max_depth=max_depth, growth=growth)
 
-    total_time = time.perf_counter()
-    for lim in range(min_depth, max_depth+1):
-        start = time.perf_counter()
-        path = _iterdeep_rec(graph, start_node, goal_node, lim)
-        if path is not None:
-            logger.info('Found a path by iterative deepening DFS in %f sec with length %d',
-                        (time.perf_counter() - total_time), len(path))
-            return path
-        logger.info('Elapsed %f sec during iterative deepening DFS with limit %d',
-                    (time.perf_counter() - start), lim)
-
-def _iterdeep_rec(graph, current_node, goal_node, max_depth, path=[]):
-    """The Depth First Search algorithm used in iterative deepening
-
-    Decreases the branching factor by assuming that each section will
-    get traversed from one end to the other. This is done by registring
-    from which end current way was entered, only neighbours that connect
-    at the opposite end are kept.
+def ida_star(graph, start, goal, heuristic=None, *, max_depth=None,
+             table_size=65536, growth=0.0):
+    """Finds a path using iterative deepening A*
+
+    Runs depth first searches that skip every section of which the
+    estimated cost f(n) = g(n) + h(n) exceeds a threshold. The first
+    threshold is the estimate for the start, every next threshold is
+    the smallest f(n) that exceeded the previous one, or more when
+    growth is set. Memory use only depends on the length of the path and
+    the transposition table.
+
+    The search uses an explicit stack so it is not bounded by the
+    recursion limit. The current path is kept in a single list that is
+    reused between iterations together with a set of the sections on
+    it, so checking for loops does not scan the path. The transposition
+    table remembers the lowest g(n) with which a section was reached in
+    the current iteration so reaching it again with a higher cost is
+    skipped. It holds at most table_size entries.
 
     Params:
     graph - The graph to do the search on
-    current_node - The node where we are continuing the search from
-    goal_node - The node we want to end up at
-    max_depth - The maximum length of the path before returning failure
-    depth - The current length of the path, when this gets larger than
-            max_depth a failure will be returned
-    path - The path that has been build from the start node up to but
-           not including current_node
+    start - The start section
+    goal - The goal section
+    heuristic - The object used to estimate h(n), see
+                planners.heuristics.CrowFliesHeuristic (default)
+    max_depth - The maximum amount of sections that may follow the start
+                in the path, unlimited when None
+    table_size - The maximum amount of entries in the transposition
+                 table, 0 disables it
+    growth - The minimum relative increase of the threshold between
+             iterations. Section lengths are all different so every
+             iteration often only adds a few sections; a growth of 0.05
+             needs far fewer iterations but the path may then be up to
+             5% longer than the shortest path.
+    """
+    logger = logging.getLogger('.'.join((__name__, 'ida_star')))
+    if heuristic is None:
+        heuristic = CrowFliesHeuristic(graph)
+    if max_depth is None:
+        max_depth = math.inf
+
+    path = []
+    on_path = set()
+    threshold = heuristic.estimate(start, goal)
+    iterations = 0
+    total_time = time.perf_counter()
+    while threshold < math.inf:
+        iterations += 1
+        start_time = time.perf_counter()
+        found, next_threshold = _ida_iteration(graph, start, goal, heuristic, threshold,
+                                               max_depth, table_size, path, on_path)
+        if next_threshold < math.inf:
+            next_threshold = max(next_threshold, threshold * (1 + growth))
+        threshold = next_threshold
+        if found:
+            logger.info('Found a path by IDA* in %f sec with length %d after %d iterations',
+                        time.perf_counter() - total_time, len(path), iterations)
+            return list(path)
+        logger.debug('Elapsed %f sec during IDA* iteration %d', time.perf_counter() - start_time, iterations)
+    logger.info('No path found by IDA* in %f sec after %d iterations',
+                time.perf_counter() - total_time, iterations)
+
+def _ida_iteration(graph, start, goal, heuristic, threshold, max_depth, table_size,
+                   path, on_path):
+    """Runs a single cost limited depth first search of IDA*
+
+    Returns a tuple of whether the goal was found, in which case path
+    holds the route, and the threshold for the next iteration.
+
+    Params:
+    path - The list to build the path in, it gets cleared
+    on_path - The set of sections in path, it gets cleared
+    See ida_star() for the other parameters.
     """
-    # Base case 1, we have reached the maximum depth, return failure
-    if len(path) >= max_depth:
-        return None
-
-    neighbours = graph.neighbors(current_node)
-    # Filter all the nodes so we only expand nodes at the opposite the
-    # end where we entered the section
-    if len(path) > 0:
-        entered_side = find_side_entered(graph, path[-1], current_node)
-        neighbours = filter_neighbours(graph, entered_side, current_node, neighbours)
-
-    # Base case 2, the goal node is in the list of neighbours, return
-    # success + the found path
-    if goal_node in neighbours:
-        return path + [current_node, goal_node]
-
-    # Recursive case, expand the neighbours
-    for neighbour in neighbours:
-        # Skip this neighbour if it is already in the path we traversed
-        if neighbour in path:
+    path.clear()
+    on_path.clear()
+    path.append(start)
+    on_path.add(start)
+    if start == goal:
+        return True, threshold
+
+    traversal = is_traversal_graph(graph)
+    next_threshold = math.inf
+    table = {}
+    # Every level of the stack holds the cost to reach the section at
+    # that level of the path, its neighbours and the next one to try
+    costs = [0.0]
+    children = [graph.neighbors(start)]
+    positions = [0]
+    while children:
+        depth = len(children) - 1
+        i = positions[depth]
+        if i == len(children[depth]):
+            # All neighbours are done, backtrack
+            children.pop()
+            positions.pop()
+            costs.pop()
+            on_path.discard(path.pop())
+            continue
+        positions[depth] = i + 1
+        child = children[depth][i]
+        if child in on_path:
             continue
 
-        ret = _iterdeep_rec(graph, neighbour, goal_node, max_depth, path + [current_node])
-        if ret is not None:
-            return ret
+        current = path[depth]
+        g = costs[depth] + graph.node_attributes(current)['length']
+        side = ENTERED_START if traversal else find_side_entered(graph, current, child)
+        f = g + heuristic.estimate(child, goal, side)
+        if f > threshold:
+            next_threshold = min(next_threshold, f)
+            continue
+        if child == goal:
+            path.append(child)
+            return True, threshold
+        if depth + 1 >= max_depth:
+            continue
+
+        if table_size:
+            key = (child, side)
+            seen = table.get(key)
+            if seen is not None and seen <= g:
+                continue
+            if seen is not None or len(table) < table_size:
+                table[key] = g
+
+        neighbours = graph.neighbors(child)
+        if not traversal:
+            neighbours = filter_neighbours(graph, side, child, neighbours)
+        path.append(child)
+        on_path.add(child)
+        costs.append(g)
+        children.append(neighbours)
+        positions.append(0)
+    return False, next_threshold
@@ -0,0 +1,279 @@
+import array
+import logging
+import math
+import struct
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from planners.common import shortest_distances
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b'MBLM'
+FILE_VERSION = 1
+_HEADER = struct.Struct('<4sHII')
+
+class LandmarkHeuristic:
+    def __init__(self, graph, *, base=None):
+        """Estimates h(n) using landmarks and the triangle inequality
+
+        A small set of landmark sections is picked and the distances
+        from and to every landmark are precomputed with build(). For any
+        landmark L the triangle inequality gives the lower bounds
+        d(n, goal) >= d(n, L) - d(goal, L) and d(n, goal) >=
+        d(L, goal) - d(L, n). The largest bound over all landmarks is
+        used as the estimate.
+
+        The distance tables are stored per section as compact arrays of
+        doubles. They can be saved next to a map with save() and loaded
+        again with load() so they only need to be built once.
+
+        Params:
+        graph - The graph that contains the sections
+        base - Another heuristic (e.g. CrowFliesHeuristic) to combine
+               with, the larger of both estimates is used
+        """
+        self.logger = logging.getLogger('.'.join((__name__, type(self).__name__)))
+        self.graph = graph
+        self.base = base
+        self.landmarks = []
+        self.sections = []
+        self.index = {}
+        self.forward = array.array('d')
+        self.backward = array.array('d')
+        self._goal = None
+
+    def build(self, count=8, *, landmarks=None):
+        """Selects landmarks and calculates the distance tables
+
+        Landmarks are selected farthest first: each new landmark is the
+        section that is farthest away from all previously selected
+        landmarks. Sections that none of the landmarks can reach are
+        considered farthest away, so every component of the graph gets
+        a landmark when there are enough of them.
+
+        Params:
+        count - The amount of landmarks to select
+        landmarks - Use these sections as landmarks instead of selecting
+                    them automatically
+        """
+        start_time = time.perf_counter()
+        self.sections = sorted(self.graph.nodes())
+        self.index = { section: i for i, section in enumerate(self.sections) }
+        self._goal = None
+        n = len(self.sections)
+
+        if landmarks is None:
+            landmarks = []
+            nearest = [math.inf] * n
+            candidate = self.sections[0] if n else None
+            tables = []
+            while candidate is not None and len(landmarks) < count:
+                landmarks.append(candidate)
+                forward = shortest_distances(self.graph, candidate)
+                backward = shortest_distances(self.graph, candidate, backward=True)
+                tables.append((forward, backward))
+                for section, d in forward.items():
+                    i = self.index[section]
+                    nearest[i] = min(nearest[i], d)
+                # Pick the section that is farthest from all landmarks
+                candidate, farthest = None, -1
+                for i, d in enumerate(nearest):
+                    if d > farthest and self.sections[i] not in landmarks:
+                        candidate, farthest = self.sections[i], d
+        else:
+            tables = [ (shortest_distances(self.graph, l),
+                        shortest_distances(self.graph, l, backward=True))
+                       for l in landmarks ]
+        self.landmarks = list(landmarks)
+
+        k = len(self.landmarks)
+        self.forward = array.array('d', [math.inf]) * (n * k)
+        self.backward = array.array('d', [math.inf]) * (n * k)
+        for j, (forward, backward) in enumerate(tables):
+            for section, d in forward.items():
+                self.forward[self.index[section]*k + j] = d
+            for section, d in backward.items():
+                self.backward[self.index[section]*k + j] = d
+        self.logger.info('Built landmark tables for %d sections and %d landmarks in %f sec',
+                         n, k, time.perf_counter() - start_time)
+
+    def estimate(self, section, goal, entered_side=None):
+        """Estimates the cost of travelling from a section to the goal
+
+        Params:
+        section - The section to calculate h(n) for
+        goal - The goal of the search
+        entered_side - The side from which section is entered, only
+                       used by the base heuristic
+        """
+        h = 0.0
+        if not self.landmarks:
+            return h if self.base is None else max(h, self.base.estimate(section, goal, entered_side))
+        goal_forward, goal_backward = self._goal_distances(goal)
+        k = len(self.landmarks)
+        i = self.index[section] * k
+        for j in range(k):
+            # d(L, goal) - d(L, section)
+            bound = goal_forward[j] - self.forward[i+j]
+            if bound > h and bound != math.inf:
+                h = bound
+            # d(section, L) - d(goal, L)
+            bound = self.backward[i+j] - goal_backward[j]
+            if bound > h and bound != math.inf:
+                h = bound
+        if self.base is not None:
+            h = max(h, self.base.estimate(section, goal, entered_side))
+        return h
+
+    def estimate_reverse(self, section, start, entered_side=None):
+        """Estimates the cost of travelling from the start to a section
+
+        Uses the bounds d(start, section) >= d(L, section) - d(L, start)
+        and d(start, section) >= d(start, L) - d(section, L), the
+        reverse of those of estimate(). Used by the backward search of
+        planners.bidirectional_search.
+
+        Params:
+        section - The section to calculate the estimate for
+        start - The start of the search
+        entered_side - The side from which section is entered, only
+                       used by the base heuristic
+        """
+        h = 0.0
+        if self.landmarks:
+            start_forward, start_backward = self._goal_distances(start)
+            k = len(self.landmarks)
+            i = self.index[section] * k
+            for j in range(k):
+                # d(L, section) - d(L, start)
+                bound = self.forward[i+j] - start_forward[j]
+                if bound > h and bound != math.inf:
+                    h = bound
+                # d(start, L) - d(section, L)
+                bound = start_backward[j] - self.backward[i+j]
+                if bound > h and bound != math.inf:
+                    h = bound
+        if self.base is not None:
+            h = max(h, self.base.estimate_reverse(section, start, entered_side))
+        return h
+
+    def estimate_many(self, sections, goal, entered_sides=None):
+        """Estimates the cost to the goal for a batch of sections
+
+        Params:
+        sections - The sections to calculate h(n) for
+        goal - The goal of the search
+        entered_sides - A sequence with the side every section is
+                        entered from, only used by the base heuristic
+        """
+        if np is None or len(sections) < 8 or not self.landmarks:
+            if entered_sides is None:
+                entered_sides = [None] * len(sections)
+            return [ self.estimate(s, goal, side) for s, side in zip(sections, entered_sides) ]
+
+        k = len(self.landmarks)
+        goal_forward, goal_backward = self._goal_distances(goal)
+        rows = np.array([ self.index[s] for s in sections ], dtype=np.intp)
+        forward = np.frombuffer(self.forward, dtype=float).reshape(-1, k)[rows]
+        backward = np.frombuffer(self.backward, dtype=float).reshape(-1, k)[rows]
+        with np.errstate(invalid='ignore'):
+            bounds = np.concatenate((np.array(goal_forward) - forward,
+                                     backward - np.array(goal_backward)), axis=1)
+        # Unreachable landmarks (inf - inf or inf - x) give no information
+        bounds[~np.isfinite(bounds)] = 0.0
+        h = bounds.max(axis=1, initial=0.0).tolist()
+        if self.base is not None:
+            h = [ max(a, b) for a, b in zip(h, self.base.estimate_many(sections, goal, entered_sides)) ]
+        return h
+
+    def invalidate(self, sections=None):
+        """Drops the distance tables after the graph changed
+
+        Any change to the graph can make distances shorter, after which
+        the tables no longer give lower bounds. Until build() is called
+        again only the base heuristic is used.
+
+        Params:
+        sections - The sections that changed, any change drops all tables
+        """
+        if self.landmarks:
+            self.logger.info('The graph changed, dropping the tables of %d landmarks', len(self.landmarks))
+        self.landmarks = []
+        self.sections = []
+        self.index = {}
+        self.forward = array.array('d')
+        self.backward = array.array('d')
+        self._goal = None
+
+    def save(self, filename):
+        """Writes the landmarks and distance tables to a file
+
+        Params:
+        filename - The file to write to, for example the name of the map
+                   with '.landmarks' appended to it
+        """
+        self.logger.info('Saving %d landmarks to %s', len(self.landmarks), filename)
+        names = '\n'.join(str(s) for s in self.sections).encode('utf-8')
+        landmarks = '\n'.join(str(l) for l in self.landmarks).encode('utf-8')
+        with open(filename, 'wb') as f:
+            f.write(_HEADER.pack(FILE_MAGIC, FILE_VERSION, len(self.sections), len(self.landmarks)))
+            f.write(struct.pack('<II', len(names), len(landmarks)))
+            f.write(names)
+            f.write(landmarks)
+            lengths = array.array('d', [ self.graph.node_attributes(s)['length'] for s in self.sections ])
+            lengths.tofile(f)
+            self.forward.tofile(f)
+            self.backward.tofile(f)
+
+    def load(self, filename):
+        """Reads the landmarks and distance tables from a file
+
+        Raises a ValueError when the file is not a landmark file or when
+        it was built for a graph with different sections or with
+        different section lengths, for example before apply_changes().
+
+        Params:
+        filename - The file that was written by save()
+        """
+        self.logger.info('Loading landmarks from %s', filename)
+        with open(filename, 'rb') as f:
+            magic, version, n, k = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != FILE_MAGIC or version != FILE_VERSION:
+                raise ValueError("{} is not a version {} landmark file".format(filename, FILE_VERSION))
+            names_size, landmarks_size = struct.unpack('<II', f.read(8))
+            names = f.read(names_size).decode('utf-8').split('\n') if n else []
+            landmarks = f.read(landmarks_size).decode('utf-8').split('\n') if k else []
+            lengths = array.array('d')
+            lengths.fromfile(f, n)
+            forward = array.array('d')
+            forward.fromfile(f, n * k)
+            backward = array.array('d')
+            backward.fromfile(f, n * k)
+
+        if sorted(str(s) for s in self.graph.nodes()) != names:
+            raise ValueError("The landmarks in {} were built for a different graph".format(filename))
+        # Map the stored names back to the section IDs used in the graph
+        ids = { str(s): s for s in self.graph.nodes() }
+        sections = [ ids[name] for name in names ]
+        for section, length in zip(sections, lengths):
+            if not math.isclose(self.graph.node_attributes(section)['length'], length, rel_tol=1e-9):
+                raise ValueError("The landmarks in {} were built for different section lengths".format(filename))
+        self.sections = sections
+        self.index = { section: i for i, section in enumerate(self.sections) }
+        self.landmarks = [ ids[name] for name in landmarks ]
+        self.forward = forward
+        self.backward = backward
+        self._goal = None
+
+    def _goal_distances(self, goal):
+        """Returns the distance tables of the goal, cached for the last goal"""
+        if self._goal is None or self._goal[0] != goal:
+            k = len(self.landmarks)
+            i = self.index[goal] * k
+            self._goal = (goal, self.forward[i:i+k].tolist(), self.backward[i:i+k].tolist())
+        return self._goal[1], self._goal[2]
@@ -0,0 +1,115 @@
+import array
+import logging
+import math
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from planners.common import dijkstra, is_traversal_graph
+from planners.astar import Astar, construct_path
+
+logger = logging.getLogger(__name__)
+
+class DistanceMatrix:
+    def __init__(self, graph, origins, targets, distances, *, trees=None,
+                 hierarchy=None):
+        """The route lengths between a set of origins and targets
+
+        Use distance_matrix() to create one. Distances are stored in a
+        flat array of doubles, row by row. Paths are only built when
+        path() is called.
+
+        Params:
+        graph - The graph the distances were calculated on
+        origins - The sections the routes start at
+        targets - The sections the routes end at
+        distances - The flat array with the distances
+        trees - The ancestors of the search from every origin, used to
+                reconstruct paths
+        hierarchy - The ContractionHierarchy used for the distances
+        """
+        self.graph = graph
+        self.origins = list(origins)
+        self.targets = list(targets)
+        self.distances = distances
+        self.trees = trees
+        self.hierarchy = hierarchy
+        self._origin_index = { o: i for i, o in enumerate(self.origins) }
+        self._target_index = { t: j for j, t in enumerate(self.targets) }
+
+    def distance(self, origin, target):
+        """Returns the route length from origin to target, inf if there is none"""
+        i = self._origin_index[origin]
+        j = self._target_index[target]
+        return self.distances[i * len(self.targets) + j]
+
+    def path(self, origin, target):
+        """Returns the route from origin to target as a list of sections
+
+        Returns None when the target can not be reached.
+        """
+        if self.distance(origin, target) == math.inf:
+            return None
+        if self.trees is not None:
+            return construct_path(self.trees[self._origin_index[origin]], target)
+        if self.hierarchy is not None:
+            return self.hierarchy.query(origin, target)
+        return Astar(self.graph, origin, target)
+
+    def rows(self):
+        """Returns the distances as a list of rows, one for every origin"""
+        columns = len(self.targets)
+        return [ self.distances[i*columns:(i+1)*columns].tolist() for i in range(len(self.origins)) ]
+
+    def to_numpy(self):
+        """Returns the distances as a 2D NumPy array without copying them"""
+        if np is None:
+            raise ImportError("NumPy is needed to convert a distance matrix to an array")
+        return np.frombuffer(self.distances, dtype=float).reshape(len(self.origins), len(self.targets))
+
+def distance_matrix(graph, origins, targets, *, hierarchy=None, keep_trees=True):
+    """Calculates the route lengths between all origins and targets
+
+    Without a hierarchy one Dijkstra search is run from every origin,
+    which stops once all targets are settled. With a hierarchy the
+    bucket based many to many algorithm of ContractionHierarchy is
+    used. Either way len(origins) searches replace the
+    len(origins) * len(targets) searches of planning every route.
+
+    Returns a DistanceMatrix.
+
+    Params:
+    graph - The graph to plan the routes in
+    origins - The sections the routes start at
+    targets - The sections the routes end at
+    hierarchy - A ContractionHierarchy that has been built for graph,
+                which must be a traversal graph
+    keep_trees - Keep the search trees of the Dijkstra searches so
+                 paths can be built without searching again
+    """
+    logger = logging.getLogger('.'.join((__name__, 'distance_matrix')))
+    logger.info('Calculating a %dx%d distance matrix', len(origins), len(targets))
+    start_time = time.perf_counter()
+
+    if hierarchy is not None and not is_traversal_graph(graph):
+        raise ValueError("A contraction hierarchy can only be used with a traversal graph")
+    if hierarchy is not None and hierarchy.graph is not graph:
+        raise ValueError("The contraction hierarchy was built for another graph")
+    if hierarchy is not None:
+        distances = hierarchy.distance_table(origins, targets)
+        matrix = DistanceMatrix(graph, origins, targets, distances, hierarchy=hierarchy)
+    else:
+        distances = array.array('d')
+        trees = [] if keep_trees else None
+        for origin in origins:
+            settled, ancestors = dijkstra(graph, origin, targets)
+            distances.extend(settled.get(target, math.inf) for target in targets)
+            if keep_trees:
+                trees.append(ancestors)
+        matrix = DistanceMatrix(graph, origins, targets, distances, trees=trees)
+
+    logger.info('Calculated the distance matrix in %f sec', time.perf_counter() - start_time)
+    return matrix
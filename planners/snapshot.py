@@ -0,0 +1,205 @@
+import array
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+import geodesic
+from planners.csr import CSRGraph
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b'MBGS'
+FILE_VERSION = 1
+# Magic, version, flags, sections, source size, source mtime in ns,
+# source SHA-256, bounds (min lat, max lat, min lon, max lon) and the
+# amount of blocks
+_HEADER = struct.Struct('<4sHHqqq32s4dI')
+# Offset and size in bytes of a block
+_BLOCK = struct.Struct('<qq')
+_FLAG_TRAVERSAL = 1
+_FLAG_BOUNDS = 2
+_FLAG_HAVERSINE = 4
+# Blocks start at a multiple of this so they can be cast in place
+_ALIGNMENT = 8
+
+# The CSRGraph arrays stored in a snapshot, in file order. The geometry
+# comes last so the part needed for planning is contiguous.
+_BLOCKS = [('offsets', 'q'), ('targets', 'q'), ('edge_flags', 'B'),
+           ('in_offsets', 'q'), ('sources', 'q'), ('length', 'd'),
+           ('start_node', 'q'), ('end_node', 'q'), ('way', 'q'),
+           ('start_lat', 'd'), ('start_lon', 'd'), ('end_lat', 'd'), ('end_lon', 'd'),
+           ('name_offsets', 'q'), ('name_data', 'B'), ('tag_data', 'B'),
+           ('path_offsets', 'q'), ('path_coords', 'd')]
+
+class StaleSnapshotError(ValueError):
+    """Raised when a snapshot was made from a different source file"""
+    pass
+
+class _NameTable:
+    def __init__(self, offsets, data):
+        """The section names of a snapshot, decoded when they are used
+
+        Params:
+        offsets - The offset of every name in data, plus the end
+        data - The UTF-8 encoded names
+        """
+        self.offsets = offsets
+        self.data = data
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return str(self.data[self.offsets[i]:self.offsets[i+1]], 'utf-8')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+def source_stamp(source, with_hash=True):
+    """Returns the size, mtime in ns and SHA-256 of a source file
+
+    Params:
+    source - The file a snapshot is made from, for example an OSM file
+    with_hash - Also hash the contents, otherwise the hash is empty
+    """
+    stat = os.stat(source)
+    digest = b''
+    if with_hash:
+        sha = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024*1024), b''):
+                sha.update(chunk)
+        digest = sha.digest()
+    return stat.st_size, stat.st_mtime_ns, digest
+
+def save_snapshot(graph, filename, source=None):
+    """Writes a CSRGraph to a binary snapshot file
+
+    The file starts with a header that describes the graph and the
+    source file it was made from, followed by a table with the offset
+    and size of every block. Every array of the graph is one block of
+    raw machine values, the names and way tags are encoded blobs and the
+    geometry is kept in the last two blocks.
+
+    Params:
+    graph - The CSRGraph to store
+    filename - The file to write to, for example the name of the map
+               with '.graph' appended to it
+    source - The file the graph was built from, which load_snapshot()
+             compares against to detect stale snapshots
+    """
+    logger.info('Saving a snapshot of %d sections to %s', len(graph), filename)
+    start_time = time.perf_counter()
+
+    names = [ str(name).encode('utf-8') for name in graph.names ]
+    name_offsets = array.array('q', [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+    tags = { str(way): tags for way, tags in graph.way_tags.items() }
+    data = dict((name, getattr(graph, name, None)) for name, typecode in _BLOCKS)
+    data['name_offsets'] = name_offsets
+    data['name_data'] = b''.join(names)
+    data['tag_data'] = json.dumps(tags, separators=(',', ':')).encode('utf-8')
+
+    size, mtime, digest = source_stamp(source) if source is not None else (-1, -1, b'')
+    flags = 0
+    if graph.traversal:
+        flags |= _FLAG_TRAVERSAL
+    if graph.distance_method == geodesic.HAVERSINE:
+        flags |= _FLAG_HAVERSINE
+    bounds = graph.bounds
+    if bounds is not None:
+        flags |= _FLAG_BOUNDS
+    else:
+        bounds = (0.0, 0.0, 0.0, 0.0)
+
+    position = _HEADER.size + _BLOCK.size * len(_BLOCKS)
+    table = []
+    for name, typecode in _BLOCKS:
+        position = _align(position)
+        nbytes = memoryview(data[name]).nbytes
+        table.append((position, nbytes))
+        position += nbytes
+
+    with open(filename, 'wb') as f:
+        f.write(_HEADER.pack(FILE_MAGIC, FILE_VERSION, flags, len(graph), size, mtime,
+                             digest, *bounds, len(_BLOCKS)))
+        for offset, nbytes in table:
+            f.write(_BLOCK.pack(offset, nbytes))
+        for (name, typecode), (offset, nbytes) in zip(_BLOCKS, table):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(data[name])
+    logger.info('Saved the snapshot in %f sec', time.perf_counter() - start_time)
+
+def load_snapshot(filename, source=None, verify_hash=False):
+    """Memory maps a snapshot written by save_snapshot() as a CSRGraph
+
+    The arrays of the graph are read-only views on the mapped file, so
+    loading takes the same time for any size of graph and processes
+    that load the same snapshot share its pages. Names are decoded and
+    the index of names is built when they are first used.
+
+    Raises StaleSnapshotError when source differs from the file the
+    snapshot was made from, ValueError when the file is not a snapshot.
+
+    Params:
+    filename - The snapshot file
+    source - The file the graph should have been built from, not
+             checked when None
+    verify_hash - Compare the contents of source instead of only its
+                  size and modification time
+    """
+    start_time = time.perf_counter()
+    with open(filename, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buffer)
+    if len(view) < _HEADER.size:
+        raise ValueError("{} is not a version {} graph snapshot".format(filename, FILE_VERSION))
+    magic, version, flags, sections, size, mtime, digest, min_lat, max_lat, min_lon, max_lon, \
+        block_count = _HEADER.unpack_from(view)
+    if magic != FILE_MAGIC or version != FILE_VERSION or block_count != len(_BLOCKS):
+        raise ValueError("{} is not a version {} graph snapshot".format(filename, FILE_VERSION))
+
+    if source is not None:
+        stamp = source_stamp(source, verify_hash)
+        if stamp[0] != size or (verify_hash and stamp[2] != digest) or \
+                (not verify_hash and stamp[1] != mtime):
+            raise StaleSnapshotError("The snapshot {} was not made from the current {}".format(filename, source))
+
+    blocks = {}
+    for i, (name, typecode) in enumerate(_BLOCKS):
+        offset, nbytes = _BLOCK.unpack_from(view, _HEADER.size + i * _BLOCK.size)
+        if offset + nbytes > len(view):
+            raise ValueError("The snapshot {} is truncated".format(filename))
+        blocks[name] = view[offset:offset+nbytes].cast(typecode)
+
+    graph = CSRGraph()
+    for name, typecode in _BLOCKS:
+        if hasattr(graph, name):
+            setattr(graph, name, blocks[name])
+    if len(graph.length) != sections:
+        raise ValueError("The snapshot {} is corrupt".format(filename))
+    graph.traversal = bool(flags & _FLAG_TRAVERSAL)
+    if flags & _FLAG_HAVERSINE:
+        graph.distance_method = geodesic.HAVERSINE
+    if flags & _FLAG_BOUNDS:
+        graph.bounds = (min_lat, max_lat, min_lon, max_lon)
+    graph.names = _NameTable(blocks['name_offsets'], blocks['name_data'])
+    graph._load_way_tags = lambda: { int(way): tags for way, tags in
+                                     json.loads(str(blocks['tag_data'], 'utf-8')).items() }
+    graph.snapshot = filename
+    graph._buffer = buffer
+    logger.info('Mapped the snapshot %s with %d sections in %f sec', filename, sections,
+                time.perf_counter() - start_time)
+    return graph
+
+def _align(position):
+    """Rounds a file position up to the next block boundary"""
+    return (position + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
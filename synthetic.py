@@ -0,0 +1,173 @@
+"""Generators of synthetic OSM maps for benchmarks
+
+Every generator writes an OSM XML file with nodes and highways around
+(53.0, 6.0) and takes a size, so maps of increasing size can be used to
+measure how the readers, the graph builder, the planners and the
+exporters scale. The same size and seed always give the same file.
+
+grid - A jittered size x size grid of streets split into ways of 2 to
+       6 blocks, some of them footways or oneway.
+radial - A city of size rings around a centre, connected by 2 * size
+         spokes. The inner ring is a roundabout.
+random - A random planar graph: a jittered size x size lattice of which
+         some edges are dropped and some cells get one diagonal.
+"""
+import logging
+import math
+import random
+
+logger = logging.getLogger(__name__)
+
+# The centre of the generated maps
+ORIGIN = (53.0, 6.0)
+# The distance in metres between neighbouring nodes
+SPACING = 100.0
+_METRES_PER_DEGREE = 111320.0
+
+def grid_map(filename, size, seed=0):
+    """Writes a grid of size x size nodes to an OSM file
+
+    Params:
+    filename - The file to write
+    size - The amount of nodes along each side
+    seed - The seed of the random generator
+    """
+    rng = random.Random(seed)
+    nodes = []
+    ids = {}
+    for i in range(size):
+        for j in range(size):
+            ids[i, j] = len(nodes) + 1
+            nodes.append((ids[i, j],) + _position(i + rng.uniform(-0.2, 0.2), j + rng.uniform(-0.2, 0.2)))
+
+    ways = []
+    for line in range(size):
+        for refs in (_split_line([ ids[line, k] for k in range(size) ], rng),
+                     _split_line([ ids[k, line] for k in range(size) ], rng)):
+            for piece in refs:
+                ways.append((len(ways) + 1, piece, _random_tags(rng)))
+    _write_osm(filename, nodes, ways)
+    return filename
+
+def radial_map(filename, size, seed=0):
+    """Writes a city of size rings and 2 * size spokes to an OSM file
+
+    Params:
+    filename - The file to write
+    size - The amount of rings around the centre
+    seed - The seed of the random generator
+    """
+    rng = random.Random(seed)
+    spokes = max(4, 2 * size)
+    nodes = [(1,) + _position(0, 0)]
+    ids = {}
+    for ring in range(1, size + 1):
+        for spoke in range(spokes):
+            angle = 2 * math.pi * (spoke + rng.uniform(-0.1, 0.1)) / spokes
+            radius = ring + rng.uniform(-0.1, 0.1)
+            ids[ring, spoke] = len(nodes) + 1
+            nodes.append((ids[ring, spoke],) + _position(radius * math.sin(angle), radius * math.cos(angle)))
+
+    ways = []
+    for ring in range(1, size + 1):
+        refs = [ ids[ring, spoke] for spoke in range(spokes) ] + [ids[ring, 0]]
+        if ring == 1:
+            tags = {'highway': 'primary', 'junction': 'roundabout'}
+        else:
+            tags = {'highway': 'secondary' if ring % 4 == 0 else 'residential'}
+        ways.append((len(ways) + 1, refs, tags))
+    for spoke in range(spokes):
+        refs = [ ids[ring, spoke] for ring in range(1, size + 1) ]
+        if spoke % 2 == 0:
+            refs.insert(0, 1)
+        for piece in _split_line(refs, rng):
+            ways.append((len(ways) + 1, piece, _random_tags(rng)))
+    _write_osm(filename, nodes, ways)
+    return filename
+
+def random_planar_map(filename, size, seed=0):
+    """Writes a random planar graph based on a size x size lattice
+
+    Every way is a single edge of the lattice or a diagonal of a cell,
+    no two of them cross.
+
+    Params:
+    filename - The file to write
+    size - The amount of nodes along each side of the lattice
+    seed - The seed of the random generator
+    """
+    rng = random.Random(seed)
+    nodes = []
+    ids = {}
+    for i in range(size):
+        for j in range(size):
+            ids[i, j] = len(nodes) + 1
+            nodes.append((ids[i, j],) + _position(i + rng.uniform(-0.3, 0.3), j + rng.uniform(-0.3, 0.3)))
+
+    edges = []
+    for i in range(size):
+        for j in range(size):
+            if j + 1 < size and rng.random() < 0.8:
+                edges.append((ids[i, j], ids[i, j+1]))
+            if i + 1 < size and rng.random() < 0.8:
+                edges.append((ids[i, j], ids[i+1, j]))
+            if i + 1 < size and j + 1 < size and rng.random() < 0.3:
+                if rng.random() < 0.5:
+                    edges.append((ids[i, j], ids[i+1, j+1]))
+                else:
+                    edges.append((ids[i+1, j], ids[i, j+1]))
+    ways = [ (i + 1, list(edge), _random_tags(rng)) for i, edge in enumerate(edges) ]
+    _write_osm(filename, nodes, ways)
+    return filename
+
+# The generators by name, all called as generator(filename, size, seed)
+GENERATORS = {'grid': grid_map, 'radial': radial_map, 'random': random_planar_map}
+
+def _position(north, east):
+    """Converts a position in units of SPACING from ORIGIN to (lat, lon)"""
+    lat = ORIGIN[0] + north * SPACING / _METRES_PER_DEGREE
+    lon = ORIGIN[1] + east * SPACING / (_METRES_PER_DEGREE * math.cos(math.radians(ORIGIN[0])))
+    return lat, lon
+
+def _split_line(refs, rng):
+    """Splits a line of nodes into ways of 2 to 6 edges"""
+    pieces = []
+    start = 0
+    while start < len(refs) - 1:
+        end = min(len(refs) - 1, start + rng.randint(2, 6))
+        pieces.append(refs[start:end+1])
+        start = end
+    return pieces
+
+def _random_tags(rng):
+    """Returns the tags of a random highway, some can't be used by cars"""
+    tags = {'highway': rng.choice(('residential', 'residential', 'tertiary', 'primary', 'footway'))}
+    if tags['highway'] != 'footway' and rng.random() < 0.1:
+        tags['oneway'] = 'yes'
+    return tags
+
+def _write_osm(filename, nodes, ways):
+    """Writes nodes and ways to an OSM XML file
+
+    Params:
+    filename - The file to write
+    nodes - (id, lat, lon) tuples
+    ways - (id, node ids, tags) tuples
+    """
+    lats = [ lat for id, lat, lon in nodes ]
+    lons = [ lon for id, lat, lon in nodes ]
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="mapbots synthetic">\n')
+        f.write(' <bounds minlat="{:.7f}" minlon="{:.7f}" maxlat="{:.7f}" maxlon="{:.7f}"/>\n'.format(
+                min(lats), min(lons), max(lats), max(lons)))
+        for id, lat, lon in nodes:
+            f.write(' <node id="{}" lat="{:.7f}" lon="{:.7f}"/>\n'.format(id, lat, lon))
+        for id, refs, tags in ways:
+            f.write(' <way id="{}">\n'.format(id))
+            for ref in refs:
+                f.write('  <nd ref="{}"/>\n'.format(ref))
+            for key, value in sorted(tags.items()):
+                f.write('  <tag k="{}" v="{}"/>\n'.format(key, value))
+            f.write(' </way>\n')
+        f.write('</osm>\n')
+    logger.info("Wrote %d nodes and %d ways to %s", len(nodes), len(ways), filename)